@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Compare benchmark results against a stored baseline.
+
+Results are pytest-benchmark json files (--benchmark-json) or baseline files
+({'machine': ..., 'benchmarks': {name: median_s}}). A benchmark regresses
+when its median is more than threshold (fraction) slower than the baseline.
+
+    $ python benchmarks/baseline.py results.json [--baseline baseline.json]
+      [--threshold 0.25] [--save]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+THRESHOLD = 0.25
+
+
+def machine_info():
+    return {'node': platform.node(), 'machine': platform.machine(),
+            'system': platform.system(),
+            'python': platform.python_version()}
+
+
+def load(path):
+    """{name: median_s} from a baseline or a pytest-benchmark json file"""
+    with open(path) as res_file:
+        data = json.load(res_file)
+    benchmarks = data.get('benchmarks', {})
+    if isinstance(benchmarks, list):
+        return {bench['name']: bench['stats']['median']
+                for bench in benchmarks}
+    return dict(benchmarks)
+
+
+def save(results, path=BASELINE):
+    with open(path, 'w') as base_file:
+        json.dump({'machine': machine_info(),
+                   'benchmarks': dict(sorted(results.items()))},
+                  base_file, indent=2)
+        base_file.write('\n')
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Returns (rows, regressions), rows are (name, baseline_s, median_s,
+    change) with change = median / baseline - 1 (None if not in baseline).
+    """
+    rows = []
+    regressions = []
+    for name, median in sorted(results.items()):
+        base = baseline.get(name)
+        change = median / base - 1 if base else None
+        rows.append((name, base, median, change))
+        if change is not None and change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def report(rows, regressions, threshold=THRESHOLD):
+    lines = ['{:<44} {:>12} {:>12} {:>9}'.format(
+        'benchmark', 'baseline(ms)', 'median(ms)', 'change')]
+    for name, base, median, change in rows:
+        lines.append('{:<44} {:>12} {:>12.3f} {:>9}{}'.format(
+            name, '-' if base is None else '{:.3f}'.format(base * 1e3),
+            median * 1e3, '-' if change is None else '{:+.1%}'.format(change),
+            '  REGRESSION' if name in regressions else ''))
+    if regressions:
+        lines.append('{} benchmark(s) slower than baseline by more than '
+                     '{:.0%}'.format(len(regressions), threshold))
+    return '\n'.join(lines)
+
+
+def main(results_path, baseline_path, threshold, save_baseline):
+    results = load(results_path)
+    if save_baseline:
+        save(results, baseline_path)
+        print('Baseline saved: {}'.format(baseline_path))
+        return 0
+    if not os.path.exists(baseline_path):
+        print('No baseline at {}, use --save'.format(baseline_path))
+        return 0
+    rows, regressions = compare(results, load(baseline_path), threshold)
+    print(report(rows, regressions, threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('results', help='pytest-benchmark json results')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='allowed slowdown (fraction of baseline)')
+    parser.add_argument('--save', action='store_true',
+                        help='store results as the new baseline')
+    args = parser.parse_args()
+    sys.exit(main(args.results, args.baseline, args.threshold, args.save))
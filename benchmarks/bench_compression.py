@@ -0,0 +1,82 @@
+"""
+Effective put/get throughput (file size / elapsed) with and without deflate
+compression, against simulators with modeled links (same rates as
+transfer_throughput.py). A Python module (compressible text) is sent:
+
+    $ pytest benchmarks -k compression
+"""
+import asyncio
+import pytest
+from upydevice import SerialDevice, WebSocketDevice
+from upydevice.simulator import (SerialSimulator, WebREPLSimulator,
+                                 BleSimulator)
+
+SIZE = 8192
+# bytes/s, latency per write (s)
+LINKS = {'serial': (11520, 0.001),
+         'ws': (500000, 0.004),
+         'ble': (12000, 0.015)}
+
+
+@pytest.fixture(scope='module')
+def module_file(tmp_path_factory):
+    root = tmp_path_factory.mktemp('compression')
+    line = "    sensor.read(addr=0x{:02x}, timeout=100)  # poll\n"
+    text = ''.join(line.format(i % 256) for i in range(SIZE))[:SIZE]
+    path = root / 'sensors.py'
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.fixture(scope='module', params=list(LINKS))
+def device(request, tmp_path_factory):
+    rate, latency = LINKS[request.param]
+    root = str(tmp_path_factory.mktemp(request.param))
+    if request.param == 'serial':
+        with SerialSimulator(root=root, bandwidth=rate,
+                             latency=latency) as sim:
+            dev = SerialDevice(sim.port, init=True)
+            yield dev
+            dev.disconnect()
+    elif request.param == 'ws':
+        with WebREPLSimulator(password='bench', root=root, bandwidth=rate,
+                              latency=latency) as sim:
+            dev = WebSocketDevice(sim.address, 'bench', init=True)
+            yield dev
+            dev.disconnect()
+    else:
+        from upydevice.bledevice import BleDevice
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        sim = BleSimulator(root=root, bandwidth=rate, latency=latency)
+        with sim.patch():
+            dev = BleDevice(sim.address, init=True)
+            yield dev
+            dev.disconnect()
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def _throughput(benchmark, transfer):
+    result = benchmark.pedantic(transfer, rounds=2)
+    benchmark.extra_info['throughput(kB/s)'] = round(
+        SIZE / benchmark.stats.stats.median / 1e3, 2)
+    benchmark.extra_info['sent(B)'] = result.sent
+    return result
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_put_compression(benchmark, device, module_file, compress):
+    result = _throughput(benchmark, lambda: device.put(
+        module_file, 'sensors.py', compress=compress))
+    assert result.verified
+    assert (result.sent < SIZE / 4) == compress
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_get_compression(benchmark, device, module_file, compress):
+    device.put(module_file, 'sensors.py')
+    result = _throughput(benchmark, lambda: device.get(
+        'sensors.py', module_file + '.copy', compress=compress))
+    assert result.verified
+    assert (result.sent < SIZE / 4) == compress
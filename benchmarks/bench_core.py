@@ -0,0 +1,141 @@
+"""
+Core device operations against local simulators (see conftest.py).
+
+    $ pytest benchmarks [-k serial] [--benchmark-json=results.json]
+"""
+import socket
+import struct
+import pytest
+from types import SimpleNamespace
+from upydevice import AsyncDeviceGroup
+from upydevice.decorators import PhantomCall
+from upydevice.output import OutputPipeline
+from upydevice.phantom import STREAMER, Pin
+from upydevice.wsprotocol import Websocket, OP_BYTES, OP_TEXT
+from upydevice.wsclient import WebsocketClient
+
+_FUNC = '\n'.join(['def bench_func(x):'] +
+                  ['    y{0} = x + {0}'.format(i) for i in range(8)] +
+                  ['    return x'])
+
+
+# WR_CMD ROUND TRIP
+
+@pytest.mark.parametrize('transport', ['serial', 'ws', 'ble'])
+def test_wr_cmd(benchmark, request, transport):
+    dev = request.getfixturevalue('{}_dev'.format(transport))
+    result = benchmark(dev.wr_cmd, '1+1', silent=True, rtn_resp=True)
+    assert result == 2
+
+
+def test_repl_exec_serial(benchmark, serial_dev):
+    # no fixed waits (transfer path)
+    assert benchmark(serial_dev._repl_exec, '1+1') == 2
+
+
+# PASTE
+
+@pytest.mark.parametrize('transport', ['serial', 'ws'])
+def test_paste_define(benchmark, request, transport):
+    dev = request.getfixturevalue('{}_dev'.format(transport))
+    benchmark.pedantic(dev.code_cache.define, args=('bench_func', _FUNC),
+                       kwargs={'force': True}, rounds=3)
+    assert dev.wr_cmd('bench_func(2)', silent=True, rtn_resp=True) == 2
+
+
+# OUTPUT PARSING
+
+@pytest.mark.parametrize('response', [
+    '[0.12, 3.4, -5.6, 7.8, 9.0, 1.2, 3.4, 5.6]',
+    "{'temp': 21.5, 'hum': 48, 'name': 'sensor'}",
+    "bytearray(b'\\x01\\x02\\x03\\x04\\x05\\x06')",
+    'not a literal'], ids=['list', 'dict', 'bytearray', 'str'])
+def test_get_output(benchmark, serial_dev, response):
+    def parse():
+        serial_dev.response = response
+        serial_dev.output = None
+        serial_dev.get_output()
+    benchmark(parse)
+
+
+# WEBSOCKET FRAMES
+
+@pytest.fixture
+def ws_pair():
+    client_sock, server_sock = socket.socketpair()
+    yield WebsocketClient(client_sock), Websocket(server_sock)
+    client_sock.close()
+    server_sock.close()
+
+
+@pytest.mark.parametrize('size', [64, 1024])
+def test_ws_frame_roundtrip(benchmark, ws_pair, size):
+    client, server = ws_pair
+    payload = bytes(range(256)) * (size // 256) or b'x' * size
+
+    def roundtrip():
+        # masked client frame + unmasked server reply
+        client.write_frame(OP_BYTES, payload)
+        server.reset_buffers()
+        fin, opcode, data = server.read_frame()
+        server.write_frame(OP_TEXT, data)
+        client.reset_buffers()
+        return client.read_frame()[2]
+    assert benchmark(roundtrip) == payload
+
+
+# FOLLOW
+
+def test_follow_lines(benchmark, serial_dev):
+    lines = []
+    pipe = OutputPipeline(lambda text, std: lines.append(text), block=True)
+
+    def follow():
+        serial_dev.wr_cmd("print('\\n'.join(map(str, range(200))))",
+                          follow=True, pipe=pipe)
+        pipe.queue.join()
+    benchmark.pedantic(follow, rounds=5)
+    assert '199' in ''.join(lines)
+
+
+# STREAMER
+
+def test_streamer_decode(benchmark):
+    n_chunks = 100
+    stream = STREAMER(SimpleNamespace(output=None), 'stream',
+                      chunk_buffer_size=20)
+    tx_sock, rx_sock = socket.socketpair()
+    stream.soc = SimpleNamespace(conn=rx_sock)
+    chunk = struct.pack('f' * 20, *range(20))
+
+    def decode():
+        tx_sock.sendall(chunk * n_chunks)
+        return [stream.soc_recv_chunk_message() for i in range(n_chunks)]
+    chunks = benchmark(decode)
+    tx_sock.close()
+    rx_sock.close()
+    assert chunks[-1] == tuple(float(v) for v in range(20))
+
+
+# DEVICE GROUP FAN-OUT
+
+def test_group_cmd(benchmark, group):
+    benchmark.pedantic(group.cmd, args=('1+1',),
+                       kwargs={'group_silent': True, 'dev_silent': True},
+                       rounds=3)
+    assert set(group.output.values()) == {2}
+
+
+def test_async_group_cmd(benchmark, group_devs):
+    group = AsyncDeviceGroup(group_devs, name='bench_async')
+    benchmark(group.cmd_async, '1+1')
+    assert set(group.output.values()) == {2}
+
+
+# PHANTOM
+
+def test_phantom_build(benchmark):
+    dev = SimpleNamespace(output=None, cmd=None, wr_cmd=None)
+    led = Pin(dev, 'led')
+    call = PhantomCall(Pin.value.__wrapped__)
+    benchmark(call.build, (led, 1), {})
@@ -0,0 +1,16 @@
+"""
+Import time of upydevice entry points (fresh interpreter per round, includes
+interpreter startup), see import_time.py for a per module breakdown.
+
+    $ pytest benchmarks -k import
+"""
+import subprocess
+import sys
+import pytest
+from import_time import STATEMENTS
+
+
+@pytest.mark.parametrize('stmt', STATEMENTS)
+def test_import(benchmark, stmt):
+    benchmark.pedantic(subprocess.run, args=([sys.executable, '-c', stmt],),
+                       kwargs={'check': True}, rounds=5)
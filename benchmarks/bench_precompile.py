@@ -0,0 +1,43 @@
+"""
+Code definition deploy time (dev.code_cache.define of a large function)
+pasted as source vs uploaded as .mpy compiled on the host, repeated deploys
+(new boot session) against a serial simulator with a modeled link. mpy-cross
+is used if installed, else the simulator stand-in:
+
+    $ pytest benchmarks -k precompile
+"""
+import pytest
+from upydevice import SerialDevice
+from upydevice.precompile import MpyCache
+from upydevice.simulator import SerialSimulator, MpyCrossSimulator
+
+# bytes/s, latency per write (s), as transfer_throughput.py
+RATE, LATENCY = 11520, 0.001
+SOURCE = 'def big(x):\n{}    return a199\n'.format(
+    ''.join('    a{0} = x * {0} + {0}\n'.format(i) for i in range(200)))
+
+
+@pytest.fixture(scope='module')
+def device(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('precompile'))
+    with SerialSimulator(root=root, bandwidth=RATE, latency=LATENCY) as sim:
+        dev = SerialDevice(sim.port, init=True)
+        dev.precompile.cache = MpyCache(str(tmp_path_factory.mktemp('mpy')))
+        if not dev.precompile.use(True):
+            dev.precompile.compiler = MpyCrossSimulator()
+        yield dev
+        dev.disconnect()
+
+
+@pytest.mark.parametrize('precompile', [False, True])
+def test_define_precompile(benchmark, device, precompile):
+    device.precompile.enabled = precompile
+
+    def deploy():
+        # as after a reboot: not registered in the device
+        device.code_cache.clear()
+        device.code_cache.define('big', SOURCE, force=True)
+    benchmark.pedantic(deploy, rounds=3, warmup_rounds=1)
+    benchmark.extra_info['mpy-cross'] = not isinstance(
+        device.precompile.compiler, MpyCrossSimulator)
+    assert device.wr_cmd('big(1)', silent=True, rtn_resp=True) == 398
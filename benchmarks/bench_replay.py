@@ -0,0 +1,118 @@
+"""
+Host side parsing and framing paths (read_frame, follow_output,
+read_callback_follow, get_output) replaying recorded sessions as fast as
+possible, no device latency involved.
+
+Sessions are recorded from the simulators, a trace recorded from a real
+board (TraceRecorder) can be used instead:
+
+    $ pytest benchmarks -k replay [--replay-trace=session.upyt]
+"""
+import asyncio
+import pytest
+from upydevice import SerialDevice, WebSocketDevice
+from upydevice.replay import TraceRecorder, TracePlayer, load_trace
+from upydevice.simulator import (SerialSimulator, WebREPLSimulator,
+                                 BleSimulator)
+
+# (cmd, follow)
+SESSION = [('x = [i * 0.5 for i in range(64)]', False),
+           ('x', False),
+           ("{'temp': 21.5, 'hum': 48, 'name': 'sensor'}", False),
+           ("bytearray(b'\\x01\\x02\\x03\\x04')", False),
+           ("print('\\n'.join(map(str, range(100))))", True)]
+
+
+def _session(dev_class):
+    if dev_class == 'WebSocketDevice':
+        # follow mode of multi frame output stalls on the WebREPL simulator
+        return [(cmd, follow) for cmd, follow in SESSION if not follow]
+    return SESSION
+
+
+def _run(dev, session):
+    for cmd, follow in session:
+        dev.wr_cmd(cmd, silent=True, follow=follow)
+
+
+def _ble_device(sim):
+    from upydevice.bledevice import BleDevice
+    return BleDevice(sim.address, init=True)
+
+
+_TRANSPORTS = {
+    'WebSocketDevice': (lambda repl: WebREPLSimulator(password='bench',
+                                                      repl=repl).start(),
+                        lambda sim: WebSocketDevice(sim.address, 'bench',
+                                                    init=True)),
+    'BleDevice': (lambda repl: BleSimulator(repl=repl), _ble_device),
+    'SerialDevice': (lambda repl: SerialSimulator(repl=repl).start(),
+                     lambda sim: SerialDevice(sim.port, init=True))}
+
+
+def _record(dev_class):
+    new_sim, new_dev = _TRANSPORTS[dev_class]
+    sim = new_sim(None)
+    with _patched(sim):
+        dev = new_dev(sim)
+        with TraceRecorder(dev) as rec:
+            _run(dev, _session(dev_class))
+        dev.disconnect()
+    _stop(sim)
+    return rec.trace
+
+
+class _patched:
+    # BleSimulator mock Bleak clients
+    def __init__(self, sim):
+        self.patch = sim.patch() if isinstance(sim, BleSimulator) else None
+
+    def __enter__(self):
+        if self.patch is not None:
+            self.patch.__enter__()
+
+    def __exit__(self, *args):
+        if self.patch is not None:
+            self.patch.__exit__(*args)
+
+
+def _stop(sim):
+    if not isinstance(sim, BleSimulator):
+        sim.stop()
+
+
+@pytest.fixture(scope='module', params=['WebSocketDevice', 'BleDevice'])
+def replay(request):
+    path = request.config.getoption('--replay-trace')
+    # BleDevice runs on the event loop current when it is created
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    if path:
+        trace = load_trace(path)
+        if trace.meta['dev_class'] != request.param:
+            pytest.skip('trace is from a {}'.format(trace.meta['dev_class']))
+        player = TracePlayer(trace, speed=None)
+        session = [(cmd, False) for cmd in player.commands()]
+    else:
+        player = TracePlayer(_record(request.param), speed=None)
+        session = _session(request.param)
+    new_sim, new_dev = _TRANSPORTS[request.param]
+    sim = new_sim(player)
+    with _patched(sim):
+        dev = new_dev(sim)
+        yield dev, player, session
+        dev.disconnect()
+    _stop(sim)
+    player.close()
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def test_replay_session(benchmark, replay):
+    dev, player, session = replay
+
+    def play():
+        with player:
+            _run(dev, session)
+    benchmark.pedantic(play, rounds=10)
+    assert player.n_reads > 0
@@ -0,0 +1,41 @@
+"""
+Binary RPC agent round trips and channels (dev.rpc) against the local
+simulators, compare with test_wr_cmd in bench_core.py (REPL scraping):
+
+    $ pytest benchmarks -k "rpc or wr_cmd"
+"""
+import pytest
+
+N_PIPELINED = 32
+VALUE = {'temp': [21.5] * 8, 'name': 'sensor', 'raw': b'\x01\x02' * 16}
+
+
+@pytest.fixture(params=['serial', 'ws', 'ble'])
+def rpc(request):
+    dev = request.getfixturevalue('{}_dev'.format(request.param))
+    with dev.rpc:
+        yield dev.rpc
+
+
+def test_rpc_call(benchmark, rpc):
+    assert benchmark(rpc.call, 'pow', 1, 1) == 1
+
+
+def test_rpc_call_typed(benchmark, rpc):
+    assert benchmark(rpc.call, 'dict', VALUE) == VALUE
+
+
+def test_rpc_pipelined(benchmark, rpc):
+    def pipelined():
+        calls = [rpc.call_async('pow', i, 2) for i in range(N_PIPELINED)]
+        return [call.result() for call in calls]
+    assert benchmark(pipelined)[-1] == (N_PIPELINED - 1) ** 2
+
+
+def test_rpc_channel(benchmark, rpc):
+    # generator items streamed on a channel while a command is sent
+    def channel():
+        items = rpc.open_channel('range', N_PIPELINED * 8)
+        assert rpc.call('pow', 2, 2) == 4
+        return list(items)
+    assert len(benchmark(channel)) == N_PIPELINED * 8
@@ -0,0 +1,128 @@
+"""
+Benchmark suite fixtures: devices connected to local simulators (pty serial,
+loopback WebREPL server, mocked Bleak) and baseline comparison.
+Requires pytest-benchmark (pip install upydevice[bench]).
+
+    $ pytest benchmarks --benchmark-json=results.json
+    $ pytest benchmarks --save-baseline        # store medians as baseline
+    $ pytest benchmarks --baseline=other.json --regression-threshold=0.25
+
+The run fails if a benchmark median is slower than the baseline
+(benchmarks/baseline.json) by more than the threshold.
+"""
+import asyncio
+import os
+import pytest
+from upydevice import SerialDevice, WebSocketDevice, DeviceGroup
+from upydevice.simulator import (SerialSimulator, WebREPLSimulator,
+                                 BleSimulator)
+import baseline
+
+N_GROUP_DEVS = 4
+
+# test name: median (s) of the benchmarks run in this session
+_RESULTS = {}
+
+
+def pytest_addoption(parser):
+    parser.addoption('--baseline', action='store', default=baseline.BASELINE,
+                     help='baseline json file to compare with')
+    parser.addoption('--save-baseline', action='store_true', default=False,
+                     help='store this run medians as the baseline')
+    parser.addoption('--regression-threshold', action='store', type=float,
+                     default=baseline.THRESHOLD,
+                     help='allowed slowdown vs baseline (fraction)')
+    parser.addoption('--replay-trace', action='store', default=None,
+                     help='trace file replayed by bench_replay.py')
+
+
+@pytest.fixture(autouse=True)
+def _record_median(request):
+    yield
+    bench = request.node.funcargs.get('benchmark')
+    if bench is not None and bench.stats is not None:
+        _RESULTS[request.node.name] = bench.stats.stats.median
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    config._upyd_report = None
+    if not _RESULTS:
+        return
+    path = config.getoption('--baseline')
+    if config.getoption('--save-baseline'):
+        base = {}
+        if os.path.exists(path):
+            base = baseline.load(path)
+        base.update(_RESULTS)
+        baseline.save(base, path)
+        config._upyd_report = 'Baseline saved: {}'.format(path)
+        return
+    if not os.path.exists(path):
+        return
+    threshold = config.getoption('--regression-threshold')
+    rows, regressions = baseline.compare(_RESULTS, baseline.load(path),
+                                         threshold)
+    config._upyd_report = baseline.report(rows, regressions, threshold)
+    if regressions:
+        session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    report = getattr(config, '_upyd_report', None)
+    if report:
+        terminalreporter.section('baseline comparison')
+        terminalreporter.write_line(report)
+
+
+# DEVICES
+
+@pytest.fixture(scope='session')
+def serial_sim():
+    with SerialSimulator() as sim:
+        yield sim
+
+
+@pytest.fixture(scope='session')
+def serial_dev(serial_sim):
+    dev = SerialDevice(serial_sim.port, init=True)
+    yield dev
+    dev.disconnect()
+
+
+@pytest.fixture(scope='session')
+def ws_dev():
+    with WebREPLSimulator(password='bench') as sim:
+        dev = WebSocketDevice(sim.address, 'bench', init=True)
+        yield dev
+        dev.disconnect()
+
+
+@pytest.fixture(scope='session')
+def ble_dev():
+    from upydevice.bledevice import BleDevice
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sim = BleSimulator()
+    with sim.patch():
+        dev = BleDevice(sim.address, init=True)
+        yield dev
+        dev.disconnect()
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+@pytest.fixture(scope='session')
+def group_devs():
+    sims = [SerialSimulator().start() for i in range(N_GROUP_DEVS)]
+    devs = [SerialDevice(sim.port, init=True, name='sim{}'.format(i))
+            for i, sim in enumerate(sims)]
+    yield devs
+    for dev, sim in zip(devs, sims):
+        dev.disconnect()
+        sim.stop()
+
+
+@pytest.fixture(scope='session')
+def group(group_devs):
+    return DeviceGroup(group_devs, name='bench')
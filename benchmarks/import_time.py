@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Import time of upydevice entry points, from `python -X importtime`.
+
+Each statement runs in a fresh interpreter; the reported time is the median
+cumulative import time (ms) of the top level modules it imports, without
+interpreter startup.
+
+    $ python benchmarks/import_time.py [-n 10] [--top 10]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+STATEMENTS = ['import upydevice',
+              'from upydevice import Device',
+              'from upydevice import WebSocketDevice',
+              'from upydevice import SerialDevice',
+              'from upydevice import DeviceGroup',
+              'from upydevice import upy_code; upy_code']
+
+
+def importtime(stmt):
+    """[(module, self_us, cumulative_us)] of a statement in a new interpreter"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', stmt],
+                          stderr=subprocess.PIPE, universal_newlines=True,
+                          check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, module = line[len('import time:'):].split('|')
+        rows.append((module[1:].rstrip(), int(self_us), int(cumulative)))
+    return rows
+
+
+def stmt_imports(stmt):
+    """importtime rows of the statement, without interpreter startup imports"""
+    startup = {module for module, _, _ in importtime('pass')}
+    return [row for row in importtime(stmt) if row[0] not in startup]
+
+
+def stmt_time(stmt):
+    """Cumulative import time (s) of the statement top level imports"""
+    return sum(cum for module, _, cum in stmt_imports(stmt)
+               if not module.startswith(' ')) / 1e6
+
+
+def main(n, top):
+    for stmt in STATEMENTS:
+        times = [stmt_time(stmt) for i in range(n)]
+        print('{:<44} {:8.2f} ms'.format(stmt, statistics.median(times) * 1e3))
+    if top:
+        print('\nSlowest modules of `from upydevice import Device` '
+              '(cumulative ms):')
+        rows = sorted(stmt_imports('from upydevice import Device'),
+                      key=lambda row: row[2], reverse=True)
+        for module, self_us, cum in rows[:top]:
+            print('  {:<40} {:8.2f}'.format(module.strip(), cum / 1e3))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', type=int, default=10, help='runs per statement')
+    parser.add_argument('--top', type=int, default=0,
+                        help='show the slowest modules')
+    args = parser.parse_args()
+    main(args.n, args.top)
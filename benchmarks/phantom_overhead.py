@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Host-side overhead per phantom call (no device round trip).
+
+Compares the precompiled PhantomCall template against the per-call
+signature building the decorators used before.
+
+    $ python benchmarks/phantom_overhead.py [-n 100000]
+"""
+import argparse
+import timeit
+from upydevice.decorators import PhantomCall
+from upydevice.phantom import Pin, I2C
+
+
+class NullDevice:
+    output = None
+
+    def cmd(self, cmd, silent=False, **kargs):
+        pass
+
+    wr_cmd = cmd
+
+
+def legacy_build(func, args, kwargs):
+    dev_dict = func(*args, **kwargs)
+    flags = ['>', '<', 'object', 'at', '0x']
+    args_repr = [repr(a) for a in args if any(
+        f not in repr(a) for f in flags)]
+    kwargs_repr = [f"{k}={v!r}" if not callable(
+        v) else f"{k}={v.__name__}" for k, v in kwargs.items()]
+    signature = ", ".join(args_repr + kwargs_repr)
+    cmd_ = f"{dev_dict['name']}.{func.__name__}({signature})"
+    return dev_dict, cmd_
+
+
+def bench(label, stmt, n):
+    t = min(timeit.repeat(stmt, number=n, repeat=5))
+    us = t / n * 1e6
+    print(f"{label:<32} {us:8.3f} us/call")
+    return us
+
+
+def main(n):
+    dev = NullDevice()
+    led = Pin(dev, 'led')
+    i2c = I2C(dev, 'i2c')
+    value = Pin.value.__wrapped__
+    readfrom_mem = I2C.readfrom_mem.__wrapped__
+    call_value = PhantomCall(value)
+    call_readfrom_mem = PhantomCall(readfrom_mem)
+    cases = [
+        ('Pin.value()', (led,), {}, value, call_value),
+        ('Pin.value(1)', (led, 1), {}, value, call_value),
+        ('I2C.readfrom_mem(0x68, 15, 6)', (i2c, 0x68, 15, 6), {},
+         readfrom_mem, call_readfrom_mem)]
+    for label, args, kwargs, func, call in cases:
+        print(label)
+        old = bench('  legacy build', lambda: legacy_build(func, args, kwargs), n)
+        new = bench('  template build', lambda: call.build(args, kwargs), n)
+        print(f"  speedup: {old / new:.2f}x")
+    print('Full phantom call (null device)')
+    bench('  led.value(1)', lambda: led.value(1), n)
+    bench('  i2c.readfrom_mem(0x68, 15, 6)',
+          lambda: i2c.readfrom_mem(0x68, 15, 6), n)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', type=int, default=100000,
+                        help='calls per measurement')
+    main(parser.parse_args().n)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+File transfer throughput (put/get) against a fake device per transport.
+
+The fake device runs the REPL commands with CPython; the link is modeled
+with a byte rate and a per write latency, so results show the protocol
+overhead (base64 + one round trip per chunk vs WebREPL binary frames).
+
+Sync: deploy of a 40 file project, then re-deploy with one file changed
+(one hash query + changed file only).
+
+    $ python benchmarks/transfer_throughput.py [--size 65536]
+"""
+import argparse
+import ast
+import os
+import shutil
+import struct
+import tempfile
+import time
+from upydevice.filetransfer import (FileTransfer, WebREPLFileTransfer,
+                                    CHUNK_SIZE)
+
+# bytes/s, latency per write (s)
+LINKS = {'SerialDevice': (11520, 0.001),          # 115200 baud
+         'WebSocketDevice': (500000, 0.004),      # WiFi
+         'BleDevice': (12000, 0.015)}             # NUS, ~240 B writes
+
+
+class FakeDevice:
+    """REPL commands evaluated locally, delayed by link model"""
+
+    def __init__(self, dev_class, root):
+        self.dev_class = dev_class
+        self.rate, self.latency = LINKS[dev_class]
+        self.root = root
+        self.namespace = {}
+        self.response = ''
+        self.code_cache = self
+        self.ws = FakeWebREPL(self)
+
+    def link(self, n_bytes):
+        time.sleep(self.latency + n_bytes / self.rate)
+
+    def define(self, name, source):
+        self.link(len(source))
+        exec(source, self.namespace)
+
+    define_exec = define
+
+    def _repl_exec(self, cmd):
+        self.link(len(cmd))
+        result = eval(cmd, self.namespace)
+        self.response = repr(result)
+        self.link(len(self.response))
+        return ast.literal_eval(self.response)
+
+
+class FakeWebREPL:
+    def __init__(self, dev):
+        self.dev = dev
+        self.sock = self
+        self.rx = b''
+        self.tx = b''
+        self.file = None
+
+    def settimeout(self, timeout):
+        pass
+
+    def reset_buffers(self):
+        pass
+
+    def send(self, data):
+        self.dev.link(len(data))
+        self.rx += data
+        if self.file is None and len(self.rx) >= 82:
+            sig, op, _, _, size, n, fname = struct.unpack('<2sBBQLH64s',
+                                                          self.rx[:82])
+            self.rx = self.rx[82:]
+            self.op, self.size = op, size
+            self.file = open(fname[:n].decode(), 'wb' if op == 1 else 'rb')
+            self.tx += b'WB\x00\x00'
+        elif self.file is not None and self.op == 1:
+            self.file.write(self.rx)
+            self.size -= len(self.rx)
+            self.rx = b''
+            if self.size == 0:
+                self.file.close()
+                self.file = None
+                self.tx += b'WB\x00\x00'
+        elif self.file is not None:
+            self.rx = b''
+            chunk = self.file.read(1024)
+            self.tx += struct.pack('<H', len(chunk)) + chunk
+            self.dev.link(len(chunk))
+            if not chunk:
+                self.file.close()
+                self.file = None
+                self.tx += b'WB\x00\x00'
+
+    def read_frame(self):
+        data, self.tx = self.tx, b''
+        return True, 2, data
+
+
+def bench(label, transfer, local, size):
+    put = transfer.put(local, 'bench.bin', verify=False)
+    get = transfer.get('bench.bin', 'bench_copy.bin', verify=False)
+    print(f"{label:<34} put {size / put.elapsed / 1e6:8.4f} MB/s"
+          f"   get {size / get.elapsed / 1e6:8.4f} MB/s")
+
+
+def bench_sync(transfer, root):
+    project = os.path.join(root, 'project')
+    if os.path.exists(project):
+        shutil.rmtree(project)
+    os.makedirs(project)
+    for i in range(40):
+        with open(os.path.join(project, f'mod{i}.py'), 'w') as mod:
+            mod.write(f'# module {i}\n' + 'x = 1\n' * 200)
+    t0 = time.perf_counter()
+    transfer.sync(project)
+    t_full = time.perf_counter() - t0
+    with open(os.path.join(project, 'mod7.py'), 'a') as mod:
+        mod.write('y = 2\n')
+    t0 = time.perf_counter()
+    results = transfer.sync(project)
+    t_delta = time.perf_counter() - t0
+    sent = sum(r.sent for r in results)
+    print(f"  sync 40 files: full {t_full:7.2f} s   "
+          f"1 changed {t_delta:6.2f} s ({sent} B sent)")
+
+
+def main(size):
+    cwd = os.getcwd()
+    try:
+        _main(size)
+    finally:
+        os.chdir(cwd)
+
+
+def _main(size):
+    with tempfile.TemporaryDirectory() as root:
+        local = os.path.join(root, 'local.bin')
+        with open(local, 'wb') as local_file:
+            local_file.write(os.urandom(size))
+        for dev_class, (rate, latency) in LINKS.items():
+            # device filesystem per transport
+            os.makedirs(os.path.join(root, dev_class))
+            os.chdir(os.path.join(root, dev_class))
+            print(f"{dev_class} (link {rate / 1e3:.1f} kB/s, "
+                  f"{latency * 1e3:.0f} ms/write)")
+            dev = FakeDevice(dev_class, root)
+            bench(f'  REPL base64 ({CHUNK_SIZE[dev_class]} B chunks)',
+                  FileTransfer(dev), local, size)
+            if dev_class == 'WebSocketDevice':
+                bench('  WebREPL binary (1024 B frames)',
+                      WebREPLFileTransfer(dev), local, size)
+            bench_sync(FileTransfer(FakeDevice(dev_class, root)), root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=int, default=65536)
+    main(parser.parse_args().size)
@@ -39,5 +39,5 @@ setup(name='upydevice',
       scripts=[],
       include_package_data=True,
       install_requires=['pyserial', 'dill', 'unsync',
-                        'bleak>=0.12.1', 'bleak_sigspec>=0.0.4', 'netifaces~=0.11.0',
-                        'python-nmap~=0.7.1'])
+                        'bleak>=0.12.1', 'bleak_sigspec>=0.0.4'],
+      extras_require={'bench': ['pytest', 'pytest-benchmark']})
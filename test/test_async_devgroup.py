@@ -0,0 +1,100 @@
+from upydevice.devgroup import AsyncDeviceGroup
+from upydevice.executor import DeviceExecutor
+from upydevice.exceptions import DeviceException
+import threading
+import time
+
+
+class _FakeCodeCache:
+    def __init__(self):
+        self.defined = {}
+
+    def define(self, name, str_func, force=False):
+        self.defined[name] = str_func
+
+
+class _FakeDevice:
+    """wr_cmd takes delay s and evaluates the command locally"""
+    active = {}
+    lock = threading.Lock()
+
+    def __init__(self, name, dev_class='SerialDevice', delay=0.2):
+        self.name = name
+        self.dev_class = dev_class
+        self.delay = delay
+        self.output = None
+        self.response = ''
+        self.code_cache = _FakeCodeCache()
+        self.executor = DeviceExecutor(self)
+
+    def wr_cmd(self, cmd, silent=False, rtn=True, follow=False):
+        with self.lock:
+            self.active[self.dev_class] = self.active.get(self.dev_class,
+                                                          [0, 0])
+            count = self.active[self.dev_class]
+            count[0] += 1
+            count[1] = max(count[1], count[0])
+        time.sleep(self.delay)
+        with self.lock:
+            count[0] -= 1
+        try:
+            self.output = eval(cmd, {'double': lambda x: 2 * x})
+            self.response = repr(self.output)
+        except Exception as e:
+            self.output = None
+            self.response = 'Traceback (most recent call last):\n{}'.format(e)
+
+    def _kbi_cmd(self):
+        pass
+
+    def raise_traceback(self):
+        if 'Traceback' in self.response:
+            raise DeviceException(self.response)
+
+
+def test_concurrent_cmd_and_results():
+    devs = [_FakeDevice('dev{}'.format(i)) for i in range(8)]
+    group = AsyncDeviceGroup(devs)
+    t0 = time.perf_counter()
+    results = group.cmd_async('1 + 2')
+    assert time.perf_counter() - t0 < 0.2 * 4
+    assert set(results) == {dev.name for dev in devs}
+    assert all(res.output == 3 and res.error is None and res.elapsed >= 0.2
+               for res in results.values())
+    assert group.output == {dev.name: 3 for dev in devs}
+
+
+def test_errors_do_not_stop_group():
+    devs = [_FakeDevice('ok', delay=0.05), _FakeDevice('slow', delay=1)]
+    group = AsyncDeviceGroup(devs, timeout=0.3)
+    results = group.cmd_async('undefined_var')
+    assert isinstance(results['ok'].error, DeviceException)
+    assert isinstance(results['slow'].error, TimeoutError)
+    results = group.cmd_async('1', include=['ok'])
+    assert list(results) == ['ok'] and results['ok'].output == 1
+
+
+def test_ble_concurrency_limit():
+    _FakeDevice.active.clear()
+    devs = ([_FakeDevice('ble{}'.format(i), 'BleDevice', 0.05)
+             for i in range(4)]
+            + [_FakeDevice('ws{}'.format(i), 'WebSocketDevice', 0.2)
+               for i in range(4)])
+    group = AsyncDeviceGroup(devs, limits={'BleDevice': 2})
+    group.cmd_async('0')
+    assert _FakeDevice.active['BleDevice'][1] == 2
+    assert _FakeDevice.active['WebSocketDevice'][1] == 4
+
+
+def test_code_defines_and_runs():
+    devs = [_FakeDevice('dev{}'.format(i), delay=0.01) for i in range(3)]
+    group = AsyncDeviceGroup(devs)
+
+    @group.code
+    def double(x):
+        return 2 * x
+
+    assert double(21) == {dev.name: 42 for dev in devs}
+    assert all('def double(x):' in dev.code_cache.defined['double']
+               for dev in devs)
+    assert all(res.error is None for res in group.results.values())
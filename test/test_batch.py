@@ -0,0 +1,81 @@
+from upydevice.decorators import DeviceBatch
+from upydevice.phantom import Pin
+import ast
+
+
+class _FakePin:
+    def __init__(self):
+        self.val = 0
+
+    def value(self, *args):
+        if args:
+            self.val = args[0]
+        else:
+            return self.val
+
+    def on(self):
+        self.val = 1
+
+
+class _FakeDevice:
+    """Evaluates commands in a local namespace, counting round trips"""
+
+    def __init__(self):
+        self.namespace = {'led': _FakePin(), 'btn': _FakePin()}
+        self.round_trips = 0
+        self.output = None
+        self.response = ''
+
+    def cmd(self, cmd, silent=False, **kargs):
+        self.round_trips += 1
+        try:
+            self.response = repr(eval(cmd, self.namespace))
+        except Exception as e:
+            self.response = 'Traceback (most recent call last):\n{}'.format(e)
+        self.output = None
+        self.get_output()
+        if self.output is None and self.response not in ('', 'None'):
+            self.output = self.response
+
+    def get_output(self):
+        try:
+            self.output = ast.literal_eval(self.response)
+        except Exception:
+            pass
+
+    def batch(self, max_calls=32):
+        return DeviceBatch(self, max_calls=max_calls)
+
+
+def test_batch_single_round_trip():
+    dev = _FakeDevice()
+    led = Pin(dev, 'led')
+    btn = Pin(dev, 'btn')
+    with dev.batch():
+        led.on()
+        first = led.value()
+        btn.value(1)
+        second = btn.value()
+    assert dev.round_trips == 1
+    assert first.result() == 1
+    assert second.result() == 1
+    assert dev.output == [None, 1, None, 1]
+
+
+def test_batch_max_calls():
+    dev = _FakeDevice()
+    led = Pin(dev, 'led')
+    with dev.batch(max_calls=2):
+        futs = [led.value() for i in range(5)]
+    assert dev.round_trips == 3
+    assert [fut.result() for fut in futs] == [0] * 5
+
+
+def test_batch_device_error():
+    dev = _FakeDevice()
+    led = Pin(dev, 'missing')
+    with dev.batch():
+        fut = led.value()
+    assert isinstance(fut.exception(), Exception)
+    # outside the batch calls go through as usual
+    assert Pin(dev, 'led').value() == 0
@@ -0,0 +1,21 @@
+from benchmarks import baseline
+
+
+def test_compare_flags_regressions():
+    base = {'test_wr_cmd[ws]': 0.001, 'test_get_output[list]': 2e-5}
+    results = {'test_wr_cmd[ws]': 0.0014, 'test_get_output[list]': 2.1e-5,
+               'test_new': 0.5}
+    rows, regressions = baseline.compare(results, base, threshold=0.25)
+    assert regressions == ['test_wr_cmd[ws]']
+    assert dict((row[0], row[3]) for row in rows)['test_new'] is None
+    assert 'REGRESSION' in baseline.report(rows, regressions)
+
+
+def test_load_pytest_benchmark_json(tmp_path):
+    results = tmp_path / 'results.json'
+    results.write_text('{"benchmarks": [{"name": "test_a", '
+                       '"stats": {"median": 0.25, "mean": 0.3}}]}')
+    assert baseline.load(str(results)) == {'test_a': 0.25}
+    saved = tmp_path / 'baseline.json'
+    baseline.save({'test_a': 0.25}, str(saved))
+    assert baseline.load(str(saved)) == {'test_a': 0.25}
@@ -0,0 +1,99 @@
+from upydevice import Device, DeviceBroker, BrokerDevice
+from upydevice.broker import spawn_broker
+from upydevice.exceptions import DeviceException, DeviceNotFound
+from upydevice.simulator import SerialSimulator, WebREPLSimulator
+from concurrent.futures import ThreadPoolExecutor
+import os
+import pytest
+
+
+@pytest.fixture
+def broker(tmp_path):
+    with DeviceBroker(str(tmp_path / 'broker.sock')) as broker:
+        yield broker
+    assert not os.path.exists(broker.path)
+
+
+def test_shared_webrepl_session(broker):
+    with WebREPLSimulator(password='shared') as sim:
+        clients = [BrokerDevice(sim.address, 'shared', path=broker.path)
+                   for i in range(4)]
+        # one device connection for all clients
+        assert sim.n_connections == 1
+        assert clients[0].dev_class == 'WebSocketDevice'
+
+        def run(i):
+            clients[i].wr_cmd('x{0} = {0}'.format(i), silent=True)
+            return [clients[i].wr_cmd('x{} * 2'.format(i), silent=True,
+                                      rtn_resp=True) for j in range(5)]
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(run, range(4)))
+        assert results == [[i * 2] * 5 for i in range(4)]
+        assert broker.sessions[sim.address].n_cmds == 24
+        for client in clients:
+            client.disconnect()
+        # device stays connected for the next client
+        dev = Device(sim.address, 'shared', broker=broker.path)
+        assert dev.wr_cmd('x3', silent=True, rtn_resp=True) == 3
+        assert sim.n_connections == 1
+        dev.disconnect()
+
+
+def test_serial_session_errors_and_calls(broker, tmp_path):
+    with SerialSimulator(root=str(tmp_path)) as sim:
+        dev = BrokerDevice(sim.port, path=broker.path, name='sim')
+        assert dev.wr_cmd("bytearray(b'ab')", silent=True,
+                          rtn_resp=True) == bytearray(b'ab')
+        dev.wr_cmd('1/0', silent=True)
+        with pytest.raises(DeviceException):
+            dev.raise_traceback()
+        local = tmp_path / 'local.txt'
+        local.write_text('hello')
+        assert dev.call('put', str(local), 'remote.txt')['verified']
+        with pytest.raises(DeviceException):
+            dev.call('disconnect')
+        # same name, other address
+        with pytest.raises(DeviceException):
+            BrokerDevice('/dev/other', path=broker.path, name='sim')
+        assert broker.unregister('sim')
+        with pytest.raises(DeviceNotFound):
+            dev.wr_cmd('1+1')
+
+
+def test_failed_connection_not_registered(broker):
+    with WebREPLSimulator(password='right') as sim:
+        with pytest.raises(DeviceNotFound):
+            BrokerDevice(sim.address, 'wrong', path=broker.path)
+        assert broker.sessions == {}
+
+
+def test_no_broker(tmp_path):
+    with pytest.raises(DeviceNotFound):
+        BrokerDevice('/dev/ttyUSB0', path=str(tmp_path / 'none.sock'),
+                     autostart=False)
+
+
+def test_relative_paths_from_client_cwd(tmp_path, monkeypatch):
+    broker_dir = tmp_path / 'broker'
+    client_dir = tmp_path / 'client'
+    broker_dir.mkdir()
+    client_dir.mkdir()
+    path = str(tmp_path / 'broker.sock')
+    with WebREPLSimulator(password='cwd', root=str(tmp_path)) as sim:
+        # detached broker process keeps the cwd it was spawned from
+        monkeypatch.chdir(broker_dir)
+        spawn_broker(path)
+        monkeypatch.chdir(client_dir)
+        dev = BrokerDevice(sim.address, 'cwd', path=path, autostart=False)
+        try:
+            (client_dir / 'local.txt').write_text('hello')
+            assert dev.put('local.txt', 'remote.txt')['verified']
+            dev.get('remote.txt')
+            assert (client_dir / 'remote.txt').read_text() == 'hello'
+            (client_dir / 'src').mkdir()
+            (client_dir / 'src' / 'main.py').write_text('x = 1')
+            assert len(dev.sync('src')) == 1
+            assert os.listdir(broker_dir) == []
+        finally:
+            dev.request('shutdown')
+            dev.disconnect()
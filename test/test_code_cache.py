@@ -0,0 +1,88 @@
+from upydevice.decorators import DeviceCodeCache
+from upydevice.devgroup import DeviceGroup
+from upydevice.serialdevice import SerialDevice
+import ast
+
+
+class _FakeDevice:
+    """Runs pasted code in a local namespace, as a device REPL would"""
+
+    def __init__(self, name='dev'):
+        self.name = name
+        self.namespace = {}
+        self.pasted = []
+        self._paste = ''
+        self.output = None
+        self.response = ''
+        self.code_cache = DeviceCodeCache(self)
+
+    def paste_buff(self, long_command):
+        self.pasted.append(long_command)
+        self._paste = long_command
+
+    def cmd(self, cmd, silent=False, **kargs):
+        self.output = None
+        if cmd == '\x04':
+            exec(self._paste, self.namespace)
+            return
+        self.response = repr(eval(cmd, self.namespace))
+        try:
+            self.output = ast.literal_eval(self.response)
+        except Exception:
+            pass
+
+    def wr_cmd(self, cmd, rtn=True, **kargs):
+        self.cmd(cmd)
+
+    def reboot(self):
+        self.namespace = {}
+        self.code_cache.clear()
+
+
+def test_code_defined_once():
+    dev = _FakeDevice()
+
+    for i in range(3):
+        @SerialDevice.code.__get__(dev)
+        def add(a, b):
+            return a + b
+
+    assert len(dev.pasted) == 1
+    assert add(1, 2) == 3
+
+
+def test_code_changed_source_is_pasted():
+    dev = _FakeDevice()
+    cache = dev.code_cache
+    assert cache.define('f', 'def f():\n    return 1\n')
+    assert not cache.define('f', 'def f():\n    return 1\n')
+    assert cache.define('f', 'def f():\n    return 2\n')
+    dev.cmd('f()')
+    assert dev.output == 2
+
+
+def test_code_registry_survives_host_session():
+    dev = _FakeDevice()
+    dev.code_cache.define('f', 'def f():\n    return 1\n')
+    # new host session, same running device
+    dev.code_cache = DeviceCodeCache(dev)
+    assert not dev.code_cache.define('f', 'def f():\n    return 1\n')
+    assert len(dev.pasted) == 1
+    # device reboot drops its functions
+    dev.reboot()
+    assert dev.code_cache.define('f', 'def f():\n    return 1\n')
+    assert len(dev.pasted) == 2
+
+
+def test_devgroup_code_cache():
+    devs = [_FakeDevice('a'), _FakeDevice('b')]
+    group = DeviceGroup.__new__(DeviceGroup)
+    group.devs = {dev.name: dev for dev in devs}
+    devs[0].code_cache.define('mul', 'def mul(a, b):\n    return a * b\n')
+
+    @group.code
+    def mul(a, b):
+        return a * b
+
+    assert [len(dev.pasted) for dev in devs] == [1, 1]
+    assert mul(2, 3) == {'a': 6, 'b': 6}
@@ -0,0 +1,106 @@
+from upydevice.compression import BlobCache, ZCAPS, MIN_SIZE
+from upydevice.simulator import (SerialSimulator, WebREPLSimulator,
+                                 BleSimulator)
+from upydevice.serialdevice import SerialDevice
+from upydevice.websocketdevice import WebSocketDevice
+import asyncio
+import os
+import pytest
+
+SOURCE = 'def big():\n{}    return a99\n'.format(
+    ''.join('    a{0} = {0}\n'.format(i) for i in range(100)))
+
+
+@pytest.fixture
+def files(tmp_path):
+    text = tmp_path / 'lib.py'
+    text.write_text('x = 1\n' * 4000)
+    noise = tmp_path / 'noise.bin'
+    noise.write_bytes(os.urandom(4000))
+    (tmp_path / 'dev').mkdir()
+    return str(text), str(noise), str(tmp_path / 'dev')
+
+
+def _round_trip(dev, text, noise, root):
+    result = dev.put(text, 'lib.py', compress=True)
+    assert result.verified and result.sent < result.size / 10
+    # not compressible: sent as is
+    assert dev.put(noise, 'noise.bin', compress=True).sent == 4000
+    assert dev.put(text, 'plain.py').sent == result.size
+    copy = text + '.copy'
+    result = dev.get('lib.py', copy, compress=True)
+    assert result.verified and result.sent < result.size / 10
+    assert open(copy).read() == open(text).read()
+    # staged files removed
+    assert sorted(os.listdir(root)) == ['lib.py', 'noise.bin', 'plain.py']
+
+
+def test_compressed_transfers_serial(files):
+    text, noise, root = files
+    with SerialSimulator(root=root) as sim:
+        dev = SerialDevice(sim.port, init=True)
+        assert dev.compression.caps == ZCAPS(True, True)
+        _round_trip(dev, text, noise, root)
+        dev.disconnect()
+
+
+def test_compressed_transfers_webrepl(files):
+    text, noise, root = files
+    with WebREPLSimulator(password='z', root=root) as sim:
+        dev = WebSocketDevice(sim.address, 'z', init=True)
+        _round_trip(dev, text, noise, root)
+        dev.disconnect()
+
+
+def test_compressed_code_ble():
+    from upydevice.bledevice import BleDevice
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sim = BleSimulator()
+    with sim.patch():
+        dev = BleDevice(sim.address, init=True)
+        dev.compression.enabled = True
+        assert dev.code_cache.define('big', SOURCE)
+        assert dev.wr_cmd('big()', silent=True, rtn_resp=True) == 99
+        # small functions are pasted
+        assert dev.code_cache.define('small', 'def small():\n    return 1\n')
+        assert dev.wr_cmd('small()', silent=True, rtn_resp=True) == 1
+        dev.disconnect()
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def test_fallback(files):
+    text, noise, root = files
+    with SerialSimulator(root=root) as sim:
+        # zlib DecompIO only (firmware before deflate module)
+        del sim.repl.modules['deflate']
+        dev = SerialDevice(sim.port, init=True)
+        assert dev.compression.caps == ZCAPS(True, False)
+        assert dev.put(text, 'lib.py', compress=True).sent < 4000
+        result = dev.get('lib.py', text + '.copy', compress=True)
+        assert result.verified and result.sent == result.size
+        dev.disconnect()
+    with SerialSimulator(root=root) as sim:
+        # no decompression
+        for name in ('deflate', 'zlib', 'uzlib'):
+            del sim.repl.modules[name]
+        dev = SerialDevice(sim.port, init=True)
+        dev.compression.enabled = True
+        assert dev.compression.caps == ZCAPS(False, False)
+        result = dev.put(text, 'lib.py')
+        assert result.verified and result.sent == result.size
+        dev.disconnect()
+
+
+def test_blob_cache():
+    cache = BlobCache(max_bytes=100)
+    data = [bytes([i]) * MIN_SIZE * 4 for i in range(20)]
+    blob = cache.compress(data[0])
+    assert cache.compress(data[0]) is blob
+    assert (cache.hits, cache.misses) == (1, 1)
+    for item in data:
+        cache.compress(item)
+    assert cache.n_bytes <= 100
+    cache.compress(data[0])
+    assert cache.misses == 21
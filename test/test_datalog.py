@@ -0,0 +1,156 @@
+from upydevice.datalog import DatalogCapture
+from upydevice import serialdevice
+from upydevice.serialdevice import SerialDevice
+from upydevice.websocketdevice import WebSocketDevice
+from upydevice.exceptions import DeviceException
+import csv
+import socket
+import pytest
+
+
+class _FakeSerial:
+    """Echoes commands and replies with a canned output and prompt"""
+
+    def __init__(self, *args, **kargs):
+        self.reply = b''
+        self.rx = b''
+
+    def write(self, data):
+        self.rx += data.replace(b'\r', b'\r\n') + self.reply + b'>>> '
+        return len(data)
+
+    def read(self, n=1):
+        data, self.rx = self.rx[:n], self.rx[n:]
+        return data
+
+    def read_all(self):
+        data, self.rx = self.rx, b''
+        return data
+
+    def readable(self):
+        return True
+
+
+def test_capture_incremental_chunks():
+    capture = DatalogCapture(dvars=['x', 'y'])
+    stream = b'(1.0, 2.0)\r\n[3, 4]\r\n5.5,6\r\nhello\r\n(7, 8, 9)\r\n>>> '
+    for i in range(0, len(stream), 3):
+        capture.feed(stream[i:i+3], timestamp=i * 0.01)
+    capture.close()
+    assert capture.rows() == [(1.0, 2.0), (3.0, 4.0), (5.5, 6.0)]
+    assert capture.n_skipped == 2
+    datalog = capture.as_dict(units='m')
+    assert datalog['vars'] == ['x', 'y']
+    assert datalog['x'] == [1.0, 3.0, 5.5]
+    assert datalog['u'] == 'm'
+    assert datalog['ts'][0] == 0 and datalog['ts'] == sorted(datalog['ts'])
+    assert capture.columns[0].typecode == 'd'
+    # integers above 2**24 (float32) are kept exact
+    capture.add_line('123456789, 1')
+    assert capture.rows()[-1] == (123456789.0, 1.0)
+
+
+def test_capture_bounded_drop_and_spill(tmp_path):
+    capture = DatalogCapture(max_rows=10)
+    for i in range(25):
+        capture.add_line('({}, {})'.format(i, -i))
+    assert len(capture) <= 10
+    assert capture.n_dropped + len(capture) == 25
+    assert capture.rows()[-1] == (24.0, -24.0)
+
+    spill = tmp_path / 'dlog.csv'
+    capture = DatalogCapture(dvars=['a', 'b'], max_rows=10, spill=str(spill))
+    for i in range(25):
+        capture.add_line('{}, {}'.format(i, i * 2))
+    capture.close()
+    with open(spill) as spill_file:
+        rows = list(csv.reader(spill_file))
+    assert rows[0] == ['a', 'b', 'ts']
+    assert len(rows) - 1 + len(capture) == 25
+    assert capture.n_spilled == len(rows) - 1
+
+
+def test_serial_follow_dlog(monkeypatch):
+    monkeypatch.setattr(serialdevice.serial, 'Serial', _FakeSerial)
+    monkeypatch.setattr(SerialDevice, '_get_serial_port_data',
+                        lambda self, port: ('fake', 'fake', 'fake'))
+    dev = SerialDevice('/dev/fake', init=False)
+    dev.serial.reply = b''.join(b'(%d, %d)\r\n' % (i, i * i)
+                                for i in range(50))
+    dev.wr_cmd('sample()', silent=True, follow=True, dlog=True)
+    assert len(dev.buff) <= len(dev.prompt)
+    dev.get_datalog(dvars=['n', 'sq'])
+    assert dev.datalog['n'] == [float(i) for i in range(50)]
+    assert dev.datalog['sq'][-1] == 49.0 ** 2
+    assert len(dev.datalog['ts']) == 50
+    dev.get_datalog()
+    assert dev.datalog[1] == (1.0, 1.0)
+
+
+_TRACEBACK = (b'Traceback (most recent call last):\r\n'
+              b'  File "<stdin>", line 1, in <module>\r\n'
+              b'  File "<stdin>", line 4, in sample\r\n'
+              b'ZeroDivisionError: divide by zero\r\n')
+
+
+def test_serial_follow_dlog_traceback(monkeypatch):
+    monkeypatch.setattr(serialdevice.serial, 'Serial', _FakeSerial)
+    monkeypatch.setattr(SerialDevice, '_get_serial_port_data',
+                        lambda self, port: ('fake', 'fake', 'fake'))
+    dev = SerialDevice('/dev/fake', init=False)
+    dev.serial.reply = b''.join(b'(%d, %d)\r\n' % (i, i * i)
+                                for i in range(10)) + _TRACEBACK
+    dev.wr_cmd('sample()', silent=True, follow=True, dlog=True)
+    assert len(dev.dlog_capture) == 10
+    assert dev.response.startswith('Traceback (most recent call last):')
+    assert dev.response.strip().endswith('ZeroDivisionError: divide by zero')
+    with pytest.raises(DeviceException):
+        dev.raise_traceback()
+    assert dev.dlog_capture.error == dev.response
+
+
+class _FakeSocket:
+
+    def settimeout(self, timeout):
+        pass
+
+
+class _FakeWebsocket:
+    """Echoes commands and replies one line per frame, then the prompt"""
+
+    def __init__(self):
+        self.sock = _FakeSocket()
+        self.reply = b''
+        self.frames = []
+
+    def send(self, data):
+        data = bytes(data, 'utf-8').replace(b'\r', b'\r\n')
+        self.frames += (data + self.reply).splitlines(True) + [b'>>> ']
+
+    def read_frame(self):
+        if not self.frames:
+            raise socket.timeout
+        return True, 1, self.frames.pop(0)
+
+    def reset_buffers(self):
+        pass
+
+
+def test_ws_follow_dlog_traceback(monkeypatch):
+    monkeypatch.setattr(WebSocketDevice, 'ws_readable',
+                        lambda self: bool(self.ws.frames))
+    dev = WebSocketDevice('fake:8266', 'fake')
+    dev.ws = _FakeWebsocket()
+    dev.ws.reply = b''.join(b'%d %d\r\n' % (i, i * 2)
+                            for i in range(20)) + b'done\r\n' + _TRACEBACK
+    dev.wr_cmd('sample(20)', silent=True, follow=True, dlog=True)
+    assert len(dev.dlog_capture) == 20
+    assert 'done' in dev.dlog_capture.lines
+    assert 'ZeroDivisionError' in dev.response
+    with pytest.raises(DeviceException):
+        dev.raise_traceback()
+    # next command without error
+    dev.ws.reply = b'0 0\r\n'
+    dev.wr_cmd('sample(1)', silent=True, follow=True, dlog=True)
+    assert dev.dlog_capture.rows() == [(0.0, 0.0)]
+    assert dev.response == ''
@@ -0,0 +1,83 @@
+from upydevice.executor import DeviceExecutor
+from upydevice.serialdevice import SERIAL_DEVICE
+import asyncio
+import threading
+import time
+import pytest
+
+
+class _SlowDevice:
+    """Commands are evaluated after a delay, KBI stops a running command"""
+
+    def __init__(self, delay=0.05):
+        self.name = 'slow'
+        self.delay = delay
+        self.output = None
+        self.threads = set()
+        self._kbi = threading.Event()
+        self.executor = DeviceExecutor(self)
+
+    def wr_cmd(self, cmd, silent=False, rtn=True, *args, **kargs):
+        self.threads.add(threading.current_thread().name)
+        self.output = None
+        self._kbi.clear()
+        if self._kbi.wait(self.delay):
+            self.output = 'KeyboardInterrupt'
+            return
+        self.output = eval(cmd)
+
+    def _kbi_cmd(self):
+        self._kbi.set()
+
+
+def test_commands_in_order_single_thread():
+    dev = _SlowDevice(delay=0.01)
+    futs = [dev.executor.cmd('{} * 2'.format(i)) for i in range(5)]
+    assert [fut.result(timeout=2) for fut in futs] == [0, 2, 4, 6, 8]
+    assert len(dev.threads) == 1
+    assert threading.current_thread().name not in dev.threads
+    dev.executor.shutdown()
+
+
+def test_timeout_interrupts_command():
+    dev = _SlowDevice(delay=5)
+    start = time.time()
+    fut = dev.executor.cmd('1', timeout=0.1)
+    with pytest.raises(TimeoutError):
+        fut.result(timeout=2)
+    assert time.time() - start < 1
+    dev.executor.shutdown()
+
+
+def test_cancel_queued_and_running():
+    dev = _SlowDevice(delay=5)
+    running = dev.executor.cmd('1')
+    queued = dev.executor.cmd('2')
+    time.sleep(0.05)
+    assert dev.executor.cancel(queued)
+    assert queued.cancelled()
+    assert dev.executor.cancel(running)
+    assert running.result(timeout=2) == 'KeyboardInterrupt'
+    dev.executor.shutdown()
+
+
+def test_cmd_nb_get_opt_and_await():
+    dev = _SlowDevice(delay=0.01)
+    fut = SERIAL_DEVICE.cmd_nb(dev, '6 * 7', silent=True)
+    dev.output = None
+    SERIAL_DEVICE.get_opt(dev)
+    fut.result(timeout=2)
+    dev.output = None
+    SERIAL_DEVICE.get_opt(dev)
+    assert dev.output == 42
+    # result is consumed once read
+    dev.output = None
+    SERIAL_DEVICE.get_opt(dev)
+    assert dev.output is None
+
+    async def gather():
+        return await asyncio.gather(
+            *[dev.executor.wrap(dev.executor.cmd(str(i))) for i in range(3)])
+
+    assert asyncio.run(gather()) == [0, 1, 2]
+    dev.executor.shutdown()
@@ -0,0 +1,276 @@
+from upydevice import serialdevice
+from upydevice.serialdevice import SerialDevice
+from upydevice.filetransfer import (FileTransfer, WebREPLFileTransfer,
+                                    file_hash, _XFER_CODE)
+from upydevice.exceptions import DeviceException
+import struct
+import os
+import pytest
+
+
+class _FakeREPL:
+    """Evaluates REPL lines and paste mode blocks with CPython"""
+
+    def __init__(self):
+        self.namespace = {}
+        self.line = b''
+        self.paste = None
+        self.lines = 0
+
+    def _run(self, code):
+        try:
+            try:
+                result = eval(code, self.namespace)
+                return '' if result is None else repr(result) + '\r\n'
+            except SyntaxError:
+                exec(code, self.namespace)
+                return ''
+        except Exception as e:
+            return 'Traceback (most recent call last):\r\n{}: {}\r\n'.format(
+                type(e).__name__, e)
+
+    def feed(self, data):
+        out = ''
+        for byte in data:
+            char = bytes([byte])
+            if self.paste is not None:
+                if char == b'\x04':
+                    out += '\r\n' + self._run(self.paste.decode()) + '>>> '
+                    self.paste = None
+                else:
+                    self.paste += char
+            elif char == b'\x05':
+                self.paste = b''
+                out += 'paste mode; Ctrl-C to cancel, Ctrl-D to finish\r\n=== '
+            elif char == b'\r':
+                line, self.line = self.line.decode(), b''
+                self.lines += 1
+                out += line + '\r\n'
+                if line.strip():
+                    out += self._run(line)
+                out += '>>> '
+            else:
+                self.line += char
+        return out.encode()
+
+
+class _FakeSerial:
+    timeout = None
+
+    def __init__(self, *args, **kargs):
+        self.repl = _FakeREPL()
+        self.rx = b''
+        self.port = '/dev/fake'
+
+    def write(self, data):
+        self.rx += self.repl.feed(data)
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.rx)
+
+    def read(self, n=1):
+        data, self.rx = self.rx[:n], self.rx[n:]
+        return data
+
+    def read_all(self):
+        data, self.rx = self.rx, b''
+        return data
+
+    def readable(self):
+        return True
+
+    def reset_input_buffer(self):
+        self.rx = b''
+
+
+@pytest.fixture
+def dev(monkeypatch, tmp_path):
+    monkeypatch.setattr(serialdevice.serial, 'Serial', _FakeSerial)
+    monkeypatch.setattr(SerialDevice, '_get_serial_port_data',
+                        lambda self, port: ('fake', 'fake', 'fake'))
+    # device filesystem is the tmp dir
+    device_fs = tmp_path / 'device'
+    device_fs.mkdir()
+    monkeypatch.chdir(device_fs)
+    return SerialDevice('/dev/fake', init=False)
+
+
+def _write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_put_get_binary(dev, tmp_path):
+    data = bytes(range(256)) * 10 + b'\r\n>>> \x04\x03'
+    local = _write(tmp_path / 'host' / 'blob.bin', data)
+    result = dev.put(local, 'lib/blob.bin')
+    assert result.verified and result.size == len(data)
+    assert (tmp_path / 'device' / 'lib' / 'blob.bin').read_bytes() == data
+    assert dev.filetransfer.remote_stat('lib/blob.bin') == (
+        len(data), file_hash(local))
+    assert dev.filetransfer.remote_stat('missing.py') is None
+
+    copy = str(tmp_path / 'host' / 'copy.bin')
+    result = dev.get('lib/blob.bin', copy)
+    assert result.verified and open(copy, 'rb').read() == data
+
+    with pytest.raises(DeviceException):
+        dev.get('missing.py', str(tmp_path / 'host' / 'missing.py'))
+
+
+def test_helpers_defined_once(dev, tmp_path):
+    local = _write(tmp_path / 'host' / 'a.txt', b'a')
+    dev.put(local)
+    dev.put(local)
+    assert dev.serial.repl.namespace['_upyd_code'] == dev.code_cache.hashes
+
+
+def test_sync_skips_unchanged(dev, tmp_path):
+    src = tmp_path / 'project'
+    _write(src / 'main.py', b'print("main")\n')
+    _write(src / 'lib' / 'sensor.py', b'x = 1\n')
+    _write(src / '.git' / 'HEAD', b'ref')
+    results = dev.sync(str(src))
+    assert sorted(r.dst for r in results) == ['lib/sensor.py', 'main.py']
+    assert not any(r.skipped for r in results)
+
+    _write(src / 'lib' / 'sensor.py', b'x = 2\n')
+    results = {r.dst: r for r in dev.sync(str(src))}
+    assert results['main.py'].skipped
+    assert not results['lib/sensor.py'].skipped
+    assert (tmp_path / 'device' / 'lib' / 'sensor.py').read_bytes() == b'x = 2\n'
+
+
+class _FakeWebREPLSocket:
+    """Device side of the WebREPL file protocol over binary frames"""
+
+    def __init__(self, root):
+        self.root = root
+        self.rx = b''
+        self.tx = b''
+        self.op = None
+        self.sock = self
+
+    def settimeout(self, timeout):
+        pass
+
+    def reset_buffers(self):
+        pass
+
+    def _resp(self, code=0):
+        self.tx += struct.pack('<2sH', b'WB', code)
+
+    def send(self, data):
+        self.rx += data
+        if self.op is None and len(self.rx) >= 82:
+            sig, op, _, _, size, fname_len, fname = struct.unpack(
+                '<2sBBQLH64s', self.rx[:82])
+            self.rx = self.rx[82:]
+            path = os.path.join(self.root, fname[:fname_len].decode())
+            if op == 1:
+                self.op, self.size, self.file = op, size, open(path, 'wb')
+            elif os.path.exists(path):
+                self.op, self.file = op, open(path, 'rb')
+            else:
+                return self._resp(1)
+            self._resp()
+        elif self.op == 1:
+            n = min(self.size, len(self.rx))
+            self.file.write(self.rx[:n])
+            self.rx, self.size = self.rx[n:], self.size - n
+            if self.size == 0:
+                self.file.close()
+                self.op = None
+                self._resp()
+        elif self.op == 2 and self.rx == b'\x00':
+            self.rx = b''
+            chunk = self.file.read(1000)
+            self.tx += struct.pack('<H', len(chunk)) + chunk
+            if not chunk:
+                self.file.close()
+                self.op = None
+                self._resp()
+
+    def read_frame(self):
+        data, self.tx = self.tx[:100], self.tx[100:]
+        return True, 2, data
+
+
+class _WebREPLDevice:
+    dev_class = 'WebSocketDevice'
+
+    def __init__(self, root):
+        self.ws = _FakeWebREPLSocket(root)
+        self.namespace = {}
+        self.response = ''
+        self.code_cache = self
+
+    def define(self, name, source):
+        exec(source, self.namespace)
+
+    define_exec = define
+
+    def _repl_exec(self, cmd):
+        return eval(cmd, self.namespace)
+
+
+def test_webrepl_binary_protocol(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = os.urandom(5000)
+    local = _write(tmp_path / 'host.bin', data)
+    dev = _WebREPLDevice(str(tmp_path))
+    transfer = WebREPLFileTransfer(dev)
+    assert transfer.put(local, 'dev.bin').verified
+    assert (tmp_path / 'dev.bin').read_bytes() == data
+    assert transfer.get('dev.bin', str(tmp_path / 'back.bin')).verified
+    assert (tmp_path / 'back.bin').read_bytes() == data
+    with pytest.raises(DeviceException):
+        transfer.get('nope.bin', str(tmp_path / 'host_nope.bin'))
+
+
+def test_device_helpers_run_in_cpython(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    namespace = {}
+    exec(_XFER_CODE, namespace)
+    namespace['_upyd_mkdirs']('a/b/c')
+    assert (tmp_path / 'a' / 'b' / 'c').is_dir()
+    (tmp_path / 'f').write_bytes(b'123')
+    assert namespace['_upyd_stat']('f') == (3, file_hash(str(tmp_path / 'f')))
+    assert isinstance(FileTransfer(None, chunk_size=64)._chunk_size(), int)
+
+
+def test_sync_batched_query_and_manifest(dev, tmp_path):
+    src = tmp_path / 'project'
+    for i in range(10):
+        _write(src / 'mod{}.py'.format(i), 'x = {}\n'.format(i).encode())
+    dev.sync(str(src))
+    assert (src / '.upyd_manifest.json').exists()
+    lines = dev.serial.repl.lines
+    results = dev.sync(str(src))
+    assert all(r.skipped and r.sent == 0 for r in results)
+    # one command for all device hashes
+    assert dev.serial.repl.lines - lines == 1
+
+
+def test_sync_block_delta(dev, tmp_path):
+    src = tmp_path / 'project'
+    data = bytearray(os.urandom(20000))
+    _write(src / 'big.bin', bytes(data))
+    dev.sync(str(src))
+    data[5000:5010] = b'0123456789'
+    data += b'tail'
+    _write(src / 'big.bin', bytes(data))
+    result, = dev.sync(str(src), block_size=1024)
+    assert result.verified and not result.skipped
+    # block with the edit + grown last block
+    assert result.sent == 1024 + len(data) % 1024
+    assert (tmp_path / 'device' / 'big.bin').read_bytes() == bytes(data)
+
+    # shorter file can not be patched in place, full upload
+    _write(src / 'big.bin', bytes(data[:10000]))
+    result, = dev.sync(str(src))
+    assert result.sent == 10000
+    assert (tmp_path / 'device' / 'big.bin').read_bytes() == data[:10000]
@@ -0,0 +1,102 @@
+from upydevice.phantom import (IRQ_MG, IRQ_EVENT_HEADER, IRQ_EVENT_MAGIC,
+                               socket_server)
+import asyncio
+import pytest
+import socket
+import struct
+import threading
+import time
+
+
+class _NoDevice:
+    output = None
+
+    def cmd(self, cmd, silent=False, **kargs):
+        pass
+
+
+def _free_port():
+    soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    soc.bind(('127.0.0.1', 0))
+    port = soc.getsockname()[1]
+    soc.close()
+    return port
+
+
+def _frame(value, count, ticks, data):
+    return (struct.pack(IRQ_EVENT_HEADER, IRQ_EVENT_MAGIC, value, count, ticks)
+            + struct.pack('fff', *data))
+
+
+def _irq_server(port):
+    irq = IRQ_MG(_NoDevice(), 'irq')
+    irq.soc = socket_server(port=port, host='127.0.0.1', soc_timeout=0.2)
+    cli = []
+    connect = threading.Timer(0.1, lambda: cli.append(
+        socket.create_connection(('127.0.0.1', port))))
+    connect.start()
+    irq.soc.start_SOC()
+    connect.join()
+    return irq, cli[0]
+
+
+def test_event_callback_dispatch():
+    irq, cli = _irq_server(_free_port())
+    events = []
+    received = threading.Event()
+
+    def on_event(event):
+        events.append(event)
+        if len(events) == 2:
+            received.set()
+
+    irq.listen(on_event)
+    sent = time.time()
+    frame = _frame(1, 1, 100, (1, 2, 3)) + _frame(0, 2, 150, (4, 5, 6))
+    # frames split across tcp segments are reassembled
+    cli.sendall(frame[:5])
+    time.sleep(0.05)
+    cli.sendall(frame[5:])
+    assert received.wait(2)
+    irq.stop_listen()
+    cli.close()
+    irq.soc.conn.close()
+    assert [(e.value, e.count, e.ticks, e.data) for e in events] == [
+        (1, 1, 100, (1.0, 2.0, 3.0)), (0, 2, 150, (4.0, 5.0, 6.0))]
+    assert events[0].timestamp >= sent
+
+
+def test_event_async_iterator():
+    irq, cli = _irq_server(_free_port())
+
+    async def consume():
+        events = []
+        cli.sendall(b''.join(_frame(1, i, i * 10, (i, i, i))
+                             for i in range(3)))
+        async for event in irq.events():
+            events.append(event)
+            if len(events) == 3:
+                break
+        return events
+
+    events = asyncio.run(consume())
+    cli.close()
+    irq.soc.conn.close()
+    assert [e.count for e in events] == [0, 1, 2]
+
+
+def test_partial_frame_does_not_block_stop():
+    irq, cli = _irq_server(_free_port())
+    irq.listen()
+    # device stops in the middle of a frame
+    cli.sendall(_frame(1, 1, 100, (1, 2, 3))[:5])
+    time.sleep(0.1)
+    t0 = time.monotonic()
+    irq.stop_listen()
+    assert time.monotonic() - t0 < 1
+    assert irq._listener is None
+    cli.sendall(b'\x00' * 3)
+    with pytest.raises(TimeoutError):
+        irq.recv_event(frame_timeout=0.3)
+    cli.close()
+    irq.soc.conn.close()
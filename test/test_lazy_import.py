@@ -0,0 +1,44 @@
+import ast
+import subprocess
+import sys
+import pytest
+
+
+def _loaded(stmt, modules):
+    # fresh interpreter, prints which of modules are in sys.modules
+    code = '{}\nimport sys\nprint([m for m in {!r} if m in sys.modules])'
+    out = subprocess.check_output(
+        [sys.executable, '-c', code.format(stmt, modules)],
+        universal_newlines=True)
+    return ast.literal_eval(out)
+
+
+HEAVY = ['serial', 'dill', 'asyncio', 'upydevice.serialdevice',
+         'upydevice.websocketdevice', 'upydevice.devgroup']
+
+
+def test_import_loads_no_transport():
+    assert _loaded('import upydevice', HEAVY) == []
+    assert _loaded('from upydevice import Device', HEAVY) == []
+
+
+def test_transport_loads_only_its_dependencies():
+    assert _loaded('from upydevice import WebSocketDevice', HEAVY) == [
+        'asyncio', 'upydevice.websocketdevice']
+    assert 'dill' in _loaded(
+        'from upydevice import SerialDevice, code_source\n'
+        'code_source(code_source)', HEAVY)
+
+
+def test_public_names_and_legacy_attributes():
+    import upydevice
+    from upydevice import (SerialDevice, DeviceGroup, DeviceException,
+                           upy_cmd_c_r, netscan)
+    assert SerialDevice.__module__ == 'upydevice.serialdevice'
+    assert set(upydevice.__all__) <= set(dir(upydevice))
+    # names star imported by the transports before lazy loading
+    assert upydevice.DeviceCodeCache.__module__ == 'upydevice.decorators'
+    from upydevice.upydevice import WebSocketDevice
+    assert WebSocketDevice is upydevice.WebSocketDevice
+    with pytest.raises(AttributeError):
+        upydevice.not_a_name
@@ -0,0 +1,83 @@
+from upydevice import netscan
+from upydevice.websocketdevice import net_scan
+import asyncio
+import socket
+import threading
+import time
+
+
+def _free_port():
+    soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    soc.bind(('127.0.0.1', 0))
+    port = soc.getsockname()[1]
+    soc.close()
+    return port
+
+
+def _fake_webrepl(port, banner=True):
+    """Accepts ws handshakes and sends the WebREPL password prompt"""
+    ready = threading.Event()
+
+    def serve():
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.bind(('127.0.0.1', port))
+        srv.listen(8)
+        srv.settimeout(3)
+        ready.set()
+        try:
+            while True:
+                conn, addr = srv.accept()
+                conn.settimeout(1)
+                try:
+                    conn.recv(1024)
+                    if banner:
+                        conn.sendall(b'HTTP/1.1 101 Switching Protocols\r\n'
+                                     b'Upgrade: websocket\r\n\r\n'
+                                     b'\x81\x0aPassword: ')
+                    else:
+                        conn.sendall(b'HTTP/1.0 200 OK\r\n\r\nhello')
+                except OSError:
+                    pass
+                conn.close()
+        except OSError:
+            pass
+        finally:
+            srv.close()
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+
+
+def test_subnet_hosts():
+    subnet, hosts = netscan.subnet_hosts('192.168.1.0/24')
+    assert subnet == '192.168.1'
+    assert hosts[0] == '192.168.1.1' and hosts[-1] == '192.168.1.254'
+    assert len(hosts) == 254
+
+
+def test_scan_probe_webrepl():
+    webrepl, other, closed = _free_port(), _free_port(), _free_port()
+    _fake_webrepl(webrepl)
+    _fake_webrepl(other, banner=False)
+    devs = asyncio.run(netscan.as_scan(['127.0.0.1'],
+                                       ports=[webrepl, other, closed],
+                                       timeout=1, probe=True))
+    by_port = {dev['port']: dev for dev in devs}
+    assert set(by_port) == {webrepl, other}
+    assert by_port[webrepl]['webrepl'] is True
+    assert by_port[other]['webrepl'] is False
+    assert by_port[webrepl]['latency'] < 1000
+
+
+def test_net_scan_subnet_fast_and_cached():
+    port = _free_port()
+    _fake_webrepl(port)
+    start = time.time()
+    devs = net_scan(subnet='127.0.0', ports=[port], timeout=0.5,
+                    cache_ttl=60)
+    assert time.time() - start < 1
+    assert '127.0.0.1' in devs
+    start = time.time()
+    assert net_scan(subnet='127.0.0', ports=[port], cache_ttl=60) == devs
+    assert time.time() - start < 0.05
+    netscan.clear_cache()
@@ -0,0 +1,107 @@
+from upydevice.output import (OutputPipeline, PipeSink, QueueSink,
+                              FileSink, STDOUT, STDERR, PROMPT)
+from upydevice import serialdevice
+from upydevice.serialdevice import SerialDevice
+import queue
+import threading
+import time
+
+
+class _FakeSerial:
+    def __init__(self, *args, **kargs):
+        self.reply = b''
+        self.rx = b''
+
+    def write(self, data):
+        self.rx += data.replace(b'\r', b'\r\n') + self.reply + b'>>> '
+        return len(data)
+
+    def read(self, n=1):
+        data, self.rx = self.rx[:n], self.rx[n:]
+        return data
+
+    def read_all(self):
+        data, self.rx = self.rx, b''
+        return data
+
+    def readable(self):
+        return True
+
+
+def _events(*chunks):
+    events = queue.Queue()
+    pipeline = OutputPipeline(QueueSink(events))
+    for chunk in chunks:
+        pipeline.feed(chunk)
+    pipeline.close()
+    return list(events.queue)
+
+
+def test_classify_stdout_traceback_prompt():
+    out = 'héllo\r\nTraceback (most recent call last):\r\n  File "<stdin>"\r\nNameError: x\r\n>>> '
+    data = out.encode('utf-8')
+    # split inside the multibyte character and the prompt
+    events = _events(data[:2], data[2:40], data[40:-2], data[-2:])
+    assert events == [('héllo\n', STDOUT),
+                      ('Traceback (most recent call last):\n', STDERR),
+                      ('  File "<stdin>"\n', STDERR),
+                      ('NameError: x\n', STDERR),
+                      ('>>> ', PROMPT)]
+
+
+def test_partial_line_before_prompt_and_flush():
+    assert _events(b'1\r\n2>>> ') == [('1\n', STDOUT), ('2', STDOUT),
+                                     ('>>> ', PROMPT)]
+    assert _events(b'no newline') == [('no newline', STDOUT)]
+
+
+def test_slow_sink_does_not_stall_reads():
+    release = threading.Event()
+    received = []
+
+    def slow_sink(text, std):
+        release.wait(2)
+        received.append(text)
+
+    pipeline = OutputPipeline(slow_sink, maxsize=4)
+    start = time.time()
+    for i in range(100):
+        pipeline.feed(b'line %d\r\n' % i)
+    assert time.time() - start < 0.5
+    assert pipeline.dropped > 0
+    release.set()
+    pipeline.close()
+    assert len(received) + pipeline.dropped == 100
+
+
+def test_legacy_pipe_and_file_sink(tmp_path):
+    calls = []
+
+    def pipe(text, std='stdout'):
+        calls.append((text, std))
+
+    log = tmp_path / 'out.log'
+    file_sink = FileSink(str(log), stderr=False)
+    pipeline = OutputPipeline(PipeSink(pipe), file_sink)
+    pipeline.feed(b'a\r\nTraceback (most recent call last):\r\nE\r\n>>> ')
+    pipeline.close()
+    file_sink.close()
+    assert calls == [('a\n', 'stdout'),
+                     ('Traceback (most recent call last):\n', 'stderr'),
+                     ('E\n', 'stderr')]
+    assert log.read_text() == 'a\n'
+
+
+def test_serial_follow_pipeline(monkeypatch):
+    monkeypatch.setattr(serialdevice.serial, 'Serial', _FakeSerial)
+    monkeypatch.setattr(SerialDevice, '_get_serial_port_data',
+                        lambda self, port: ('fake', 'fake', 'fake'))
+    dev = SerialDevice('/dev/fake', init=False)
+    dev.serial.reply = b'0\r\n1\r\n2\r\n'
+    events = queue.Queue()
+    pipeline = OutputPipeline(QueueSink(events))
+    dev.wr_cmd('count()', follow=True, pipe=pipeline)
+    pipeline.join()
+    assert list(events.queue) == [('0\n', STDOUT), ('1\n', STDOUT),
+                                  ('2\n', STDOUT), ('>>> ', PROMPT)]
+    pipeline.close()
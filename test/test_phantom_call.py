@@ -0,0 +1,77 @@
+from upydevice.decorators import (PhantomCall, format_signature,
+                                  upy_cmd_c_r_in_callback)
+from upydevice.phantom import Pin, I2C
+
+
+class _RecordDevice:
+    def __init__(self):
+        self.sent = []
+        self.output = None
+
+    def cmd(self, cmd, silent=False, **kargs):
+        self.sent.append(cmd)
+
+    wr_cmd = cmd
+
+
+def _legacy_cmd(func, args, kwargs, name, prefix=None):
+    flags = ['>', '<', 'object', 'at', '0x']
+    args_repr = [repr(a) for a in args if any(
+        f not in repr(a) for f in flags)]
+    if prefix:
+        kwargs_repr = [f"{k}={v!r}" if not callable(
+            v) else f"{k}={prefix}.{v.__name__}" for k, v in kwargs.items()]
+    else:
+        kwargs_repr = [f"{k}={v!r}" if not callable(
+            v) else f"{k}={v.__name__}" for k, v in kwargs.items()]
+    signature = ", ".join(args_repr + kwargs_repr)
+    return f"{name}.{func}({signature})"
+
+
+def test_command_strings_unchanged():
+    dev = _RecordDevice()
+    led = Pin(dev, 'led')
+    i2c = I2C(dev, 'i2c')
+
+    def handler(x):
+        pass
+
+    led.value()
+    led.value(1)
+    led.irq(trigger=1, handler=handler)
+    i2c.readfrom_mem(0x68, 0x0F, 1)
+    i2c.writeto(0x68, b'\x01\x02')
+    assert dev.sent == [
+        _legacy_cmd('value', (led,), {}, 'led'),
+        _legacy_cmd('value', (led, 1), {}, 'led'),
+        _legacy_cmd('irq', (led,), {'trigger': 1, 'handler': handler}, 'led'),
+        _legacy_cmd('readfrom_mem', (i2c, 0x68, 0x0F, 1), {}, 'i2c'),
+        _legacy_cmd('writeto', (i2c, 0x68, b'\x01\x02'), {}, 'i2c')]
+
+
+def test_signature_filters_default_repr():
+    obj = object()
+    assert format_signature((obj, 'at 0x <object>', 1.5, None), {}) == "1.5, None"
+    assert format_signature((), {'cb': print}, callback_prefix='irq') == "cb=irq.print"
+
+
+def test_non_trivial_method_is_called():
+    calls = []
+
+    class Phantom:
+        def __init__(self, dev):
+            self.dev_dict = {'name': 'ph', 'dev': dev}
+
+        @upy_cmd_c_r_in_callback()
+        def set_cb(self, **kwargs):
+            calls.append(kwargs)
+            return self.dev_dict
+
+    def on_data(x):
+        pass
+
+    dev = _RecordDevice()
+    Phantom(dev).set_cb(callback=on_data)
+    assert calls == [{'callback': on_data}]
+    assert dev.sent == ['ph.set_cb(callback=ph.on_data)']
+    assert not PhantomCall(Phantom.set_cb.__wrapped__).fast_dev_dict
@@ -0,0 +1,144 @@
+from upydevice.precompile import (MpyCache, MpyCross, parse_abi, abi_tag,
+                                  DEVICE_DIR)
+from upydevice.simulator import (SerialSimulator, WebREPLSimulator,
+                                 MpyCrossSimulator)
+from upydevice.serialdevice import SerialDevice
+from upydevice.websocketdevice import WebSocketDevice
+from upydevice.devgroup import DeviceGroup
+import os
+import stat
+import sys
+
+SOURCE = 'def big():\n{}    return a99\n'.format(
+    ''.join('    a{0} = {0}\n'.format(i) for i in range(100)))
+
+MODULE = """import time
+def blink(n):
+    return [i % 2 for i in range(n)]
+t0 = time.ticks_ms()
+print('loaded')
+"""
+
+
+def _precompile(dev, cache_dir, compiler=None):
+    dev.precompile.compiler = compiler or MpyCrossSimulator()
+    dev.precompile.cache = MpyCache(cache_dir)
+    dev.precompile.enabled = True
+    return dev.precompile
+
+
+def test_parse_abi():
+    # 1.19 esp32 firmware reports mpy v6 without arch (bytecode only)
+    abi = parse_abi(6, '1.19.1', 'ESP32 module with ESP32')
+    assert abi_tag(abi) == 'v6.0-xtensawin'
+    assert parse_abi(6 | 1 << 8 | 4 << 10, '1.21.0',
+                     'Raspberry Pi Pico with RP2040').arch == 'armv6m'
+    assert parse_abi(5, '1.17', 'unknown board').arch == ''
+
+
+def test_precompiled_code(tmp_path):
+    root = str(tmp_path / 'dev')
+    os.mkdir(root)
+    with SerialSimulator(root=root) as sim:
+        dev = SerialDevice(sim.port, init=True)
+        precompile = _precompile(dev, str(tmp_path / 'cache'))
+        assert precompile.use()
+
+        @dev.code
+        def add(a, b=1):
+            return a + b
+        assert add(2, b=3) == 5
+        assert dev.code_cache.define('big', SOURCE)
+        assert dev.wr_cmd('big()', silent=True, rtn_resp=True) == 99
+        assert precompile.compiler.n_compiled == 2
+        assert sorted(os.listdir(os.path.join(root, DEVICE_DIR[1:]))) == [
+            '_upyd_f_add.mpy', '_upyd_f_big.mpy']
+        # compile errors are pasted, the device reports them
+        assert dev.code_cache.define('bad', 'def bad(:\n    pass\n')
+        assert 'SyntaxError' in dev.response
+        # new boot session: compiled files are reused, not sent again
+        mpy = os.path.join(root, DEVICE_DIR[1:], '_upyd_f_big.mpy')
+        mtime = os.stat(mpy).st_mtime_ns
+        dev.reset_ready()
+        dev.code_cache.clear()
+        assert dev.code_cache.define('big', SOURCE)
+        assert dev.wr_cmd('big()', silent=True, rtn_resp=True) == 99
+        assert precompile.compiler.n_compiled == 2
+        assert precompile.cache.hits == 1
+        assert os.stat(mpy).st_mtime_ns == mtime
+        dev.disconnect()
+
+
+def test_precompiled_load(tmp_path):
+    script = tmp_path / 'blink.py'
+    script.write_text(MODULE)
+    with WebREPLSimulator(password='mpy') as sim:
+        dev = WebSocketDevice(sim.address, 'mpy', init=True)
+        _precompile(dev, str(tmp_path / 'cache'))
+        dev.load(str(script))
+        assert 'loaded' in dev.response
+        assert dev.wr_cmd('blink(4)', silent=True, rtn_resp=True) == [0, 1,
+                                                                     0, 1]
+        dev.disconnect()
+
+
+FAKE_MPY_CROSS = """#!{}
+import marshal, sys
+if sys.argv[1] == '--version':
+    print('MicroPython v1.19.1 on 2022-06-18; mpy-cross emitting mpy v6')
+    sys.exit()
+out, name, src = sys.argv[2], sys.argv[4], sys.argv[-1]
+assert sys.argv[5] == '-march=xtensawin'
+with open(src) as f:
+    code = compile(f.read(), name, 'exec')
+with open(out, 'wb') as f:
+    f.write(b'M\\x06\\x00\\x1f' + marshal.dumps(code))
+"""
+
+
+def test_mpy_cross(tmp_path):
+    path = tmp_path / 'mpy-cross'
+    path.write_text(FAKE_MPY_CROSS.format(sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    with SerialSimulator() as sim:
+        dev = SerialDevice(sim.port, init=True)
+        _precompile(dev, str(tmp_path / 'cache'), MpyCross(str(path)))
+        assert dev.precompile.compiler.version == (6, 0)
+        assert dev.code_cache.define('big', SOURCE)
+        assert dev.wr_cmd('big()', silent=True, rtn_resp=True) == 99
+        assert dev.precompile.cache.misses == 1
+        dev.disconnect()
+
+
+def test_group_compiles_once(tmp_path):
+    with SerialSimulator() as sim_a, SerialSimulator() as sim_b:
+        devs = [SerialDevice(sim_a.port, init=True, name='a'),
+                SerialDevice(sim_b.port, init=True, name='b')]
+        group = DeviceGroup(devs)
+        compiler = MpyCrossSimulator()
+        for dev in group.devs.values():
+            _precompile(dev, str(tmp_path / 'cache'), compiler)
+
+        @group.code
+        def double(x):
+            return 2 * x
+        assert double(4) == {'a': 8, 'b': 8}
+        assert compiler.n_compiled == 1
+        for dev in devs:
+            dev.disconnect()
+
+
+def test_fallback(tmp_path):
+    with SerialSimulator() as sim:
+        dev = SerialDevice(sim.port, init=True)
+        # no mpy-cross
+        precompile = _precompile(dev, str(tmp_path / 'cache'),
+                                 MpyCross(path=str(tmp_path / 'missing')))
+        assert not precompile.use()
+        # mpy-cross for another mpy version than the firmware
+        precompile.compiler = MpyCrossSimulator(version=(5, 0))
+        assert not precompile.use()
+        assert dev.code_cache.define('big', SOURCE)
+        assert dev.wr_cmd('big()', silent=True, rtn_resp=True) == 99
+        assert precompile.cache.misses == 0
+        dev.disconnect()
@@ -0,0 +1,81 @@
+from upydevice import netscan
+from upydevice.websocketdevice import WebSocketDevice
+import socket
+import time
+
+
+def _listener():
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.bind(('127.0.0.1', 0))
+    srv.listen(64)
+    return srv, srv.getsockname()[1]
+
+
+class _FakeSock:
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+
+class _FakeWs:
+    """Answers an empty line with the REPL prompt after a delay"""
+
+    def __init__(self, delay=0.0):
+        self.sock = _FakeSock()
+        self.delay = delay
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def read_frame(self):
+        if self.delay > self.sock.timeout:
+            time.sleep(self.sock.timeout)
+            raise socket.timeout
+        time.sleep(self.delay)
+        return True, 1, b'\r\n>>> '
+
+    def reset_buffers(self):
+        pass
+
+
+def test_tcp_ping_open_and_refused():
+    srv, port = _listener()
+    res = netscan.tcp_ping('127.0.0.1', port, timeout=0.5, n_tries=3)
+    assert res['reachable'] and res['lost'] == 0
+    assert 0 <= res['min(ms)'] <= res['latency(ms)'] <= res['max(ms)'] < 500
+    srv.close()
+    # refused: host is up
+    res = netscan.tcp_ping('127.0.0.1', port, timeout=0.5)
+    assert res['reachable']
+
+
+def test_check_reachable_concurrent():
+    servers = [_listener() for i in range(20)]
+    targets = [('127.0.0.{}'.format(i + 1), port)
+               for i, (srv, port) in enumerate(servers)]
+    targets.append(('unknown.invalid', 8266))
+    start = time.time()
+    results = netscan.check_reachable(targets, timeout=0.3)
+    assert time.time() - start < 1
+    assert results['unknown.invalid']['reachable'] is False
+    assert results['unknown.invalid']['loss(%)'] == 100.0
+    assert results['127.0.0.1']['reachable']
+    for srv, port in servers:
+        srv.close()
+
+
+def test_connected_device_repl_ping():
+    dev = WebSocketDevice.__new__(WebSocketDevice)
+    dev.ip, dev.port, dev.prompt = '127.0.0.1', 8266, b'>>> '
+    dev.connected = True
+    dev.flush = lambda: None
+    dev.ws = _FakeWs(delay=0.01)
+    res = dev.is_reachable(n_tries=2, latency=True)
+    assert res['reachable'] and res['lost'] == 0
+    assert res['min(ms)'] >= 10
+    assert dev.ws.sent == ['\r', '\r']
+    assert dev.is_reachable()
+    dev.ws = _FakeWs(delay=1)
+    start = time.time()
+    assert not dev.is_reachable(n_tries=1, timeout=0.1)
+    assert time.time() - start < 0.5
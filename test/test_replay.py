@@ -0,0 +1,91 @@
+from upydevice.replay import (TraceRecorder, TracePlayer, load_trace,
+                              WRITE, READ)
+from upydevice.simulator import (SerialSimulator, WebREPLSimulator,
+                                 BleSimulator)
+from upydevice.serialdevice import SerialDevice
+from upydevice.websocketdevice import WebSocketDevice
+import asyncio
+import time
+
+CMDS = ['x = 21', 'x * 2', "'abc' * 40", 'import os; os.uname().sysname',
+        "print('\\n'.join(str(i) for i in range(20)))"]
+
+
+def _session(dev):
+    return [dev.wr_cmd(cmd, silent=True, rtn_resp=True) for cmd in CMDS]
+
+
+def test_record_and_replay_serial(tmp_path):
+    path = str(tmp_path / 'serial.upyt')
+    with SerialSimulator() as sim:
+        dev = SerialDevice(sim.port, init=True)
+        with TraceRecorder(dev, path) as rec:
+            expected = _session(dev)
+        assert not isinstance(dev.serial, rec._proxy)
+        dev.disconnect()
+    trace = load_trace(path)
+    assert trace.meta['dev_class'] == 'SerialDevice'
+    assert {event.direction for event in trace.events} == {WRITE, READ}
+    assert trace.events[0].data == b'x = 21\r'
+
+    player = TracePlayer(path, speed=None)
+    assert player.commands() == CMDS
+    with SerialSimulator(repl=player) as sim:
+        dev = SerialDevice(sim.port, init=True)
+        with player:
+            assert _session(dev) == expected
+        assert player.wait(1) and player.n_reads > 0
+        # the trace can be played again
+        with player:
+            assert _session(dev) == expected
+        dev.disconnect()
+    player.close()
+
+
+def test_record_and_replay_webrepl():
+    with WebREPLSimulator(password='rec', latency=0.01) as sim:
+        dev = WebSocketDevice(sim.address, 'rec', init=True)
+        with TraceRecorder(dev) as rec:
+            t0 = time.monotonic()
+            expected = _session(dev)
+            recorded = time.monotonic() - t0
+        dev.disconnect()
+    assert rec.trace.events[0].kind == 1
+    assert recorded > 0.01 * len(CMDS)
+    # as fast as possible (no device latency) and with the recorded timing
+    for speed in (None, 1):
+        player = TracePlayer(rec.trace, speed=speed)
+        with WebREPLSimulator(password='rec', repl=player) as sim:
+            dev = WebSocketDevice(sim.address, 'rec', init=True)
+            with player:
+                t0 = time.monotonic()
+                assert _session(dev) == expected
+                elapsed = time.monotonic() - t0
+            dev.disconnect()
+        player.close()
+        if speed is None:
+            assert elapsed < recorded / 2
+        else:
+            assert elapsed > recorded * 0.8
+
+
+def test_record_and_replay_ble():
+    from upydevice.bledevice import BleDevice
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sim = BleSimulator(mtu=64)
+    with sim.patch():
+        dev = BleDevice(sim.address, init=True, lenbuff=61)
+        with TraceRecorder(dev) as rec:
+            expected = _session(dev)
+        dev.disconnect()
+    player = TracePlayer(rec.trace, speed=None)
+    sim = BleSimulator(mtu=64, repl=player)
+    with sim.patch():
+        dev = BleDevice(sim.address, init=True, lenbuff=61)
+        with player:
+            assert _session(dev) == expected
+        dev.disconnect()
+    player.close()
+    asyncio.set_event_loop(None)
+    loop.close()
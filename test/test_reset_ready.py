@@ -0,0 +1,130 @@
+from upydevice.backoff import Backoff
+from upydevice.exceptions import DeviceException, DeviceNotFound
+from upydevice import serialdevice
+from upydevice.serialdevice import SerialDevice
+from upydevice.simulator import REPLSimulator, SerialSimulator
+import asyncio
+import time
+import pytest
+
+_BANNER = (b'MPY: soft reboot\r\nMicroPython v1.19.1 on 2022-06-18; '
+           b'ESP32 module with ESP32\r\nType "help()" for more information.'
+           b'\r\n>>> ')
+
+
+class _RebootingSerial:
+    """Emits the boot banner in chunks some time after a reset"""
+    boot_time = 0.2
+    banner = _BANNER
+
+    def __init__(self, *args, **kargs):
+        self.port = '/dev/fake'
+        self.is_open = True
+        self.t_reset = None
+        self.sent = 0
+
+    def write(self, data):
+        if data in (b'\x04', b'import machine; machine.reset()\r'):
+            self.t_reset = time.monotonic()
+        return len(data)
+
+    def read_all(self):
+        if self.t_reset is None:
+            return b''
+        elapsed = time.monotonic() - self.t_reset - self.boot_time
+        if elapsed < 0:
+            return b''
+        # ~40 bytes every 10 ms
+        n = min(len(self.banner), int(elapsed * 4000) + 1)
+        data = self.banner[self.sent:n]
+        self.sent = n
+        return data
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+    def open(self):
+        self.is_open = True
+
+
+class _HungSerial(_RebootingSerial):
+    banner = b'MPY: soft reboot\r\nrunning main.py\r\n'
+
+
+def _serial_dev(monkeypatch, serial_class):
+    monkeypatch.setattr(serialdevice.serial, 'Serial', serial_class)
+    monkeypatch.setattr(SerialDevice, '_get_serial_port_data',
+                        lambda self, port: ('fake', 'fake', 'fake'))
+    return SerialDevice('/dev/fake', init=False)
+
+
+def test_backoff_intervals_and_deadline():
+    backoff = Backoff(0.3, initial=0.01, factor=2, max_interval=0.05)
+    intervals = [backoff.next_interval() for i in range(5)]
+    assert intervals[:3] == [0.01, 0.02, 0.04]
+    assert max(intervals) <= 0.05
+    backoff.reset()
+    assert backoff.next_interval() == 0.01
+    n = 0
+    while backoff.sleep():
+        n += 1
+    assert backoff.expired() and not backoff.sleep()
+    assert 0.3 <= backoff.elapsed < 0.5
+    assert n < 15
+
+
+def test_backoff_async():
+    async def wait():
+        backoff = Backoff(0.1, initial=0.01)
+        while await backoff.as_sleep():
+            pass
+        return backoff.elapsed
+    assert 0.1 <= asyncio.run(wait()) < 0.3
+
+
+def test_serial_reset_ready(monkeypatch):
+    dev = _serial_dev(monkeypatch, _RebootingSerial)
+    elapsed = dev.reset_ready(timeout=2)
+    assert _RebootingSerial.boot_time <= elapsed < 1
+    assert dev.buff == _BANNER
+
+
+def test_serial_reset_ready_reopens_port(monkeypatch):
+    dev = _serial_dev(monkeypatch, _RebootingSerial)
+    dev.serial.close()
+    dev.reset_ready(hr=True, timeout=2)
+    assert dev.serial.is_open
+
+
+def test_serial_reset_ready_timeout(monkeypatch):
+    dev = _serial_dev(monkeypatch, _HungSerial)
+    t0 = time.monotonic()
+    with pytest.raises(DeviceNotFound):
+        dev.reset_ready(timeout=0.5)
+    assert time.monotonic() - t0 < 1.5
+
+
+class _HungREPL(REPLSimulator):
+    """Echoes input but never runs it, so no prompt comes back"""
+
+    def feed(self, data):
+        self.output(data)
+
+
+def test_serial_repl_exec_timeout():
+    with SerialSimulator(repl=_HungREPL()) as sim:
+        dev = SerialDevice(sim.port, init=False)
+        t0 = time.monotonic()
+        with pytest.raises(DeviceException) as excinfo:
+            dev._repl_exec('_upyd_put(0, 1024)', timeout=0.5)
+        assert time.monotonic() - t0 < 1.5
+        assert "b'_upyd_put(0, 1024)" in str(excinfo.value)
+        # blocking port restored
+        assert dev.serial.timeout is None
+        dev.disconnect()
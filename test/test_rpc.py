@@ -0,0 +1,178 @@
+from upydevice.rpc import pack, unpack
+from upydevice.exceptions import DeviceException
+from upydevice.phantom import Pin
+from upydevice.simulator import (SerialSimulator, WebREPLSimulator,
+                                 BleSimulator)
+from upydevice.serialdevice import SerialDevice
+from upydevice.websocketdevice import WebSocketDevice
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import pytest
+import time
+
+VALUES = [None, True, False, 0, -1, 2**40, -2**70, 2.5, '', 'héllo',
+          b'\x00\xa5\x03', bytearray(b'\xff'), [1, [2, (3,)]], (),
+          {'a': {'b': [1.5, None]}, 1: 'int key'}]
+
+GEN = """def _gen(n):
+    for i in range(n):
+        yield {'i': i, 'sq': i * i}
+"""
+
+
+def test_codec_round_trip():
+    for value in VALUES:
+        assert unpack(pack(value)) == value
+        assert type(unpack(pack(value))) is type(value)
+    with pytest.raises(TypeError):
+        pack({1, 2})
+
+
+def _session(dev):
+    dev.wr_cmd('from machine import Pin; led = Pin(2, Pin.OUT)',
+               silent=True)
+    with dev.rpc as rpc:
+        # typed results, same encoding on both sides
+        assert rpc.eval(repr(VALUES)) == VALUES
+        assert rpc.call('len', list(range(10))) == 10
+        # other types come back as their repr
+        assert 'esp32' in rpc.call('os.uname')
+        assert rpc.call('int', '7f', 16) == 127
+        with pytest.raises(DeviceException) as exc:
+            rpc.eval('1/0')
+        assert 'ZeroDivisionError' in str(exc.value)
+        # pipelined requests, results in order
+        calls = [rpc.call_async('pow', i, 2) for i in range(40)]
+        assert [call.result() for call in calls] == [i * i for i in
+                                                      range(40)]
+        rpc.exec(GEN)
+        assert list(rpc.stream('_gen', 5))[-1] == {'i': 4, 'sq': 16}
+        out = []
+        rpc.on_output = out.append
+        rpc.exec("print('from device')")
+        assert ''.join(out).strip() == 'from device'
+
+        # code decorated functions and phantom commands use the agent
+        @dev.code
+        def add(a, b=1):
+            return a + b
+        assert add(b'x', b=b'y') == b'xy'
+        led = Pin(dev, 'led')
+        led.on()
+        assert led.value() == 1
+        with dev.batch():
+            led.off()
+            value = led.value()
+        assert value.result() == 0
+    assert not dev.rpc.active
+    # back to the REPL
+    assert dev.wr_cmd('add(1, 2)', silent=True, rtn_resp=True) == 3
+    assert dev.rpc.n_calls > 50
+
+
+def test_rpc_serial():
+    with SerialSimulator() as sim:
+        dev = SerialDevice(sim.port, init=True)
+        _session(dev)
+        dev.disconnect()
+
+
+def test_rpc_webrepl():
+    with WebREPLSimulator(password='rpc') as sim:
+        dev = WebSocketDevice(sim.address, 'rpc', init=True)
+        _session(dev)
+        dev.disconnect()
+
+
+def test_rpc_ble():
+    from upydevice.bledevice import BleDevice
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sim = BleSimulator(mtu=64)
+    with sim.patch():
+        dev = BleDevice(sim.address, init=True, lenbuff=61)
+        _session(dev)
+        dev.disconnect()
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def test_rpc_not_started():
+    with SerialSimulator() as sim:
+        dev = SerialDevice(sim.port, init=True)
+        with pytest.raises(DeviceException):
+            dev.rpc.call('len', [])
+        dev.disconnect()
+
+
+SOURCES = """import time
+_n = [0]
+def _sample():
+    _n[0] += 1
+    return (time.ticks_ms(), _n[0])
+def _count(n):
+    for i in range(n):
+        yield i
+def _fail():
+    yield 1
+    raise OSError('sensor')
+"""
+
+
+def _channels(dev):
+    with dev.rpc as rpc:
+        rpc.exec(SOURCES)
+        # commands interleaved with a generator channel
+        channel = rpc.open_channel('_count', 100, window=8)
+        items = []
+        for item in channel:
+            items.append(item)
+            if item % 10 == 0:
+                assert rpc.call('pow', item, 2) == item * item
+        assert items == list(range(100)) and channel.closed
+        # sampled channel, paused by flow control while not consumed
+        with rpc.open_channel('_sample', period=5, window=4) as sampled:
+            assert sampled.get()[1] == 1
+            time.sleep(0.2)
+            assert rpc.eval('_n[0]') == 4
+            assert [sampled.get()[1] for i in range(6)] == list(range(2, 8))
+        assert sampled.closed
+        n = rpc.eval('_n[0]')
+        time.sleep(0.05)
+        assert rpc.eval('_n[0]') == n
+        # one thread consumes, others send commands
+        channel = rpc.open_channel('_count', 200, window=16)
+        with ThreadPoolExecutor(3) as pool:
+            consumer = pool.submit(lambda: list(channel))
+            callers = [pool.submit(lambda k=k: [rpc.call('pow', k, i)
+                                                for i in range(20)])
+                       for k in (2, 3)]
+            assert consumer.result(10) == list(range(200))
+            assert callers[1].result(10)[-1] == 3 ** 19
+        channel = rpc.open_channel('_fail')
+        assert channel.get() == 1
+        with pytest.raises(DeviceException):
+            channel.get()
+        with pytest.raises(DeviceException):
+            rpc.open_channel('_missing')
+    assert dev.wr_cmd('_n[0] > 0', silent=True, rtn_resp=True) is True
+
+
+def test_channels_serial():
+    with SerialSimulator() as sim:
+        dev = SerialDevice(sim.port, init=True)
+        _channels(dev)
+        dev.disconnect()
+
+
+def test_channels_ble():
+    from upydevice.bledevice import BleDevice
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sim = BleSimulator(mtu=64)
+    with sim.patch():
+        dev = BleDevice(sim.address, init=True, lenbuff=61)
+        _channels(dev)
+        dev.disconnect()
+    asyncio.set_event_loop(None)
+    loop.close()
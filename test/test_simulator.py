@@ -0,0 +1,122 @@
+from upydevice.simulator import (REPLSimulator, SerialSimulator,
+                                 WebREPLSimulator, BleSimulator, LinkModel)
+from upydevice.serialdevice import SerialDevice
+from upydevice.websocketdevice import WebSocketDevice
+from upydevice.exceptions import DeviceException, DeviceNotFound
+import asyncio
+import os
+import queue
+import time
+import pytest
+
+
+def _repl(**kargs):
+    repl = REPLSimulator(**kargs)
+    out = queue.Queue()
+    repl.output = out.put
+    return repl, out
+
+
+def _read_until(out, end=b'>>> ', timeout=2):
+    data = b''
+    deadline = time.monotonic() + timeout
+    while not data.endswith(end):
+        data += out.get(timeout=max(0, deadline - time.monotonic()))
+    return data
+
+
+def test_repl_expression_and_traceback():
+    repl, out = _repl()
+    repl.feed(b'1+1\r')
+    assert _read_until(out) == b'1+1\r\n2\r\n>>> '
+    repl.feed(b'1/0\r')
+    resp = _read_until(out)
+    assert b'Traceback (most recent call last):' in resp
+    assert b'ZeroDivisionError' in resp
+    repl.close()
+
+
+def test_repl_paste_mode_and_stub_modules(tmp_path):
+    repl, out = _repl(root=str(tmp_path))
+    repl.feed(b'\x05')
+    _read_until(out, b'=== ')
+    repl.feed(b"import os\rf = open('a.txt', 'w')\rf.write('hi')\r"
+              b"f.close()\rprint(os.listdir(), os.uname().sysname)\x04")
+    assert b"['a.txt'] esp32" in _read_until(out)
+    assert (tmp_path / 'a.txt').read_text() == 'hi'
+    repl.close()
+
+
+def test_repl_interrupt_and_soft_reset():
+    repl, out = _repl()
+    repl.feed(b'x = 1\rimport time; time.sleep(10)\r')
+    _read_until(out)
+    time.sleep(0.05)
+    repl.feed(b'\x03')
+    assert b'KeyboardInterrupt' in _read_until(out)
+    repl.feed(b'\x04')
+    assert b'soft reboot' in _read_until(out)
+    repl.feed(b'x\r')
+    assert b'NameError' in _read_until(out)
+    assert repl.n_resets == 1
+    repl.close()
+
+
+def test_link_model():
+    link = LinkModel(latency=0.01, bandwidth=1000, mtu=20)
+    assert link.delay(100) == pytest.approx(0.11)
+    assert [len(p) for p in link.split(b'x' * 50)] == [20, 20, 10]
+
+
+def test_serial_device(tmp_path):
+    with SerialSimulator() as sim:
+        dev = SerialDevice(sim.port, init=True)
+        assert dev.wr_cmd('1+1', silent=True, rtn_resp=True) == 2
+        dev.wr_cmd('1/0', silent=True)
+        with pytest.raises(DeviceException):
+            dev.raise_traceback()
+
+        @dev.code
+        def double(x):
+            return x * 2
+        assert double(21) == 42
+
+        local = tmp_path / 'data.bin'
+        local.write_bytes(os.urandom(700))
+        assert dev.put(str(local), 'data.bin').verified
+        assert dev.get('data.bin', str(tmp_path / 'back.bin')).verified
+        assert (tmp_path / 'back.bin').read_bytes() == local.read_bytes()
+
+        dev.reset_ready(timeout=5)
+        assert sim.repl.n_resets == 1
+        assert dev.wr_cmd('1+2', silent=True, rtn_resp=True) == 3
+        dev.disconnect()
+
+
+def test_webrepl_device():
+    with WebREPLSimulator(password='secret') as sim:
+        dev = WebSocketDevice(sim.address, 'secret', init=True)
+        assert dev.wr_cmd('1+1', silent=True, rtn_resp=True) == 2
+        dev.reset_ready(hr=True, timeout=5)
+        assert sim.n_connections == 2
+        assert dev.wr_cmd('1+2', silent=True, rtn_resp=True) == 3
+        dev.disconnect()
+        with pytest.raises(DeviceNotFound):
+            WebSocketDevice(sim.address, 'wrong', init=True)
+
+
+def test_ble_device():
+    from upydevice.bledevice import BleDevice
+    # BleDevice runs on the current thread event loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sim = BleSimulator(mtu=64)
+    with sim.patch():
+        dev = BleDevice(sim.address, init=True, lenbuff=61)
+        assert dev.wr_cmd('1+1', silent=True, rtn_resp=True) == 2
+        assert dev.wr_cmd("'x' * 300", silent=True, rtn_resp=True) == 'x' * 300
+        dev.reset_ready(timeout=5)
+        assert dev.wr_cmd('1+2', silent=True, rtn_resp=True) == 3
+        dev.disconnect()
+    asyncio.set_event_loop(None)
+    loop.close()
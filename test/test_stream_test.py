@@ -0,0 +1,74 @@
+from upydevice.phantom import (STREAMER, STREAM_TEST_RESULT, UDP_HEADER,
+                               socket_server, udp_socket_server)
+import socket
+import struct
+import threading
+import time
+
+
+class _NoDevice:
+    output = None
+
+
+def _free_port():
+    soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    soc.bind(('127.0.0.1', 0))
+    port = soc.getsockname()[1]
+    soc.close()
+    return port
+
+
+def _fake_tcp_streamer(port, n_packets, period):
+    time.sleep(0.1)
+    cli = socket.create_connection(('127.0.0.1', port))
+    for i in range(n_packets):
+        cli.sendall(struct.pack('fff', i, i, i))
+        time.sleep(period)
+    cli.close()
+
+
+def test_result_stats():
+    arrivals = [i * 0.01 for i in range(101)]
+    result = STREAM_TEST_RESULT(arrivals, packet_size=12, lost=0, bins=4)
+    assert result.n_packets == 101
+    assert round(result.mean_interval, 3) == 10.0
+    assert result.jitter < 1e-6
+    assert round(result.samples_per_s) == 101
+    assert round(result.bytes_per_s) == 1212
+    assert sum(count for lo, hi, count in result.histogram) == 100
+    assert result.as_dict()['loss(%)'] == 0.0
+
+
+def test_stream_test_tcp_loopback():
+    port = _free_port()
+    stream = STREAMER(_NoDevice(), 'streamer', n_vars=3, port=port)
+    stream.soc = socket_server(port=port, host='127.0.0.1', soc_timeout=1)
+    sender = threading.Thread(target=_fake_tcp_streamer,
+                              args=(port, 30, 0.005))
+    sender.start()
+    stream.soc.start_SOC()
+    result = stream.stream_test(n_samples=20, init=False)
+    sender.join()
+    stream.soc.conn.close()
+    stream.soc.serv_soc.close()
+    assert result.n_samples == 20
+    assert result.n_bytes == 20 * 12
+    assert len(result.inter_arrival) == 19
+    assert result.samples_per_s > 0
+
+
+def test_stream_test_udp_loopback():
+    stream = STREAMER(_NoDevice(), 'streamer', n_vars=3, udp=True)
+    stream.soc = udp_socket_server(port=0, host='127.0.0.1', soc_timeout=0.2)
+    stream.soc.start_SOC()
+    addr = stream.soc.serv_soc.getsockname()
+    cli = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for seq in [0, 1, 2, 4, 5, 6, 7, 8, 9, 10, 11, 12]:
+        cli.sendto(struct.pack(UDP_HEADER, seq, seq * 10)
+                   + struct.pack('fff', seq, seq, seq), addr)
+    cli.close()
+    result = stream.stream_test(duration=0.5, mode='udp', init=False)
+    stream.soc.close()
+    assert result.n_packets == 12
+    assert result.lost == 1
+    assert result.loss == round(100 / 13, 2)
@@ -0,0 +1,82 @@
+from upydevice.tracing import (CommandTracer, LatencyHistogram, CMD_TRACE,
+                               PHASES, TOTAL)
+from upydevice.simulator import (SerialSimulator, WebREPLSimulator,
+                                 BleSimulator)
+from upydevice.serialdevice import SerialDevice
+from upydevice.websocketdevice import WebSocketDevice
+import asyncio
+import pytest
+
+
+def test_histogram_percentiles_and_buckets():
+    hist = LatencyHistogram(maxlen=100)
+    for ms in range(1, 101):
+        hist.add(ms / 1e3)
+    assert hist.percentile(50) == pytest.approx(0.050)
+    assert hist.percentile(95) == pytest.approx(0.095)
+    assert hist.percentile(100) == pytest.approx(0.100)
+    buckets = hist.buckets(edges=(10, 50))
+    assert buckets == {'<=10': 10, '<=50': 40, '>50': 50}
+    summary = hist.summary()
+    assert summary['n'] == 100 and summary['p99(ms)'] == pytest.approx(99)
+    hist.add(1.0)
+    assert len(hist.samples) == 100 and hist.count == 101
+
+
+def test_tracer_disabled_and_callback_errors():
+    tracer = CommandTracer(None)
+    span = tracer.span('1+1')
+    span.mark('write')
+    span.end()
+    assert tracer.stats() == {}
+    tracer.enable(callback=lambda trace: 1 / 0)
+    tracer.span('1+1').end(sent=4, received=9)
+    assert tracer.errors == 1 and tracer.bytes_received == 9
+    assert list(tracer.stats()) == [TOTAL]
+
+
+def _check_traces(dev):
+    traces = []
+    dev.tracer.enable(callback=traces.append)
+    for i in range(5):
+        assert dev.wr_cmd('1+1', silent=True, rtn_resp=True) == 2
+    dev.tracer.disable()
+    dev.wr_cmd('1+1', silent=True)
+    assert len(traces) == 5
+    trace = traces[-1]
+    assert isinstance(trace, CMD_TRACE) and trace.cmd == '1+1'
+    assert set(trace.phases) <= set(PHASES)
+    assert {'write', 'first_byte', 'prompt', 'parse'} <= set(trace.phases)
+    assert sum(trace.phases.values()) <= trace.elapsed
+    assert trace.sent > 0 and trace.received >= len('2\r\n>>> ')
+    stats = dev.tracer.stats()
+    assert stats[TOTAL]['n'] == 5
+    assert stats['prompt']['p95(ms)'] <= stats[TOTAL]['max(ms)']
+    assert 'retries' in dev.tracer.report()
+
+
+def test_serial_tracing():
+    with SerialSimulator() as sim:
+        dev = SerialDevice(sim.port, init=True)
+        _check_traces(dev)
+        dev.disconnect()
+
+
+def test_webrepl_tracing():
+    with WebREPLSimulator(password='trace') as sim:
+        dev = WebSocketDevice(sim.address, 'trace', init=True)
+        _check_traces(dev)
+        dev.disconnect()
+
+
+def test_ble_tracing():
+    from upydevice.bledevice import BleDevice
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sim = BleSimulator()
+    with sim.patch():
+        dev = BleDevice(sim.address, init=True)
+        _check_traces(dev)
+        dev.disconnect()
+    asyncio.set_event_loop(None)
+    loop.close()
@@ -0,0 +1,139 @@
+from upydevice.phantom import (STREAMER, UDP_STREAM_TRACKER, UDP_HEADER,
+                               udp_socket_server)
+from types import SimpleNamespace
+import importlib.util
+import os
+import socket
+import struct
+import sys
+import time
+
+
+class _NoDevice:
+    output = None
+
+
+def test_tracker_in_order():
+    tracker = UDP_STREAM_TRACKER()
+    released = []
+    for seq in range(10):
+        released += tracker.push(seq, seq * 10, (seq,))
+    assert [p[0] for p in released] == list(range(10))
+    stats = tracker.stats()
+    assert stats['lost'] == 0
+    assert stats['reordered'] == 0
+    assert stats['fs(hz)'] == 100.0
+
+
+def test_tracker_reorder_and_loss():
+    tracker = UDP_STREAM_TRACKER(reorder_window=2)
+    released = []
+    for seq in [0, 2, 1, 3, 3, 7, 8, 9, 5]:
+        released += tracker.push(seq, seq * 10, (seq,))
+    released += tracker.flush()
+    assert [p[0] for p in released] == [0, 1, 2, 3, 7, 8, 9]
+    stats = tracker.stats()
+    assert stats['reordered'] == 1
+    assert stats['duplicates'] == 1
+    assert stats['lost'] == 3
+    assert stats['late'] == 1
+
+
+def test_tracker_ticks_wrap():
+    tracker = UDP_STREAM_TRACKER()
+    tracker.push(0, (1 << 30) - 5, (0,))
+    tracker.push(1, 5, (1,))
+    assert tracker.stats()['duration(s)'] == 0.01
+
+
+def test_udp_loopback():
+    stream = STREAMER(_NoDevice(), 'streamer', n_vars=3)
+    stream.soc = udp_socket_server(port=0, host='127.0.0.1', soc_timeout=1)
+    stream.soc.start_SOC()
+    addr = stream.soc.serv_soc.getsockname()
+    cli = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for seq in [0, 1, 3, 2]:
+        cli.sendto(struct.pack(UDP_HEADER, seq, seq * 100)
+                   + struct.pack('fff', seq, seq, seq), addr)
+    released = []
+    for i in range(4):
+        released += stream.soc_recv_udp_message()
+    cli.close()
+    stream.soc.close()
+    assert [p[0] for p in released] == [0, 1, 2, 3]
+    assert released[-1][2] == (3.0, 3.0, 3.0)
+    stats = stream.get_udp_stats()
+    assert stats['lost'] == 0
+    assert stats['reordered'] == 1
+
+
+def test_tracker_seq_wrap():
+    period = 1 << 32
+    tracker = UDP_STREAM_TRACKER()
+    released = []
+    for seq in [period - 2, period - 1, 1, 0, 2]:
+        released += tracker.push(seq, 0, (seq,))
+    assert [p[0] for p in released] == [period - 2, period - 1, 0, 1, 2]
+    assert tracker.stats()['reordered'] == 1
+    # gap across the wrap around
+    tracker = UDP_STREAM_TRACKER()
+    for seq in [period - 1, 1, 2]:
+        tracker.push(seq, 0, (seq,))
+    tracker.flush()
+    assert tracker.stats()['lost'] == 1
+
+
+class _UDPSocket:
+    def __init__(self, fail=False):
+        self.sent = []
+        self.fail = fail
+
+    def sendto(self, data, addr):
+        if self.fail:
+            raise OSError('ENOMEM')
+        self.sent.append(bytes(data))
+
+
+def _u_streamer(monkeypatch):
+    # device module with the MicroPython modules it imports
+    stubs = {'machine': SimpleNamespace(Timer=lambda n: None),
+             'usocket': socket, 'ustruct': struct,
+             'micropython': SimpleNamespace(const=lambda x: x)}
+    for name, module in stubs.items():
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.setattr(time, 'ticks_ms', lambda: 0, raising=False)
+    path = os.path.join(os.path.dirname(__file__), '..', 'upydevice_utils',
+                        'STREAMER_util.py')
+    spec = importlib.util.spec_from_file_location('STREAMER_util', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    streamer = module.U_STREAMER(n_vars=1, buffer_size=2)
+    streamer.read_method = lambda: [1.0]
+    streamer.udp_buff = bytearray(module.UDP_HEADER_SIZE + 8)
+    streamer.udp_soc = _UDPSocket()
+    return streamer
+
+
+def test_device_seq_counts_sent_packets(monkeypatch):
+    streamer = _u_streamer(monkeypatch)
+    # chunk mode: 2 samples per packet, a busy tick drops a sample
+    for tick in range(3):
+        streamer.udp_chunk_send_call(None)
+    streamer.irq_busy = True
+    streamer.udp_chunk_send_call(None)
+    streamer.irq_busy = False
+    assert streamer.udp_stats() == [1, 1]
+    # a packet that can not be sent drops its samples, no sequence gap
+    streamer.udp_soc.fail = True
+    for tick in range(3):
+        streamer.udp_chunk_send_call(None)
+    assert streamer.udp_stats() == [1, 3]
+    streamer.udp_soc.fail = False
+    streamer.udp_sample_send_call(None)
+    seqs = [struct.unpack_from(UDP_HEADER, data)[0]
+            for data in streamer.udp_soc.sent]
+    assert seqs == [0, 1]
+    # wraps around at the header field size
+    streamer.udp_seq = (1 << 32) - 1
+    streamer.udp_sample_send_call(None)
+    assert streamer.udp_seq == 0
@@ -20,6 +20,71 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from .upydevice import *
+"""
+Device classes and helpers are loaded on first access (PEP 562), so
+`import upydevice` does not import pyserial, dill, asyncio or the transports
+that are not used.
+"""
+
+import importlib
+
 name = 'upydevice'
 __version__ = '0.3.8'
+
+# public name: submodule that defines it
+_LAZY = {}
+for _module, _names in (
+        ('upydevice', ('check_device_type', 'Device')),
+        ('serialdevice', ('serial_ports', 'get_serial_port_data',
+                          'list_comp_devices', 'serial_scan',
+                          'BASE_SERIAL_DEVICE', 'SERIAL_DEVICE',
+                          'SerialDevice')),
+        ('websocketdevice', ('REPR_IMPORTS_CMD', 'REPR_CMDS', 'CA_PATH',
+                             'get_ssid', 'net_scan', 'BASE_WS_DEVICE',
+                             'WS_DEVICE', 'WebSocketDevice')),
+        ('devgroup', ('DEV_RESULT', 'DEVGROUP', 'DeviceGroup',
+                      'AsyncDeviceGroup')),
+        ('decorators', ('uparser_dec', 'upy_code', 'code_source',
+                        'DeviceCodeCache', 'format_signature', 'PhantomCall',
+                        'DeviceBatch', 'upy_cmd', 'upy_cmd_c',
+                        'upy_cmd_c_raw', 'upy_cmd_c_r', 'upy_cmd_c_raw_r',
+                        'upy_cmd_c_r_in_callback', 'upy_cmd_c_r_nb',
+                        'upy_cmd_c_r_nb_in_callback', 'upy_wrcmd_c_r',
+                        'upy_wrcmd_c_r_in_callback')),
+        ('exceptions', ('DeviceException', 'DeviceNotFound')),
+        ('broker', ('DeviceBroker', 'BrokerDevice'))):
+    _LAZY.update(dict.fromkeys(_names, _module))
+del _module, _names
+
+# modules that were star imported before lazy loading, searched in this
+# order for any other name
+_LEGACY = ('serialdevice', 'websocketdevice', 'devgroup', 'decorators',
+           'exceptions')
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(attr):
+    if attr in _LAZY:
+        value = getattr(importlib.import_module(
+            '.' + _LAZY[attr], __name__), attr)
+        globals()[attr] = value
+        return value
+    if not attr.startswith('_'):
+        try:
+            # from upydevice import <submodule>
+            return importlib.import_module('.' + attr, __name__)
+        except ModuleNotFoundError as e:
+            if e.name != '{}.{}'.format(__name__, attr):
+                raise
+        for module in _LEGACY:
+            mod = importlib.import_module('.' + module, __name__)
+            if hasattr(mod, attr):
+                value = globals()[attr] = getattr(mod, attr)
+                return value
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, attr))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
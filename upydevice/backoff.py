@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Exponential backoff with a deadline"""
+
+import asyncio
+import time
+
+
+class Backoff:
+    """
+    Polling intervals growing from initial by factor up to max_interval,
+    sleep() returns False once the deadline (timeout s from now) is reached.
+    """
+
+    def __init__(self, timeout, initial=0.02, factor=2, max_interval=0.5):
+        self.start = time.monotonic()
+        self.deadline = self.start + timeout
+        self.initial = initial
+        self.factor = factor
+        self.max_interval = max_interval
+        self.interval = initial
+        self.tries = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def remaining(self):
+        return max(0, self.deadline - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.deadline
+
+    def reset(self):
+        self.interval = self.initial
+
+    def next_interval(self):
+        interval = min(self.interval, self.remaining())
+        self.interval = min(self.interval * self.factor, self.max_interval)
+        self.tries += 1
+        return interval
+
+    def sleep(self):
+        if self.expired():
+            return False
+        time.sleep(self.next_interval())
+        return True
+
+    async def as_sleep(self):
+        if self.expired():
+            return False
+        await asyncio.sleep(self.next_interval())
+        return True
@@ -42,7 +42,15 @@ import sys
 import traceback
 from binascii import hexlify
 from .exceptions import DeviceException, DeviceNotFound
-from .decorators import getsource
+from .decorators import (DeviceBatch, DeviceCodeCache, code_source,
+                         active_rpc)
+from .executor import DeviceExecutor
+from .rpc import DeviceRPC
+from .backoff import Backoff
+from .compression import DeviceCompression
+from .precompile import DevicePrecompile
+from .filetransfer import FileTransfer
+from .tracing import CommandTracer, NULL_SPAN
 import functools
 from unsync import unsync
 import re
@@ -116,6 +124,14 @@ class BASE_BLE_DEVICE:
         self.platform = None
         self.break_flag = None
         self.log = conn_debug
+        self.code_cache = DeviceCodeCache(self)
+        self.filetransfer = FileTransfer(self)
+        self.executor = DeviceExecutor(self)
+        self.compression = DeviceCompression(self)
+        self.precompile = DevicePrecompile(self)
+        self.rpc = DeviceRPC(self)
+        self.tracer = CommandTracer(self)
+        self._span = NULL_SPAN
         #
         if init:
             self.connect(debug=self.log)
@@ -444,6 +460,7 @@ class BASE_BLE_DEVICE:
 
     def read_callback(self, sender, data):
         self.raw_buff += data
+        self._span.first_byte()
 
     def read_callback_follow(self, sender, data):
         try:
@@ -499,12 +516,13 @@ class BASE_BLE_DEVICE:
         if len(data) > self.len_buffer:
             for i in range(0, len(data), self.len_buffer):
                 await self.ble_client.write_gatt_char(self.writeables['Nordic UART RX'], data[i:i+self.len_buffer])
-                await asyncio.sleep(0.1, loop=self.loop)
+                await asyncio.sleep(0.1)
 
         else:
             await self.ble_client.write_gatt_char(self.writeables['Nordic UART RX'], data)
+        self._span.mark('write')
         while self.prompt not in self.raw_buff:
-            await asyncio.sleep(0, loop=self.loop)
+            await asyncio.sleep(0)
         await self.ble_client.stop_notify(self.readables['Nordic UART TX'])
         if rtn_buff:
             return self.raw_buff
@@ -523,7 +541,7 @@ class BASE_BLE_DEVICE:
             await self.ble_client.write_gatt_char(self.writeables['Nordic UART RX'], data)
         while self.prompt not in self.raw_buff:
             try:
-                await asyncio.sleep(0, loop=self.loop)
+                await asyncio.sleep(0)
             except KeyboardInterrupt:
                 print('Catch here1')
                 data = bytes(self._kbi, 'utf-8')
@@ -576,6 +594,14 @@ class BASE_BLE_DEVICE:
         self.write_char_raw(key='Nordic UART RX', data=cmd)
         return n_bytes
 
+    def _kbi_cmd(self):
+        if self.loop.is_running():  # command running in executor thread
+            asyncio.run_coroutine_threadsafe(
+                self.as_write_char(self.writeables['Nordic UART RX'],
+                                   bytes(self._kbi+'\r', 'utf-8')), self.loop)
+        else:
+            self.bytes_sent = self.write(self._kbi+'\r')
+
     def read_all(self):
         try:
             return self.raw_buff
@@ -601,6 +627,7 @@ class BASE_BLE_DEVICE:
         self.buff = b''
         self.pipe = pipe
         self._cmdstr = cmd
+        span = self._span = self.tracer.span(cmd)
         # self.flush()
         data = self.fmt_data(cmd)  # make fmt_data
         self.bytes_sent = len(data)
@@ -611,7 +638,11 @@ class BASE_BLE_DEVICE:
         self.buff = self.read_all()
         if self.buff == b'':
             # time.sleep(0.1)
+            span.retry()
             self.buff = self.read_all()
+        span.mark('prompt')
+        self._span = NULL_SPAN
+        received = len(self.buff)
         # print(self.buff)
         # filter command
         if follow:
@@ -638,8 +669,10 @@ class BASE_BLE_DEVICE:
                     self.response = ''
             else:
                 self.response = ''
+        span.mark('decode')
         if rtn:
             self.get_output()
+            span.mark('parse')
             if self.output == '\n' and self.output == '':
                 self.output = None
             if self.output is None:
@@ -647,6 +680,7 @@ class BASE_BLE_DEVICE:
                     self.output = self.response
             if nb_queue is not None:
                 nb_queue.put((self.output), block=False)
+        span.end(sent=self.bytes_sent, received=received)
         if rtn_resp:
             return self.output
 
@@ -658,6 +692,7 @@ class BASE_BLE_DEVICE:
         self.buff = b''
         self._cmdstr = cmd
         self.cmd_finished = False
+        span = self._span = self.tracer.span(cmd)
         # self.flush()
         data = self.fmt_data(cmd)  # make fmt_data
         n_bytes = len(data)
@@ -670,7 +705,11 @@ class BASE_BLE_DEVICE:
             self.buff = await self.as_write_read_waitp(data, rtn_buff=True)
         if self.buff == b'':
             # time.sleep(0.1)
+            span.retry()
             self.buff = self.read_all()
+        span.mark('prompt')
+        self._span = NULL_SPAN
+        received = len(self.buff)
         # print(self.buff)
         # filter command
         if follow:
@@ -690,13 +729,16 @@ class BASE_BLE_DEVICE:
                 print(self.response)
             else:
                 self.response = ''
+        span.mark('decode')
         if rtn:
             self.get_output()
+            span.mark('parse')
             if self.output == '\n' and self.output == '':
                 self.output = None
             if self.output is None:
                 if self.response != '' and self.response != '\n':
                     self.output = self.response
+        span.end(sent=self.bytes_sent, received=received)
         self.cmd_finished = True
         if rtn_resp:
             return self.output
@@ -715,7 +757,7 @@ class BASE_BLE_DEVICE:
     async def as_kbi(self):
         for i in range(1):
             print('This is buff: {}'.format(self.raw_buff))
-            await asyncio.sleep(1, loop=self.loop)
+            await asyncio.sleep(1)
             data = bytes(self._kbi + '\r', 'utf-8')
             await self.ble_client.write_gatt_char(self.writeables['Nordic UART RX'], data)
 
@@ -729,6 +771,7 @@ class BASE_BLE_DEVICE:
                 pipe(self.response.replace('\n\n', '\n'))
 
     def reset(self, silent=False, reconnect=True, hr=False):
+        self.code_cache.clear()
         if not silent:
             print('Rebooting device...')
         if not hr:
@@ -744,6 +787,7 @@ class BASE_BLE_DEVICE:
             print('Done!')
 
     async def as_reset(self, silent=True, reconnect=True, hr=False):
+        self.code_cache.clear()
         if not silent:
             print('Rebooting device...')
         if not hr:
@@ -761,19 +805,63 @@ class BASE_BLE_DEVICE:
             print('Done!')
         return None
 
+    async def as_reset_ready(self, hr=False, timeout=30, silent=True):
+        """
+        Reset, wait for disconnection and advertising, then reconnect with
+        exponential backoff until timeout (s). Returns elapsed s.
+        """
+        self.code_cache.clear()
+        if not silent:
+            print('Rebooting device...')
+        backoff = Backoff(timeout, initial=0.05, max_interval=1)
+        try:
+            await self.as_write_char(self.writeables['Nordic UART RX'],
+                                     bytes(self._hreset if hr else self._reset,
+                                           'utf-8'))
+        except Exception:
+            # device may drop the connection before the write response
+            pass
+        while self.ble_client.is_connected and await backoff.as_sleep():
+            pass
+        self.connected = False
+        backoff.reset()
+        while not backoff.expired():
+            dev = await BleakScanner.find_device_by_address(
+                self.UUID, timeout=max(0.5, min(5, backoff.remaining())))
+            if dev is not None:
+                await self.connect_client(n_tries=1, debug=self.log)
+                if self.connected:
+                    break
+            await backoff.as_sleep()
+        if not self.connected:
+            raise DeviceNotFound('BleDevice @ {} not ready after {} s'.format(
+                self.UUID, timeout))
+        if not silent:
+            print('Done! ({:.2f} s)'.format(backoff.elapsed))
+        return backoff.elapsed
+
+    def reset_ready(self, hr=False, timeout=30, silent=True):
+        return self.loop.run_until_complete(
+            self.as_reset_ready(hr=hr, timeout=timeout, silent=silent))
+
     def cmd_nb(self, command, silent=False, rtn=True, long_string=False,
                rtn_resp=False, follow=False, pipe=None, multiline=False,
-               dlog=False, block_dev=True):
+               dlog=False, block_dev=True, timeout=None):
         if block_dev:
-            pass  # Not possible in multiprocessing
-            # self.dev_process_raw = multiprocessing.Process(
-            #     target=self.wr_cmd, args=(command, silent, rtn, long_string, rtn_resp,
-            #                               follow, pipe, multiline, dlog,
-            #                               self.output_queue))
-            # self.dev_process_raw.start()
+            return self.executor.submit(self.wr_cmd, command, silent=silent,
+                                        rtn=rtn, long_string=long_string,
+                                        rtn_resp=rtn_resp, follow=follow,
+                                        pipe=pipe, multiline=multiline,
+                                        dlog=dlog, timeout=timeout)
         else:
             self.bytes_sent = self.write(command+'\r')
 
+    def get_opt(self):
+        nb_cmd = self.executor.pop_last()
+        if nb_cmd is not None and not nb_cmd.cancelled():
+            if nb_cmd.exception() is None:
+                self.output = nb_cmd.result()
+
     def get_output(self):
         try:
             self.output = ast.literal_eval(self.response)
@@ -1207,6 +1295,29 @@ class BLE_DEVICE(BASE_BLE_DEVICE):
                 else:
                     return "{}: {}".format(field, val)
 
+    def _repl_exec(self, cmd):
+        self.wr_cmd(cmd, silent=True, rtn=True)
+        return self.output
+
+    def put(self, local, remote=None, verify=True, compress=None):
+        """Upload a file, returns TRANSFER"""
+        return self.filetransfer.put(local, remote, verify=verify,
+                                     compress=compress)
+
+    def get(self, remote, local=None, verify=True, compress=None):
+        """Download a file, returns TRANSFER"""
+        return self.filetransfer.get(remote, local, verify=verify,
+                                     compress=compress)
+
+    def sync(self, local_dir, remote_dir='', verify=True, exclude=(),
+             **kargs):
+        """
+        Upload changed files of a directory (block delta for large files),
+        see FileTransfer.sync, returns list of TRANSFER
+        """
+        return self.filetransfer.sync(local_dir, remote_dir, verify=verify,
+                                      exclude=exclude, **kargs)
+
 
 class BleDevice(BLE_DEVICE):
     def __init__(self, *args, **kargs):
@@ -1214,6 +1325,9 @@ class BleDevice(BLE_DEVICE):
         self.pipe = None
         self.pipe_mode = "stdout"
 
+    def batch(self, max_calls=32):
+        return DeviceBatch(self, max_calls=max_calls)
+
     async def as_paste_buff(self, cmd, **kargs):
         # print('Here')
         long_command = cmd
@@ -1243,12 +1357,13 @@ class BleDevice(BLE_DEVICE):
             print(e)
 
     def code(self, func):
-        str_func = '\n'.join(getsource(func).split('\n')[1:])
-        self.paste_buff(str_func)
-        self.cmd('\x04', silent=True)
+        self.code_cache.define(func.__name__, code_source(func))
 
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
+            rpc = active_rpc(self)
+            if rpc is not None:
+                return rpc.call(func.__name__, *args, **kwargs)
             flags = ['>', '<', 'object', 'at', '0x']
             args_repr = [repr(a) for a in args if any(
                 f not in repr(a) for f in flags)]
@@ -1262,9 +1377,7 @@ class BleDevice(BLE_DEVICE):
         return wrapper_cmd
 
     def code_follow(self, func):
-        str_func = '\n'.join(getsource(func).split('\n')[1:])
-        self.paste_buff(str_func)
-        self.cmd('\x04', silent=True)
+        self.code_cache.define(func.__name__, code_source(func))
 
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
@@ -1281,6 +1394,8 @@ class BleDevice(BLE_DEVICE):
         return wrapper_cmd
 
     def load(self, file):
+        if self.precompile.use() and self.precompile.load(file):
+            return
         with open(file, 'r') as upy_file:
             upy_content = upy_file.read()
         self.paste_buff(upy_content)
@@ -1440,6 +1555,7 @@ class AsyncBleDevice(BLE_DEVICE):
 
         else:
             await self.ble_client.write_gatt_char(self.writeables['Nordic UART RX'], data)
+        self._span.mark('write')
         while self.prompt not in self.raw_buff:
             await asyncio.sleep(0)
         await self.ble_client.stop_notify(self.readables['Nordic UART TX'])
@@ -1486,6 +1602,7 @@ class AsyncBleDevice(BLE_DEVICE):
             self._cmdstr = cmd
         self.cmd_finished = False
         self.pipe = pipe
+        span = self._span = self.tracer.span(cmd)
         # self.flush()
         data = self.fmt_data(cmd)  # make fmt_data
         n_bytes = len(data)
@@ -1498,7 +1615,11 @@ class AsyncBleDevice(BLE_DEVICE):
             self.buff = await self.as_write_read_waitp(data, rtn_buff=True)
         if self.buff == b'':
             # time.sleep(0.1)
+            span.retry()
             self.buff = self.read_all()
+        span.mark('prompt')
+        self._span = NULL_SPAN
+        received = len(self.buff)
         # print(self.buff)
         # filter command
         if follow:
@@ -1518,13 +1639,16 @@ class AsyncBleDevice(BLE_DEVICE):
                 print(self.response)
             else:
                 self.response = ''
+        span.mark('decode')
         if rtn:
             self.get_output()
+            span.mark('parse')
             if self.output == '\n' and self.output == '':
                 self.output = None
             if self.output is None:
                 if self.response != '' and self.response != '\n':
                     self.output = self.response
+        span.end(sent=self.bytes_sent, received=received)
         self.cmd_finished = True
         if rtn_resp:
             return self.output
@@ -1555,6 +1679,13 @@ class AsyncBleDevice(BLE_DEVICE):
     def reset(self, **kargs):
         return self.un_reset(**kargs).result()
 
+    @unsync
+    async def un_reset_ready(self, **kargs):
+        return await self.as_reset_ready(**kargs)
+
+    def reset_ready(self, **kargs):
+        return self.un_reset_ready(**kargs).result()
+
     # async def as_kbi(self, silent=True, pipe=None):
     #     data = bytes(self._kbi + '\r', 'utf-8')
     #     await self.ble_client.write_gatt_char(self.writeables['Nordic UART RX'], data)
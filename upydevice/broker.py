@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Local broker daemon holding persistent device connections"""
+
+from array import array
+import argparse
+import ast
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from .exceptions import DeviceException, DeviceNotFound
+
+# device methods clients can call through the broker (besides wr_cmd)
+BROKER_METHODS = ('cmd', 'reset', 'reset_ready', 'kbi', 'paste_buff',
+                  'is_reachable', 'put', 'get', 'sync')
+
+_ERRORS = {'DeviceException': DeviceException,
+           'DeviceNotFound': DeviceNotFound,
+           'TimeoutError': TimeoutError}
+
+
+def default_socket_path():
+    """Per user broker socket in the temp dir (UPYDEVICE_BROKER overrides)"""
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.environ.get('UPYDEVICE_BROKER', os.path.join(
+        tempfile.gettempdir(), 'upydevice-broker-{}.sock'.format(uid)))
+
+
+def _encode(value):
+    # json friendly results (e.g. TRANSFER namedtuples as dicts)
+    if hasattr(value, '_asdict'):
+        return {k: _encode(v) for k, v in value._asdict().items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    if isinstance(value, (bytes, bytearray, array)):
+        return repr(value)
+    return value
+
+
+def _send(sock_file, msg):
+    sock_file.write(json.dumps(msg).encode() + b'\n')
+    sock_file.flush()
+
+
+def _recv(sock_file):
+    line = sock_file.readline()
+    if not line:
+        raise ConnectionError('Broker connection closed')
+    return json.loads(line)
+
+
+class _Session:
+    """A broker device, commands from all clients run under its lock"""
+
+    def __init__(self, name, address, password, kargs, device):
+        self.name = name
+        self.address = address
+        self.password = password
+        self.kargs = kargs
+        self.dev = device
+        self.lock = threading.Lock()
+        self.n_cmds = 0
+        self.since = time.time()
+
+    def info(self):
+        return {'name': self.name, 'address': self.address,
+                'dev_class': getattr(self.dev, 'dev_class', None),
+                'n_cmds': self.n_cmds, 'since': self.since}
+
+
+class DeviceBroker:
+    """
+    Unix socket server that keeps one connection per registered device and
+    serves any number of local clients (see BrokerDevice). Commands to the
+    same device are serialized, different devices run concurrently.
+
+        $ python -m upydevice.broker [--socket PATH]
+    """
+
+    def __init__(self, path=None, device_factory=None):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise DeviceException('Broker needs Unix domain sockets')
+        self.path = path or default_socket_path()
+        if device_factory is None:
+            from .upydevice import Device as device_factory
+        self.device_factory = device_factory
+        self.sessions = {}
+        self.n_clients = 0
+        self._lock = threading.Lock()
+        self._sock = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    # SERVER
+
+    def bind(self):
+        if os.path.exists(self.path):
+            if _alive(self.path):
+                raise DeviceException(
+                    'Broker already running at {}'.format(self.path))
+            os.remove(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self._sock.listen()
+        self._sock.settimeout(0.2)
+        return self
+
+    def serve_forever(self):
+        if self._sock is None:
+            self.bind()
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn, _ = self._sock.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                threading.Thread(target=self._serve_client, args=(conn,),
+                                 daemon=True).start()
+        finally:
+            self._close()
+
+    def start(self):
+        """Serve in a background thread"""
+        self.bind()
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='upydevice-broker', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _close(self):
+        self._sock.close()
+        self._sock = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        for name in list(self.sessions):
+            try:
+                self.unregister(name)
+            except Exception:
+                # device already gone
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _serve_client(self, conn):
+        with self._lock:
+            self.n_clients += 1
+        sock_file = conn.makefile('rwb')
+        try:
+            while True:
+                try:
+                    req = _recv(sock_file)
+                except (ConnectionError, OSError, ValueError):
+                    break
+                try:
+                    resp = {'result': self.handle(req)}
+                except Exception as e:
+                    resp = {'error': type(e).__name__,
+                            'message': getattr(e, 'message', None) or str(e)}
+                _send(sock_file, resp)
+                if req.get('op') == 'shutdown':
+                    break
+        finally:
+            sock_file.close()
+            conn.close()
+            with self._lock:
+                self.n_clients -= 1
+
+    # OPS
+
+    def handle(self, req):
+        op = req.get('op')
+        if op == 'wr_cmd':
+            return self.wr_cmd(req['dev'], req['cmd'],
+                               long_string=req.get('long_string', False))
+        if op == 'call':
+            return self.call(req['dev'], req['method'], req.get('args', []),
+                             req.get('kwargs', {}))
+        if op == 'register':
+            return self.register(req['address'], req.get('password'),
+                                 name=req.get('name'),
+                                 **req.get('kwargs', {}))
+        if op == 'unregister':
+            return self.unregister(req['dev'])
+        if op == 'devices':
+            return [session.info() for session in self.sessions.values()]
+        if op == 'ping':
+            return {'pid': os.getpid(), 'clients': self.n_clients,
+                    'devices': list(self.sessions)}
+        if op == 'shutdown':
+            self._stop.set()
+            return True
+        raise DeviceException('Unknown broker op: {}'.format(op))
+
+    def register(self, address, password=None, name=None, **kargs):
+        """Connect to a device (once), returns its session info"""
+        name = name or address
+        with self._lock:
+            session = self.sessions.get(name)
+            if session is None:
+                # connecting can take seconds (BLE), other devices keep running
+                session = self.sessions[name] = _Session(
+                    name, address, password, kargs, None)
+                session.lock.acquire()
+            elif session.address != address:
+                raise DeviceException('{} already registered as {}'.format(
+                    name, session.address))
+            else:
+                session = None
+        if session is None:
+            # wait if another client is still connecting it
+            session = self._session(name)
+            with session.lock:
+                if session.dev is None:
+                    raise DeviceNotFound('{} failed to connect'.format(name))
+            return session.info()
+        try:
+            session.dev = self.device_factory(address, password, init=True,
+                                              **kargs)
+        except BaseException:
+            with self._lock:
+                self.sessions.pop(name, None)
+            raise
+        finally:
+            session.lock.release()
+        return session.info()
+
+    def unregister(self, name):
+        with self._lock:
+            session = self.sessions.pop(name, None)
+        if session is None:
+            return False
+        with session.lock:
+            if session.dev is not None:
+                session.dev.disconnect()
+        return True
+
+    def _session(self, name):
+        session = self.sessions.get(name)
+        if session is None:
+            raise DeviceNotFound('{} not registered in broker'.format(name))
+        return session
+
+    def wr_cmd(self, name, cmd, long_string=False):
+        session = self._session(name)
+        with session.lock:
+            dev = session.dev
+            if dev is None:
+                raise DeviceNotFound('{} failed to connect'.format(name))
+            dev.wr_cmd(cmd, silent=True, long_string=long_string)
+            session.n_cmds += 1
+            return dev.response
+
+    def call(self, name, method, args, kwargs):
+        if method not in BROKER_METHODS:
+            raise DeviceException('{} not allowed through broker'.format(
+                method))
+        session = self._session(name)
+        with session.lock:
+            if session.dev is None:
+                raise DeviceNotFound('{} failed to connect'.format(name))
+            result = getattr(session.dev, method)(*args, **kwargs)
+            session.n_cmds += 1
+            return _encode(result)
+
+
+def _alive(path):
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        client.close()
+        return True
+    except OSError:
+        return False
+
+
+def spawn_broker(path=None, timeout=5):
+    """Start a detached broker process and wait for its socket"""
+    path = path or default_socket_path()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+        ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    subprocess.Popen([sys.executable, '-m', 'upydevice.broker',
+                      '--socket', path], env=env, start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while not _alive(path):
+        if time.monotonic() > deadline:
+            raise DeviceException('Broker did not start at {}'.format(path))
+        time.sleep(0.01)
+    return path
+
+
+class BrokerDevice:
+    """
+    Device proxy served by a local DeviceBroker, connecting only opens the
+    broker socket, the device connection is kept by the broker.
+
+        dev = BrokerDevice('192.168.1.42', 'mypass')  # or Device(..., broker=True)
+        dev.wr_cmd('led.on()')
+    """
+
+    def __init__(self, address, password=None, name=None, path=None,
+                 autostart=True, init=True, **kargs):
+        self.address = address
+        self.name = name or address
+        self.path = path or default_socket_path()
+        self.autostart = autostart
+        self.password = password
+        self.kargs = kargs
+        self.output = None
+        self.response = ''
+        self.dev_class = None
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._traceback = 'Traceback (most recent call last):'
+        if init:
+            self.connect()
+
+    def connect(self):
+        if self._sock is not None:
+            return
+        if not _alive(self.path):
+            if not self.autostart:
+                raise DeviceNotFound('No broker at {}'.format(self.path))
+            spawn_broker(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self.path)
+        self._file = self._sock.makefile('rwb')
+        info = self.request('register', address=self.address,
+                            password=self.password, name=self.name,
+                            kwargs=self.kargs)
+        self.dev_class = info['dev_class']
+
+    def disconnect(self):
+        """Close the broker connection, the device stays connected"""
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    def is_connected(self):
+        return self._sock is not None
+
+    def request(self, op, **kargs):
+        kargs['op'] = op
+        with self._lock:
+            if self._file is None:
+                raise DeviceException('Not connected to broker')
+            _send(self._file, kargs)
+            resp = _recv(self._file)
+        if 'error' in resp:
+            raise _ERRORS.get(resp['error'], DeviceException)(
+                '{}: {}'.format(resp['error'], resp['message'])
+                if resp['error'] not in _ERRORS else resp['message'])
+        return resp['result']
+
+    def wr_cmd(self, cmd, silent=False, rtn=True, rtn_resp=False,
+               long_string=False, **kargs):
+        self.output = None
+        self.response = self.request('wr_cmd', dev=self.name, cmd=cmd,
+                                     long_string=long_string)
+        if not silent:
+            if self.response != '\n' and self.response != '':
+                print(self.response)
+        if rtn:
+            self.get_output()
+            if self.output is None:
+                if self.response != '' and self.response != '\n':
+                    self.output = self.response
+        if rtn_resp:
+            return self.output
+
+    cmd = wr_cmd
+
+    def call(self, method, *args, **kwargs):
+        """Call a device method in the broker (see BROKER_METHODS)"""
+        return self.request('call', dev=self.name, method=method, args=args,
+                            kwargs=kwargs)
+
+    def reset(self, **kargs):
+        return self.call('reset', **kargs)
+
+    def reset_ready(self, **kargs):
+        return self.call('reset_ready', **kargs)
+
+    def kbi(self, **kargs):
+        return self.call('kbi', **kargs)
+
+    def paste_buff(self, long_command):
+        return self.call('paste_buff', long_command)
+
+    # local paths are resolved here, the broker process has its own cwd
+
+    def put(self, local, remote=None, **kargs):
+        """Upload a file (see FileTransfer.put)"""
+        return self.call('put', os.path.abspath(local), remote, **kargs)
+
+    def get(self, remote, local=None, **kargs):
+        """Download a file (see FileTransfer.get)"""
+        local = os.path.abspath(local or os.path.basename(remote))
+        return self.call('get', remote, local, **kargs)
+
+    def sync(self, local_dir, remote_dir='', **kargs):
+        """Upload changed files of a directory (see FileTransfer.sync)"""
+        if isinstance(kargs.get('manifest'), str):
+            kargs['manifest'] = os.path.abspath(kargs['manifest'])
+        return self.call('sync', os.path.abspath(local_dir), remote_dir,
+                         **kargs)
+
+    def get_output(self):
+        try:
+            self.output = ast.literal_eval(self.response)
+        except Exception:
+            if 'bytearray' in self.response:
+                try:
+                    self.output = bytearray(ast.literal_eval(
+                        self.response.strip().split('bytearray')[1]))
+                except Exception:
+                    pass
+            elif 'array' in self.response:
+                try:
+                    arr = ast.literal_eval(
+                        self.response.strip().split('array')[1])
+                    self.output = array(arr[0], arr[1])
+                except Exception:
+                    pass
+
+    def raise_traceback(self):
+        if self._traceback in self.response:
+            tr_index = re.search(r'\b(Traceback)\b', self.response).start()
+            raise DeviceException(self.response[tr_index:])
+
+    def __repr__(self):
+        return 'BrokerDevice @ {}, Type: {}, Broker: {}'.format(
+            self.address, self.dev_class, self.path)
+
+
+def main(path):
+    broker = DeviceBroker(path)
+    print('upydevice broker at {} (pid {})'.format(broker.path, os.getpid()))
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--socket', default=None,
+                        help='Unix socket path (default: {})'.format(
+                            default_socket_path()))
+    args = parser.parse_args()
+    main(args.socket)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Deflate compressed code and file uploads/downloads"""
+
+from binascii import b2a_base64
+from collections import OrderedDict, namedtuple
+import hashlib
+import threading
+import zlib
+from .decorators import repl_exec
+from .exceptions import DeviceException
+
+# device decompression/compression support (probed once per device)
+ZCAPS = namedtuple('ZCAPS', ['decompress', 'compress'])
+
+# smaller uploads are sent as is, and compressed data must save at least
+# 10 % (random/already compressed files are sent as is)
+MIN_SIZE = 256
+MAX_RATIO = 0.9
+LEVEL = 9
+
+# device side helpers, defined when compression is first used. deflate
+# (v1.21+) or zlib/uzlib DecompIO (older firmware) for decompression,
+# only deflate can compress (MICROPY_PY_DEFLATE_COMPRESS builds)
+_ZLIB_CODE = """try:
+    import ubinascii as _upyd_zba
+except ImportError:
+    import binascii as _upyd_zba
+def _upyd_zcap():
+    try:
+        import deflate
+        return (True, hasattr(deflate.DeflateIO, 'write'))
+    except ImportError:
+        pass
+    for m in ('zlib', 'uzlib'):
+        try:
+            if hasattr(__import__(m), 'DecompIO'):
+                return (True, False)
+        except ImportError:
+            pass
+    return (False, False)
+def _upyd_zio(f):
+    try:
+        import deflate
+        return deflate.DeflateIO(f, deflate.ZLIB)
+    except ImportError:
+        pass
+    try:
+        import zlib as z
+    except ImportError:
+        import uzlib as z
+    return z.DecompIO(f)
+def _upyd_unz(src, dst, bs=512):
+    import os
+    buf = bytearray(bs)
+    mv = memoryview(buf)
+    n = 0
+    with open(src, 'rb') as f:
+        d = _upyd_zio(f)
+        with open(dst, 'wb') as o:
+            while True:
+                k = d.readinto(buf)
+                if not k:
+                    break
+                o.write(mv[:k])
+                n += k
+    os.remove(src)
+    return n
+def _upyd_z(src, dst, bs=512):
+    import os
+    import deflate
+    buf = bytearray(bs)
+    mv = memoryview(buf)
+    with open(src, 'rb') as f:
+        with open(dst, 'wb') as o:
+            d = deflate.DeflateIO(o, deflate.ZLIB)
+            while True:
+                k = f.readinto(buf)
+                if not k:
+                    break
+                d.write(mv[:k])
+            d.close()
+    return os.stat(dst)[6]
+def _upyd_rm(path):
+    import os
+    os.remove(path)
+def _upyd_zexec(data):
+    import io
+    src = _upyd_zio(io.BytesIO(_upyd_zba.a2b_base64(data))).read()
+    exec(src.decode(), globals())
+"""
+
+_ZLIB_NAME = '_upyd_zlib'
+
+
+class BlobCache:
+    """
+    Compressed blobs by content hash (LRU, up to max_bytes), shared by
+    devices so the same module/file deployed to a group is compressed once.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._blobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compress(self, data, level=LEVEL):
+        key = (hashlib.sha256(data).digest(), level)
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is not None:
+                self._blobs.move_to_end(key)
+                self.hits += 1
+                return blob
+        blob = zlib.compress(data, level)
+        with self._lock:
+            self.misses += 1
+            if key not in self._blobs:
+                self._blobs[key] = blob
+                self.n_bytes += len(blob)
+            while self.n_bytes > self.max_bytes and len(self._blobs) > 1:
+                key, old = self._blobs.popitem(last=False)
+                self.n_bytes -= len(old)
+        return blob
+
+    def clear(self):
+        with self._lock:
+            self._blobs.clear()
+            self.n_bytes = 0
+
+
+BLOB_CACHE = BlobCache()
+
+
+class DeviceCompression:
+    """
+    Deflate compressed code definitions (DeviceCodeCache.define) and file
+    transfers (put/get/sync) for a device, opt-in:
+
+        dev.compression.enabled = True
+        dev.put('lib.py', compress=True)
+
+    Device support is probed once, devices without deflate/zlib
+    decompression fall back to plain uploads.
+    """
+
+    def __init__(self, device, enabled=False, level=LEVEL, cache=BLOB_CACHE):
+        self.dev = device
+        self.enabled = enabled
+        self.level = level
+        self.cache = cache
+        self._caps = None
+
+    def _exec(self, cmd):
+        return repl_exec(self.dev, cmd)
+
+    def setup(self):
+        self.dev.code_cache.define_exec(_ZLIB_NAME, _ZLIB_CODE)
+
+    @property
+    def caps(self):
+        """ZCAPS of the device firmware"""
+        if self._caps is None:
+            self.setup()
+            caps = self._exec('_upyd_zcap()')
+            if not isinstance(caps, tuple):
+                raise DeviceException(self.dev.response)
+            self._caps = ZCAPS(*caps)
+        return self._caps
+
+    def compress(self, data):
+        """Compressed data if worth sending, else None"""
+        if len(data) < MIN_SIZE:
+            return None
+        blob = self.cache.compress(data, self.level)
+        if len(blob) > len(data) * MAX_RATIO:
+            return None
+        return blob
+
+    def use(self, compress=None):
+        """compress argument (None: enabled) and device support"""
+        if compress is None:
+            compress = self.enabled
+        return bool(compress) and self.caps.decompress
+
+    def define(self, name, str_func, register):
+        """
+        Define code with one compressed exec line, returns False if not
+        worth it (code_cache pastes it)
+        """
+        blob = self.compress(str_func.encode('utf-8'))
+        if blob is None:
+            return False
+        data = b2a_base64(blob).rstrip().decode()
+        self._exec(f"_upyd_zexec('{data}'); {register}")
+        return True
+
+    def unzip(self, src, dst):
+        """Decompress a device file into dst (src is removed)"""
+        return self._exec(f"_upyd_unz({src!r}, {dst!r})")
+
+    def zip(self, src, dst):
+        """Compress a device file into dst, returns its size"""
+        return self._exec(f"_upyd_z({src!r}, {dst!r})")
+
+    def remove(self, path):
+        self._exec(f"_upyd_rm({path!r})")
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Streaming datalog capture"""
+
+from array import array
+from collections import deque
+import ast
+import time
+
+_TRACEBACK = 'Traceback (most recent call last):'
+
+
+class DatalogCapture:
+    """
+    Parse device output lines as they arrive (e.g. print(x, y, z) or
+    print((x, y, z)) in a loop) into typed columns with host arrival
+    timestamps.
+
+    Columns are doubles (typecode 'd', exact integers up to 2**53, e.g.
+    time.ticks_ms()), typecode='f' halves memory at float32 precision.
+    max_rows bounds rows kept in memory, when reached rows are appended to
+    spill file (csv) if given, otherwise the oldest rows are dropped.
+    Other lines are kept in lines (last max_lines), and a device traceback
+    from its first line on in traceback (see error).
+    """
+
+    def __init__(self, dvars=None, typecode='d', max_rows=None, spill=None,
+                 units=None, fs=None, max_lines=100):
+        self.dvars = list(dvars) if dvars is not None else None
+        self.typecode = typecode
+        self.max_rows = max_rows
+        self.spill = spill
+        self.units = units
+        self.fs = fs
+        self.columns = None
+        self.ts = array('d')
+        self.t0 = None
+        self.n_rows = 0
+        self.n_spilled = 0
+        self.n_dropped = 0
+        self.n_skipped = 0
+        self.lines = deque(maxlen=max_lines)
+        self.traceback = []
+        self._partial = b''
+        self._spill_file = None
+        if self.dvars is not None:
+            self._init_columns(len(self.dvars))
+
+    def _init_columns(self, n_vars):
+        if self.dvars is None:
+            self.dvars = ['v{}'.format(i) for i in range(n_vars)]
+        self.columns = [array(self.typecode) for _ in self.dvars]
+
+    @staticmethod
+    def parse_line(line):
+        """Values of a line as a tuple of numbers, None if not a data line"""
+        line = line.strip().strip('()[]')
+        if not line:
+            return None
+        try:
+            return tuple(float(val) for val in line.replace(',', ' ').split())
+        except ValueError:
+            pass
+        try:
+            vals = ast.literal_eval('({},)'.format(line))
+        except Exception:
+            return None
+        if all(isinstance(val, (int, float)) for val in vals):
+            return vals
+        return None
+
+    def feed(self, data, timestamp=None):
+        """Feed raw device output (bytes), complete lines are parsed"""
+        if timestamp is None:
+            timestamp = time.time()
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        # a trailing prompt ends the output
+        if self._partial.endswith(b'>>> '):
+            lines.append(self._partial[:-4])
+            self._partial = b''
+        for line in lines:
+            self.add_line(line.decode('utf-8', 'ignore'), timestamp)
+
+    def add_line(self, line, timestamp=None):
+        vals = self.parse_line(line.replace('>>> ', ''))
+        if vals is None:
+            if line.strip():
+                self._skip(line)
+            return
+        if self.columns is None:
+            self._init_columns(len(vals))
+        if len(vals) != len(self.columns):
+            self._skip(line)
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        if self.t0 is None:
+            self.t0 = timestamp
+        if self.max_rows is not None and len(self.ts) >= self.max_rows:
+            self._release()
+        for col, val in zip(self.columns, vals):
+            col.append(val)
+        self.ts.append(timestamp - self.t0)
+        self.n_rows += 1
+
+    def _skip(self, line):
+        self.n_skipped += 1
+        line = line.rstrip('\r\n')
+        if self.traceback or line.startswith(_TRACEBACK):
+            self.traceback.append(line)
+        else:
+            self.lines.append(line)
+
+    @property
+    def error(self):
+        """Device traceback in the output ('' if none)"""
+        if not self.traceback:
+            return ''
+        return '\n'.join(self.traceback) + '\n'
+
+    def _release(self):
+        if self.spill is not None:
+            n = len(self.ts)
+            if self._spill_file is None:
+                self._spill_file = open(self.spill, 'w')
+                self._spill_file.write(','.join(self.dvars + ['ts']) + '\n')
+            for i in range(n):
+                self._spill_file.write(','.join(
+                    [repr(col[i]) for col in self.columns]
+                    + [repr(self.ts[i])]) + '\n')
+            self.n_spilled += n
+        else:
+            # drop oldest half, keeps trimming amortized
+            n = max(1, len(self.ts) // 2)
+            self.n_dropped += n
+        for col in self.columns:
+            del col[:n]
+        del self.ts[:n]
+
+    def close(self):
+        if self._partial:
+            self.add_line(self._partial.decode('utf-8', 'ignore'))
+            self._partial = b''
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def rows(self):
+        if self.columns is None:
+            return []
+        return list(zip(*self.columns))
+
+    def as_dict(self, dvars=None, fs=None, time_out=None, units=None):
+        """Same layout as get_datalog, 'ts' are host arrival times (s)"""
+        if dvars is None:
+            dvars = self.dvars or []
+        datalog = {var: list(col) for var, col in
+                   zip(dvars, self.columns or [])}
+        datalog['vars'] = dvars
+        if time_out is not None:
+            fs = int((1/time_out)*1000)
+        fs = fs or self.fs
+        if fs is not None:
+            datalog['fs'] = fs
+        datalog['ts'] = list(self.ts)
+        units = units or self.units
+        if units is not None:
+            datalog['u'] = units
+        return datalog
+
+    def to_numpy(self):
+        """Columns as a dict of numpy arrays (numpy required)"""
+        import numpy as np
+        datalog = {var: np.frombuffer(col, dtype=col.typecode)
+                   for var, col in zip(self.dvars or [], self.columns or [])}
+        datalog['ts'] = np.frombuffer(self.ts, dtype='d')
+        return datalog
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __repr__(self):
+        return ('DatalogCapture(vars={}, rows={}, in_memory={}, spilled={}, '
+                'dropped={}, skipped={})'.format(self.dvars, self.n_rows,
+                                                 len(self), self.n_spilled,
+                                                 self.n_dropped,
+                                                 self.n_skipped))
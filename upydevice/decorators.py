@@ -21,10 +21,19 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from dill.source import getsource
+from concurrent.futures import Future
+import hashlib
+import textwrap
+from .exceptions import DeviceException
 import functools
 
 
+def getsource(func):
+    # dill is slow to import and only needed to send function sources
+    from dill.source import getsource
+    return getsource(func)
+
+
 def uparser_dec(long_command, pastemode=False, end=''):
     lines_cmd = []
     space_count = [0]
@@ -73,6 +82,266 @@ def upy_code(func):  # TODO: ACCEPT DEVICE ARG
     return wrapper_get_str_func
 
 
+# DEVICE CODE CACHE
+
+# device-side registry of source hashes of functions defined with @dev.code
+_CODE_REGISTRY = '_upyd_code'
+
+
+def code_source(func):
+    """Function source without the decorator line, dedented"""
+    return textwrap.dedent('\n'.join(getsource(func).split('\n')[1:]))
+
+
+def active_rpc(device):
+    """device.rpc if the binary RPC agent is running, else None"""
+    rpc = getattr(device, 'rpc', None)
+    if rpc is not None and rpc.active:
+        return rpc
+    return None
+
+
+def repl_exec(device, cmd):
+    """device._repl_exec(cmd), raises DeviceException on a device traceback"""
+    output = device._repl_exec(cmd)
+    if 'Traceback (most recent call last):' in (device.response or ''):
+        raise DeviceException(device.response)
+    return output
+
+
+class DeviceCodeCache:
+    """
+    Track functions defined in a device by source hash (per boot session)
+    so unchanged functions are not pasted again.
+
+    Hashes are also registered in the device globals, so a new host session
+    can reuse functions already defined in the running device.
+    """
+
+    def __init__(self, device):
+        self.dev = device
+        self.hashes = {}
+
+    @staticmethod
+    def hash_source(str_func):
+        return hashlib.sha1(str_func.encode('utf-8')).hexdigest()[:16]
+
+    def is_defined(self, name, digest):
+        if self.hashes.get(name) == digest:
+            return True
+        self.dev.output = None
+        self.dev.cmd(f"globals().get('{_CODE_REGISTRY}', {{}}).get('{name}')",
+                     silent=True)
+        if self.dev.output == digest:
+            self.hashes[name] = digest
+            return True
+        return False
+
+    @staticmethod
+    def _register(name, digest):
+        return (f"globals().setdefault('{_CODE_REGISTRY}', {{}})"
+                f"['{name}'] = '{digest}'")
+
+    def define(self, name, str_func, force=False):
+        """Paste function source if not already defined, returns True if pasted"""
+        rpc = active_rpc(self.dev)
+        if rpc is not None:
+            return rpc.define(name, str_func, force=force)
+        digest = self.hash_source(str_func)
+        if not force and self.is_defined(name, digest):
+            return False
+        register = self._register(name, digest)
+        # .mpy compiled on the host, else compressed source, else pasted
+        helpers = (getattr(self.dev, 'precompile', None),
+                   getattr(self.dev, 'compression', None))
+        if not any(helper is not None and helper.use()
+                   and helper.define(name, str_func, register)
+                   for helper in helpers):
+            self.dev.paste_buff(f"{str_func.rstrip()}\n{register}\n")
+            self.dev.cmd('\x04', silent=True)
+        self.hashes[name] = digest
+        return True
+
+    def define_exec(self, name, str_func, force=False):
+        """
+        As define, with one exec() command line instead of paste mode (no
+        per line pacing), for helper code sent by upydevice itself
+        """
+        rpc = active_rpc(self.dev)
+        if rpc is not None:
+            return rpc.define(name, str_func, force=force)
+        digest = self.hash_source(str_func)
+        if not force and self.is_defined(name, digest):
+            return False
+        repl_exec(self.dev, f"exec({str_func!r}); "
+                  f"{self._register(name, digest)}")
+        self.hashes[name] = digest
+        return True
+
+    def clear(self):
+        self.hashes.clear()
+
+
+# PHANTOM CALL TEMPLATE
+
+# args whose repr contains all of these (default object repr, e.g. the phantom
+# instance itself) are not sent to the device
+_REPR_FLAGS = ('>', '<', 'object', 'at', '0x')
+_PLAIN_TYPES = (int, float, bool, type(None))
+
+
+def format_signature(args, kwargs, callback_prefix=None):
+    args_repr = []
+    for a in args:
+        a_type = type(a)
+        if a_type in _PLAIN_TYPES:
+            args_repr.append(repr(a))
+        elif a_type.__repr__ is object.__repr__:
+            continue
+        else:
+            a_repr = repr(a)
+            if not all(f in a_repr for f in _REPR_FLAGS):
+                args_repr.append(a_repr)
+    for k, v in kwargs.items():
+        if not callable(v):
+            args_repr.append(f"{k}={v!r}")
+        elif callback_prefix:
+            args_repr.append(f"{k}={callback_prefix}.{v.__name__}")
+        else:
+            args_repr.append(f"{k}={v.__name__}")
+    return ", ".join(args_repr)
+
+
+def _phantom_method(self):
+    return self.dev_dict
+
+
+class PhantomCall:
+    """
+    Precompiled command template of a phantom method.
+
+    The ``name.method(`` prefix is built once per phantom instance name, and
+    methods whose body is just ``return self.dev_dict`` are not called to
+    fetch it.
+    """
+
+    def __init__(self, func, out=False, in_callback=False):
+        self.func = func
+        self.method = func.__name__
+        self.out = out
+        self.in_callback = in_callback
+        code = getattr(func, '__code__', None)
+        self.fast_dev_dict = (code is not None
+                              and code.co_code == _phantom_method.__code__.co_code
+                              and code.co_names == ('dev_dict',))
+        self._prefixes = {}
+
+    def get_dev_dict(self, args, kwargs):
+        if self.fast_dev_dict and args:
+            return args[0].dev_dict
+        return self.func(*args, **kwargs)
+
+    def build(self, args, kwargs):
+        dev_dict = self.get_dev_dict(args, kwargs)
+        name = dev_dict['name']
+        try:
+            prefix = self._prefixes[name]
+        except KeyError:
+            if self.out:
+                prefix = f"{self.method}("
+            else:
+                prefix = f"{name}.{self.method}("
+            self._prefixes[name] = prefix
+        if self.in_callback:
+            signature = format_signature(args, kwargs, callback_prefix=name)
+        else:
+            signature = format_signature(args, kwargs)
+        return dev_dict, f"{prefix}{signature})"
+
+
+# PHANTOM BATCH
+
+class DeviceBatch:
+    """
+    Queue phantom calls and send them to the device in one round trip.
+
+    Phantom calls made inside ``with dev.batch():`` return a Future
+    that is resolved in order when the batch is flushed.
+    """
+
+    def __init__(self, device, max_calls=32):
+        self.dev = device
+        self.max_calls = max_calls
+        self.queue = []
+        self._prev_batch = None
+
+    def __enter__(self):
+        self._prev_batch = getattr(self.dev, '_batch', None)
+        self.dev._batch = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.dev._batch = self._prev_batch
+        if exc_type is None:
+            self.flush()
+        else:
+            for cmd, fut in self.queue:
+                fut.cancel()
+            self.queue = []
+        return False
+
+    def add(self, cmd):
+        fut = Future()
+        self.queue.append((cmd, fut))
+        return fut
+
+    def flush(self):
+        rpc = active_rpc(self.dev)
+        if rpc is not None:
+            return self._flush_rpc(rpc)
+        outputs = []
+        while self.queue:
+            chunk = self.queue[:self.max_calls]
+            self.queue = self.queue[self.max_calls:]
+            # repr each result on the device so any type comes back parseable
+            batch_cmd = '[{}]'.format(','.join(['repr({})'.format(cmd)
+                                                for cmd, fut in chunk]))
+            self.dev.output = None
+            self.dev.cmd(batch_cmd, silent=True)
+            results = self.dev.output
+            if not isinstance(results, list) or len(results) != len(chunk):
+                exc = DeviceException(self.dev.response)
+                for cmd, fut in chunk:
+                    fut.set_exception(exc)
+                continue
+            for (cmd, fut), result in zip(chunk, results):
+                self.dev.response = result
+                self.dev.output = None
+                self.dev.get_output()
+                if self.dev.output is None and result != 'None':
+                    self.dev.output = result
+                fut.set_result(self.dev.output)
+                outputs.append(self.dev.output)
+        self.dev.output = outputs
+        return outputs
+
+    def _flush_rpc(self, rpc):
+        # pipelined: all requests are sent before reading the results
+        queue, self.queue = self.queue, []
+        calls = [(rpc.eval_async(cmd), fut) for cmd, fut in queue]
+        outputs = []
+        for call, fut in calls:
+            try:
+                fut.set_result(call.result())
+            except DeviceException as e:
+                fut.set_exception(e)
+                outputs.append(None)
+            else:
+                outputs.append(fut.result())
+        self.dev.output = outputs
+        return outputs
+
+
 # PYTHON PHANTOM DECORATORS
 
 def upy_cmd(device, debug=False, rtn=True):
@@ -158,22 +427,19 @@ def upy_cmd_c_raw(device, out=False):
 
 def upy_cmd_c_r(debug=False, rtn=True, out=False):
     def decorator_cmd_str(func):
+        call = PhantomCall(func, out=out)
+
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
-            flags = ['>', '<', 'object', 'at', '0x']
-            args_repr = [repr(a) for a in args if any(
-                f not in repr(a) for f in flags)]
-            kwargs_repr = [f"{k}={v!r}" if not callable(
-                v) else f"{k}={v.__name__}" for k, v in kwargs.items()]
-            signature = ", ".join(args_repr + kwargs_repr)
-            cmd_ = f"{func.__name__}({signature})"
-            dev_dict = func(*args, **kwargs)
-            cmd = "{}.{}".format(dev_dict['name'], cmd_)
+            dev_dict, cmd = call.build(args, kwargs)
             dev_dict['dev'].output = None
-            if out:
-                cmd = "{}".format(cmd_)
-            else:
-                pass
+            batch = getattr(dev_dict['dev'], '_batch', None)
+            if batch is not None:
+                return batch.add(cmd)
+            rpc = active_rpc(dev_dict['dev'])
+            if rpc is not None:
+                dev_dict['dev'].output = rpc.eval(cmd)
+                return dev_dict['dev'].output if rtn else None
             if debug:
                 dev_dict['dev'].cmd(cmd, long_string=True)
             else:
@@ -188,22 +454,12 @@ def upy_cmd_c_r(debug=False, rtn=True, out=False):
 
 def upy_cmd_c_raw_r(out=False):
     def decorator_cmd_str(func):
+        call = PhantomCall(func, out=out)
+
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
-            flags = ['>', '<', 'object', 'at', '0x']
-            args_repr = [repr(a) for a in args if any(
-                f not in repr(a) for f in flags)]
-            kwargs_repr = [f"{k}={v!r}" if not callable(
-                v) else f"{k}={v.__name__}" for k, v in kwargs.items()]
-            signature = ", ".join(args_repr + kwargs_repr)
-            cmd_ = f"{func.__name__}({signature})"
-            dev_dict = func(*args, **kwargs)
-            cmd = "{}.{}".format(dev_dict['name'], cmd_)
+            dev_dict, cmd = call.build(args, kwargs)
             dev_dict['dev'].output = None
-            if out:
-                cmd = "{}".format(cmd_)
-            else:
-                pass
             dev_dict['dev'].cmd(cmd, capture_output=True)
             try:
                 dev_dict['dev'].output = dev_dict['dev'].long_output[0].strip()
@@ -217,23 +473,19 @@ def upy_cmd_c_raw_r(out=False):
 
 def upy_cmd_c_r_in_callback(debug=False, rtn=True, out=False):
     def decorator_cmd_str(func):
+        call = PhantomCall(func, out=out, in_callback=True)
+
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
-            flags = ['>', '<', 'object', 'at', '0x']
-            args_repr = [repr(a) for a in args if any(
-                f not in repr(a) for f in flags)]
-            dev_dict = func(*args, **kwargs)
-            name = dev_dict['name']
-            kwargs_repr = [f"{k}={v!r}" if not callable(
-                v) else f"{k}={name}.{v.__name__}" for k, v in kwargs.items()]
-            signature = ", ".join(args_repr + kwargs_repr)
-            cmd_ = f"{func.__name__}({signature})"
-            cmd = "{}.{}".format(dev_dict['name'], cmd_)
+            dev_dict, cmd = call.build(args, kwargs)
             dev_dict['dev'].output = None
-            if out:
-                cmd = "{}".format(cmd_)
-            else:
-                pass
+            batch = getattr(dev_dict['dev'], '_batch', None)
+            if batch is not None:
+                return batch.add(cmd)
+            rpc = active_rpc(dev_dict['dev'])
+            if rpc is not None:
+                dev_dict['dev'].output = rpc.eval(cmd)
+                return dev_dict['dev'].output if rtn else None
             if debug:
                 dev_dict['dev'].cmd(cmd)
             else:
@@ -248,22 +500,12 @@ def upy_cmd_c_r_in_callback(debug=False, rtn=True, out=False):
 
 def upy_cmd_c_r_nb(debug=False, rtn=True, out=False, block=False):
     def decorator_cmd_str(func):
+        call = PhantomCall(func, out=out)
+
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
-            flags = ['>', '<', 'object', 'at', '0x']
-            args_repr = [repr(a) for a in args if any(
-                f not in repr(a) for f in flags)]
-            kwargs_repr = [f"{k}={v!r}" if not callable(
-                v) else f"{k}={v.__name__}" for k, v in kwargs.items()]
-            signature = ", ".join(args_repr + kwargs_repr)
-            cmd_ = f"{func.__name__}({signature})"
-            dev_dict = func(*args, **kwargs)
-            cmd = "{}.{}".format(dev_dict['name'], cmd_)
+            dev_dict, cmd = call.build(args, kwargs)
             dev_dict['dev'].output = None
-            if out:
-                cmd = "{}".format(cmd_)
-            else:
-                pass
             if debug:
                 dev_dict['dev'].cmd_nb(cmd, long_string=True)
             else:
@@ -279,23 +521,12 @@ def upy_cmd_c_r_nb(debug=False, rtn=True, out=False, block=False):
 
 def upy_cmd_c_r_nb_in_callback(debug=False, rtn=True, out=False):
     def decorator_cmd_str(func):
+        call = PhantomCall(func, out=out, in_callback=True)
+
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
-            flags = ['>', '<', 'object', 'at', '0x']
-            args_repr = [repr(a) for a in args if any(
-                f not in repr(a) for f in flags)]
-            dev_dict = func(*args, **kwargs)
-            name = dev_dict['name']
-            kwargs_repr = [f"{k}={v!r}" if not callable(
-                v) else f"{k}={name}.{v.__name__}" for k, v in kwargs.items()]
-            signature = ", ".join(args_repr + kwargs_repr)
-            cmd_ = f"{func.__name__}({signature})"
-            cmd = "{}.{}".format(dev_dict['name'], cmd_)
+            dev_dict, cmd = call.build(args, kwargs)
             dev_dict['dev'].output = None
-            if out:
-                cmd = "{}".format(cmd_)
-            else:
-                pass
             if debug:
                 dev_dict['dev'].cmd_nb(cmd)
             else:
@@ -311,22 +542,19 @@ def upy_cmd_c_r_nb_in_callback(debug=False, rtn=True, out=False):
 
 def upy_wrcmd_c_r(debug=False, rtn=True, out=False):
     def decorator_cmd_str(func):
+        call = PhantomCall(func, out=out)
+
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
-            flags = ['>', '<', 'object', 'at', '0x']
-            args_repr = [repr(a) for a in args if any(
-                f not in repr(a) for f in flags)]
-            kwargs_repr = [f"{k}={v!r}" if not callable(
-                v) else f"{k}={v.__name__}" for k, v in kwargs.items()]
-            signature = ", ".join(args_repr + kwargs_repr)
-            cmd_ = f"{func.__name__}({signature})"
-            dev_dict = func(*args, **kwargs)
-            cmd = "{}.{}".format(dev_dict['name'], cmd_)
+            dev_dict, cmd = call.build(args, kwargs)
             dev_dict['dev'].output = None
-            if out:
-                cmd = "{}".format(cmd_)
-            else:
-                pass
+            batch = getattr(dev_dict['dev'], '_batch', None)
+            if batch is not None:
+                return batch.add(cmd)
+            rpc = active_rpc(dev_dict['dev'])
+            if rpc is not None:
+                dev_dict['dev'].output = rpc.eval(cmd)
+                return dev_dict['dev'].output if rtn else None
             if debug:
                 dev_dict['dev'].wr_cmd(cmd)
             else:
@@ -341,23 +569,19 @@ def upy_wrcmd_c_r(debug=False, rtn=True, out=False):
 
 def upy_wrcmd_c_r_in_callback(debug=False, rtn=True, out=False):
     def decorator_cmd_str(func):
+        call = PhantomCall(func, out=out, in_callback=True)
+
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
-            flags = ['>', '<', 'object', 'at', '0x']
-            args_repr = [repr(a) for a in args if any(
-                f not in repr(a) for f in flags)]
-            dev_dict = func(*args, **kwargs)
-            name = dev_dict['name']
-            kwargs_repr = [f"{k}={v!r}" if not callable(
-                v) else f"{k}={name}.{v.__name__}" for k, v in kwargs.items()]
-            signature = ", ".join(args_repr + kwargs_repr)
-            cmd_ = f"{func.__name__}({signature})"
-            cmd = "{}.{}".format(dev_dict['name'], cmd_)
+            dev_dict, cmd = call.build(args, kwargs)
             dev_dict['dev'].output = None
-            if out:
-                cmd = "{}".format(cmd_)
-            else:
-                pass
+            batch = getattr(dev_dict['dev'], '_batch', None)
+            if batch is not None:
+                return batch.add(cmd)
+            rpc = active_rpc(dev_dict['dev'])
+            if rpc is not None:
+                dev_dict['dev'].output = rpc.eval(cmd)
+                return dev_dict['dev'].output if rtn else None
             if debug:
                 dev_dict['dev'].wr_cmd(cmd)
             else:
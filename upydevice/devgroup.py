@@ -22,9 +22,16 @@
 # SOFTWARE.
 
 import time
+import asyncio
 import multiprocessing
-from .decorators import getsource
+from collections import namedtuple
+from .decorators import code_source, format_signature
+from .netscan import run_coro
 import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# per device result of AsyncDeviceGroup commands, elapsed in s
+DEV_RESULT = namedtuple('DEV_RESULT', ['output', 'elapsed', 'error'])
 
 # DEV GROUP
 
@@ -110,6 +117,38 @@ class DEVGROUP:
                 print('Rebooting {}'.format(dev))
             self.devs[dev].reset(silent=silent_dev)
 
+    def reset_ready(self, timeout=20, hr=False, group_silent=False, ignore=[],
+                    include=[]):
+        """
+        Reset devices and wait until all are ready, serial/websocket devices
+        concurrently, BLE devices in sequence. Returns {dev: elapsed s or
+        exception}
+        """
+        if len(include) == 0:
+            include = [dev for dev in self.devs.keys()]
+        include = [dev for dev in include if dev not in ignore]
+        if not group_silent:
+            print('Rebooting: {}'.format(', '.join(include)))
+        ble_devs = [dev for dev in include
+                    if self.devs[dev].dev_class == 'BleDevice']
+        net_devs = [dev for dev in include if dev not in ble_devs]
+        result = {}
+        if net_devs:
+            with ThreadPoolExecutor(max_workers=len(net_devs)) as pool:
+                futures = {dev: pool.submit(self.devs[dev].reset_ready, hr=hr,
+                                            timeout=timeout)
+                           for dev in net_devs}
+            for dev, fut in futures.items():
+                result[dev] = fut.exception() or fut.result()
+        for dev in ble_devs:
+            try:
+                result[dev] = self.devs[dev].reset_ready(hr=hr, timeout=timeout)
+            except Exception as e:
+                result[dev] = e
+        if not group_silent:
+            print('Done!')
+        return result
+
 
 class DeviceGroup(DEVGROUP):
 
@@ -117,10 +156,9 @@ class DeviceGroup(DEVGROUP):
         super().__init__(*args, **kargs)
 
     def code(self, func):
-        str_func = '\n'.join(getsource(func).split('\n')[1:])
+        str_func = code_source(func)
         for dev in self.devs.keys():
-            self.devs[dev].paste_buff(str_func)
-            self.devs[dev].cmd('\x04', silent=True)
+            self.devs[dev].code_cache.define(func.__name__, str_func)
 
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
@@ -141,10 +179,9 @@ class DeviceGroup(DEVGROUP):
         return wrapper_cmd
 
     def code_follow(self, func):
-        str_func = '\n'.join(getsource(func).split('\n')[1:])
+        str_func = code_source(func)
         for dev in self.devs.keys():
-            self.devs[dev].paste_buff(str_func)
-            self.devs[dev].cmd('\x04', silent=True)
+            self.devs[dev].code_cache.define(func.__name__, str_func)
 
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
@@ -163,3 +200,125 @@ class DeviceGroup(DEVGROUP):
             if self.output:
                 return self.output
         return wrapper_cmd
+
+
+class AsyncDeviceGroup(DeviceGroup):
+    """
+    DeviceGroup that pastes, runs and collects concurrently across devices,
+    each device in its own I/O thread (dev.executor).
+
+    limits: max concurrent devices per dev_class, e.g. {'BleDevice': 2}
+    (default BLE devices one at a time, others unbounded).
+    Results are {dev: DEV_RESULT(output, elapsed, error)}, a device error
+    (traceback, timeout, lost connection) does not stop the others.
+    """
+
+    def __init__(self, *args, limits=None, timeout=None, **kargs):
+        super().__init__(*args, **kargs)
+        self.limits = {'BleDevice': 1}
+        if limits:
+            self.limits.update(limits)
+        self.timeout = timeout
+        self.results = {}
+
+    def _select(self, include=[], ignore=[]):
+        if len(include) == 0:
+            include = [dev for dev in self.devs.keys()]
+        return [dev for dev in include if dev not in ignore]
+
+    async def _as_dev_run(self, dev, job, sems, timeout):
+        device = self.devs[dev]
+        sem = sems.get(device.dev_class)
+        t0 = time.perf_counter()
+        try:
+            if sem is None:
+                output = await asyncio.wrap_future(
+                    device.executor.submit(job, device, timeout=timeout))
+            else:
+                async with sem:
+                    output = await asyncio.wrap_future(
+                        device.executor.submit(job, device, timeout=timeout))
+            return DEV_RESULT(output, time.perf_counter() - t0, None)
+        except Exception as e:
+            return DEV_RESULT(None, time.perf_counter() - t0, e)
+
+    async def as_gather(self, job, include=[], ignore=[], timeout=None):
+        """
+        Run job(device) in every device I/O thread concurrently (within
+        per dev_class limits), returns {dev: DEV_RESULT}
+        """
+        if timeout is None:
+            timeout = self.timeout
+        sems = {dev_class: asyncio.Semaphore(limit)
+                for dev_class, limit in self.limits.items() if limit}
+        devs = self._select(include, ignore)
+        results = await asyncio.gather(*[self._as_dev_run(dev, job, sems,
+                                                          timeout)
+                                         for dev in devs])
+        self.results = dict(zip(devs, results))
+        self.output = {dev: res.output for dev, res in self.results.items()
+                       if res.error is None and res.output is not None}
+        return self.results
+
+    def gather(self, job, include=[], ignore=[], timeout=None):
+        return run_coro(self.as_gather(job, include=include, ignore=ignore,
+                                       timeout=timeout))
+
+    @staticmethod
+    def _cmd_job(command, follow=False, name=None, str_func=None):
+        def job(device):
+            if str_func is not None:
+                device.code_cache.define(name, str_func)
+            if follow:
+                device.wr_cmd(command, rtn=True, follow=True)
+            else:
+                device.wr_cmd(command, silent=True, rtn=True)
+            device.raise_traceback()
+        return job
+
+    async def as_cmd(self, command, include=[], ignore=[], timeout=None,
+                     follow=False):
+        return await self.as_gather(self._cmd_job(command, follow=follow),
+                                    include=include, ignore=ignore,
+                                    timeout=timeout)
+
+    def cmd_async(self, command, include=[], ignore=[], timeout=None,
+                  follow=False):
+        """Send command to all devices concurrently, returns {dev: DEV_RESULT}"""
+        return run_coro(self.as_cmd(command, include=include, ignore=ignore,
+                                    timeout=timeout, follow=follow))
+
+    def as_code(self, func, follow=False):
+        """
+        Decorator, returns a coroutine function that defines func in each
+        device (if not already defined) and calls it, concurrently.
+        """
+        str_func = code_source(func)
+
+        @functools.wraps(func)
+        async def wrapper_cmd(*args, **kwargs):
+            cmd_ = f"{func.__name__}({format_signature(args, kwargs)})"
+            return await self.as_gather(self._cmd_job(cmd_, follow=follow,
+                                                      name=func.__name__,
+                                                      str_func=str_func))
+        return wrapper_cmd
+
+    def code(self, func):
+        as_wrapper = self.as_code(func)
+
+        @functools.wraps(func)
+        def wrapper_cmd(*args, **kwargs):
+            run_coro(as_wrapper(*args, **kwargs))
+            if self.output:
+                return self.output
+        return wrapper_cmd
+
+    def code_follow(self, func):
+        as_wrapper = self.as_code(func, follow=True)
+
+        @functools.wraps(func)
+        def wrapper_cmd(*args, **kwargs):
+            run_coro(as_wrapper(*args, **kwargs))
+            if self.output:
+                return self.output
+        return wrapper_cmd
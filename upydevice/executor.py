@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Non blocking device commands"""
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+
+
+class DeviceExecutor:
+    """
+    Per device I/O thread that owns the connection, commands are run in
+    order and each one returns a Future resolved with the device output.
+    """
+
+    def __init__(self, device):
+        self.dev = device
+        self._pool = None
+        self._lock = threading.Lock()
+        self.last = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix='upydevice-{}'.format(
+                        getattr(self.dev, 'name', None) or 'dev'))
+            return self._pool
+
+    def _run(self, func, args, kwargs, timeout):
+        timer = None
+        timed_out = threading.Event()
+        if timeout is not None:
+            def expire():
+                timed_out.set()
+                self.interrupt()
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            # KBI traceback of the interrupted command
+            if timed_out.is_set():
+                raise TimeoutError('Command interrupted after {} s'.format(
+                    timeout)) from e
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if timed_out.is_set():
+            raise TimeoutError('Command interrupted after {} s'.format(timeout))
+        return self.dev.output
+
+    def submit(self, func, *args, timeout=None, **kwargs):
+        """
+        Run func (e.g. dev.wr_cmd) in the I/O thread, Future result is the
+        device output. If timeout (s) is exceeded the command is interrupted
+        with KBI and the Future raises TimeoutError.
+        """
+        self.last = self._get_pool().submit(self._run, func, args, kwargs,
+                                            timeout)
+        return self.last
+
+    def pop_last(self):
+        """Last submitted Future once it is done (then cleared), else None"""
+        with self._lock:
+            future = self.last
+            if future is None or not future.done():
+                return None
+            self.last = None
+        return future
+
+    def cmd(self, command, timeout=None, **kargs):
+        return self.submit(self.dev.wr_cmd, command, timeout=timeout, **kargs)
+
+    def wrap(self, future):
+        """asyncio Future from a command Future, to await results"""
+        return asyncio.wrap_future(future)
+
+    def interrupt(self):
+        """Send KBI to the device, stops the running command"""
+        self.dev._kbi_cmd()
+
+    def cancel(self, future):
+        """Cancel a queued command or interrupt it if already running"""
+        if future.cancel():
+            return True
+        if future.running():
+            self.interrupt()
+            return True
+        return False
+
+    def shutdown(self, wait=True, cancel_futures=True):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+                self._pool = None
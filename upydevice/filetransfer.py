@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Chunked, hash verified file transfer (put/get/sync)"""
+
+from binascii import a2b_base64, b2a_base64
+from collections import namedtuple
+import hashlib
+import io
+import json
+import os
+import struct
+import time
+import zlib
+from .decorators import repl_exec
+from .exceptions import DeviceException
+from . import wsprotocol
+
+# src, dst, size (bytes), elapsed (s), verified, skipped, sent (file bytes
+# actually transferred, less than size for block delta uploads)
+TRANSFER = namedtuple('TRANSFER', ['src', 'dst', 'size', 'elapsed',
+                                   'verified', 'skipped', 'sent'])
+
+# block delta: block size and min file size
+BLOCK_SIZE = 1024
+DELTA_MIN_SIZE = 8192
+MANIFEST = '.upyd_manifest.json'
+
+# compressed uploads/downloads are staged in this device file
+ZTMP_SUFFIX = '.upyz'
+
+# raw bytes per REPL command (base64 encoded in the command line)
+CHUNK_SIZE = {'SerialDevice': 512, 'WebSocketDevice': 1024,
+              'BleDevice': 240}
+
+# device side helpers, pasted once per boot session (see DeviceCodeCache)
+_XFER_CODE = """try:
+    import ubinascii as _upyd_ba
+except ImportError:
+    import binascii as _upyd_ba
+try:
+    import uhashlib as _upyd_hl
+except ImportError:
+    import hashlib as _upyd_hl
+try:
+    import os as _upyd_os
+except ImportError:
+    import uos as _upyd_os
+_upyd_f = None
+def _upyd_hash(path, bs=512):
+    h = _upyd_hl.sha256()
+    buf = bytearray(bs)
+    mv = memoryview(buf)
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(mv[:n])
+    return _upyd_ba.hexlify(h.digest()).decode()
+def _upyd_stat(path):
+    try:
+        return (_upyd_os.stat(path)[6], _upyd_hash(path))
+    except OSError:
+        return None
+def _upyd_stats(paths):
+    return [_upyd_stat(p) for p in paths]
+def _upyd_blocks(path, bs):
+    hs = []
+    buf = bytearray(bs)
+    mv = memoryview(buf)
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hs.append(_upyd_ba.hexlify(
+                _upyd_hl.sha256(mv[:n]).digest()[:8]).decode())
+    return hs
+def _upyd_mkdirs(path):
+    p = '/' if path.startswith('/') else ''
+    for d in path.split('/'):
+        if d:
+            p += d
+            try:
+                _upyd_os.mkdir(p)
+            except OSError:
+                pass
+            p += '/'
+def _upyd_open(path, mode):
+    global _upyd_f
+    _upyd_f = open(path, mode)
+def _upyd_wr(data):
+    return _upyd_f.write(_upyd_ba.a2b_base64(data))
+def _upyd_wrat(pos, data):
+    _upyd_f.seek(pos)
+    return _upyd_f.write(_upyd_ba.a2b_base64(data))
+def _upyd_rd(n):
+    return _upyd_ba.b2a_base64(_upyd_f.read(n))
+def _upyd_close():
+    global _upyd_f
+    _upyd_f.close()
+    _upyd_f = None
+"""
+
+_XFER_NAME = '_upyd_xfer'
+
+
+def file_hash(path, bs=65536):
+    """sha256 hex digest of a local file (same as device _upyd_hash)"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(bs), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def block_hashes(path, block_size=BLOCK_SIZE):
+    """Truncated sha256 per block (same as device _upyd_blocks)"""
+    with open(path, 'rb') as f:
+        return [hashlib.sha256(block).digest()[:8].hex()
+                for block in iter(lambda: f.read(block_size), b'')]
+
+
+class SyncManifest:
+    """
+    Local file hashes cached by (size, mtime) in a json file, so unchanged
+    files are not hashed again on every sync.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.files = {}
+        self.changed = False
+        if path and os.path.exists(path):
+            try:
+                with open(path) as manifest:
+                    self.files = json.load(manifest).get('files', {})
+            except (OSError, ValueError):
+                self.files = {}
+
+    def _entry(self, rel, local):
+        stat = os.stat(local)
+        entry = self.files.get(rel)
+        if (entry is None or entry['size'] != stat.st_size
+                or entry['mtime'] != stat.st_mtime_ns):
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                     'sha256': file_hash(local)}
+            self.files[rel] = entry
+            self.changed = True
+        return entry
+
+    def stat(self, rel, local):
+        """(size, sha256) of a local file"""
+        entry = self._entry(rel, local)
+        return (entry['size'], entry['sha256'])
+
+    def blocks(self, rel, local, block_size=BLOCK_SIZE):
+        entry = self._entry(rel, local)
+        if entry.get('block_size') != block_size:
+            entry['blocks'] = block_hashes(local, block_size)
+            entry['block_size'] = block_size
+            self.changed = True
+        return entry['blocks']
+
+    def save(self):
+        if self.path and self.changed:
+            with open(self.path, 'w') as manifest:
+                json.dump({'files': self.files}, manifest)
+            self.changed = False
+
+
+class FileTransfer:
+    """
+    put/get/sync through the REPL: file data is sent in base64 chunks, one
+    command per chunk, and checked against the sha256 of the device file.
+    """
+
+    def __init__(self, device, chunk_size=None):
+        self.dev = device
+        self.chunk_size = chunk_size
+
+    def _chunk_size(self):
+        if self.chunk_size:
+            return self.chunk_size
+        return CHUNK_SIZE.get(getattr(self.dev, 'dev_class', None), 512)
+
+    def _exec(self, cmd):
+        return repl_exec(self.dev, cmd)
+
+    def setup(self):
+        self.dev.code_cache.define_exec(_XFER_NAME, _XFER_CODE)
+
+    def remote_stat(self, remote):
+        """(size, sha256) of a device file or None if it does not exist"""
+        self.setup()
+        stat = self._exec(f"_upyd_stat({remote!r})")
+        return tuple(stat) if stat else None
+
+    def remote_stats(self, remotes):
+        """(size, sha256) or None per device file, in one command"""
+        if not remotes:
+            return []
+        self.setup()
+        stats = self._exec(f"_upyd_stats({list(remotes)!r})")
+        if not isinstance(stats, list) or len(stats) != len(remotes):
+            raise DeviceException(self.dev.response)
+        return [tuple(stat) if stat else None for stat in stats]
+
+    def remote_blocks(self, remote, block_size=BLOCK_SIZE):
+        self.setup()
+        return self._exec(f"_upyd_blocks({remote!r}, {block_size})")
+
+    def remote_hash(self, remote):
+        self.setup()
+        return self._exec(f"_upyd_hash({remote!r})")
+
+    def mkdirs(self, remote_dir):
+        if remote_dir and remote_dir != '/':
+            self.setup()
+            self._exec(f"_upyd_mkdirs({remote_dir!r})")
+
+    def _put_data(self, remote, local_file, size):
+        chunk_size = self._chunk_size()
+        self._exec(f"_upyd_open({remote!r}, 'wb')")
+        try:
+            for chunk in iter(lambda: local_file.read(chunk_size), b''):
+                data = b2a_base64(chunk).rstrip().decode()
+                self._exec(f"_upyd_wr('{data}')")
+        finally:
+            self._exec("_upyd_close()")
+
+    def _get_data(self, remote, local_file):
+        chunk_size = self._chunk_size()
+        self._exec(f"_upyd_open({remote!r}, 'rb')")
+        try:
+            while True:
+                data = self._exec(f"_upyd_rd({chunk_size})")
+                if not isinstance(data, bytes):
+                    raise DeviceException(self.dev.response)
+                chunk = a2b_base64(data)
+                if not chunk:
+                    break
+                local_file.write(chunk)
+        finally:
+            self._exec("_upyd_close()")
+
+    def put_delta(self, local, remote, local_blocks, remote_blocks,
+                  block_size=BLOCK_SIZE, verify=True):
+        """
+        Upload only blocks that differ from the device copy (the device
+        file must not be larger than the local one, files can not be
+        truncated in place).
+        """
+        t0 = time.perf_counter()
+        chunk_size = min(self._chunk_size(), block_size)
+        changed = [i for i, block in enumerate(local_blocks)
+                   if i >= len(remote_blocks) or block != remote_blocks[i]]
+        sent = 0
+        self._exec(f"_upyd_open({remote!r}, 'r+b')")
+        try:
+            with open(local, 'rb') as local_file:
+                for i in changed:
+                    local_file.seek(i * block_size)
+                    block = local_file.read(block_size)
+                    for off in range(0, len(block), chunk_size):
+                        data = b2a_base64(block[off:off+chunk_size]).rstrip()
+                        self._exec(f"_upyd_wrat({i * block_size + off}, "
+                                   f"'{data.decode()}')")
+                    sent += len(block)
+        finally:
+            self._exec("_upyd_close()")
+        verified = False
+        if verify:
+            if self.remote_hash(remote) != file_hash(local):
+                raise DeviceException(f'{remote}: hash mismatch after put')
+            verified = True
+        return TRANSFER(local, remote, os.path.getsize(local),
+                        time.perf_counter() - t0, verified, False, sent)
+
+    def _compression(self, compress):
+        compression = getattr(self.dev, 'compression', None)
+        if compression is not None and compression.use(compress):
+            return compression
+        return None
+
+    def put(self, local, remote=None, verify=True, compress=None):
+        """
+        Upload local file to remote path (default: same file name).
+        compress: deflate the file and decompress it in the device
+        (None: dev.compression.enabled), TRANSFER.sent is the compressed
+        size.
+        """
+        if remote is None:
+            remote = os.path.basename(local)
+        t0 = time.perf_counter()
+        self.setup()
+        self.mkdirs(os.path.dirname(remote))
+        size = sent = os.path.getsize(local)
+        compression = self._compression(compress)
+        blob = None
+        if compression is not None:
+            with open(local, 'rb') as local_file:
+                blob = compression.compress(local_file.read())
+        if blob is not None:
+            sent = len(blob)
+            self._put_data(remote + ZTMP_SUFFIX, io.BytesIO(blob), sent)
+            compression.unzip(remote + ZTMP_SUFFIX, remote)
+        else:
+            with open(local, 'rb') as local_file:
+                self._put_data(remote, local_file, size)
+        verified = False
+        if verify:
+            if self.remote_hash(remote) != file_hash(local):
+                raise DeviceException(f'{remote}: hash mismatch after put')
+            verified = True
+        return TRANSFER(local, remote, size, time.perf_counter() - t0,
+                        verified, False, sent)
+
+    def get(self, remote, local=None, verify=True, compress=None):
+        """
+        Download remote file to local path (default: same file name).
+        compress: deflate the file in the device first, if the firmware
+        can compress (deflate module with compression), TRANSFER.sent is
+        the compressed size.
+        """
+        if local is None:
+            local = os.path.basename(remote)
+        t0 = time.perf_counter()
+        self.setup()
+        compression = self._compression(compress)
+        sent = None
+        try:
+            with open(local, 'wb') as local_file:
+                if compression is not None and compression.caps.compress:
+                    blob = io.BytesIO()
+                    compression.zip(remote, remote + ZTMP_SUFFIX)
+                    try:
+                        self._get_data(remote + ZTMP_SUFFIX, blob)
+                    finally:
+                        compression.remove(remote + ZTMP_SUFFIX)
+                    sent = blob.tell()
+                    local_file.write(zlib.decompress(blob.getvalue()))
+                else:
+                    self._get_data(remote, local_file)
+        except Exception:
+            os.remove(local)
+            raise
+        verified = False
+        if verify:
+            if self.remote_hash(remote) != file_hash(local):
+                raise DeviceException(f'{remote}: hash mismatch after get')
+            verified = True
+        size = os.path.getsize(local)
+        return TRANSFER(remote, local, size, time.perf_counter() - t0,
+                        verified, False, size if sent is None else sent)
+
+    @staticmethod
+    def local_files(local_dir, exclude=()):
+        """Relative paths (posix) of files under local_dir"""
+        files = []
+        for root, dirs, names in os.walk(local_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.')
+                             and d not in exclude)
+            for name in sorted(names):
+                if name.startswith('.') or name in exclude:
+                    continue
+                rel = os.path.relpath(os.path.join(root, name), local_dir)
+                files.append(rel.replace(os.sep, '/'))
+        return files
+
+    def sync(self, local_dir, remote_dir='', verify=True, exclude=(),
+             manifest=True, delta=True, block_size=BLOCK_SIZE,
+             delta_min_size=DELTA_MIN_SIZE, compress=None):
+        """
+        Upload files under local_dir to remote_dir. Device file hashes are
+        requested in one command and files whose size and sha256 match are
+        skipped. Changed files larger than delta_min_size only send the
+        blocks that differ (delta=True).
+        Local hashes are cached in local_dir/.upyd_manifest.json (manifest
+        True), or a given manifest path. Whole files are compressed with
+        compress (see put). Returns list of TRANSFER.
+        """
+        if manifest is True:
+            manifest = os.path.join(local_dir, MANIFEST)
+        cache = SyncManifest(manifest or None)
+        rels = self.local_files(local_dir, exclude=exclude)
+        local_paths = [os.path.join(local_dir, *rel.split('/')) for rel in rels]
+        remotes = ['/'.join([remote_dir.rstrip('/'), rel]) if remote_dir
+                   else rel for rel in rels]
+        t0 = time.perf_counter()
+        remote_stats = self.remote_stats(remotes)
+        t_query = (time.perf_counter() - t0) / max(1, len(rels))
+        results = []
+        try:
+            for rel, local, remote, remote_stat in zip(rels, local_paths, remotes,
+                                                        remote_stats):
+                local_stat = cache.stat(rel, local)
+                if remote_stat == local_stat:
+                    results.append(TRANSFER(local, remote, local_stat[0],
+                                            t_query, True, True, 0))
+                elif (delta and remote_stat is not None
+                      and local_stat[0] >= delta_min_size
+                      and remote_stat[0] <= local_stat[0]):
+                    results.append(self.put_delta(
+                        local, remote, cache.blocks(rel, local, block_size),
+                        self.remote_blocks(remote, block_size),
+                        block_size=block_size, verify=verify))
+                else:
+                    results.append(self.put(local, remote, verify=verify,
+                                            compress=compress))
+        finally:
+            cache.save()
+        return results
+
+
+# WEBREPL BINARY FILE PROTOCOL
+
+_WEBREPL_PUT = 1
+_WEBREPL_GET = 2
+_WEBREPL_HEADER = '<2sBBQLH64s'
+_WEBREPL_CHUNK = 1024
+
+
+class WebREPLFileTransfer(FileTransfer):
+    """
+    put/get with the native WebREPL binary protocol (raw bytes in binary
+    frames, no encoding), hash verification and sync through the REPL.
+    """
+
+    def __init__(self, device, chunk_size=None, webrepl=True):
+        super().__init__(device, chunk_size=chunk_size)
+        self.webrepl = webrepl
+        self._rx = b''
+
+    def _ws_read(self, n):
+        while len(self._rx) < n:
+            fin, opcode, data = self.dev.ws.read_frame()
+            # skip REPL output still in flight (text frames)
+            if data and opcode == wsprotocol.OP_BYTES:
+                self._rx += data
+        data, self._rx = self._rx[:n], self._rx[n:]
+        return data
+
+    def _read_resp(self):
+        sig, code = struct.unpack('<2sH', self._ws_read(4))
+        if sig != b'WB':
+            raise DeviceException(f'WebREPL: unexpected response {sig!r}')
+        return code
+
+    def _send_header(self, op, remote, size=0):
+        fname = remote.encode('utf-8')
+        if len(fname) > 64:
+            raise DeviceException(f'WebREPL: file name too long: {remote}')
+        header = struct.pack(_WEBREPL_HEADER, b'WA', op, 0, 0, size,
+                             len(fname), fname)
+        self._rx = b''
+        self.dev.ws.reset_buffers()
+        self.dev.ws.sock.settimeout(None)
+        # header in two frames, as webrepl_cli does
+        self.dev.ws.send(header[:10])
+        self.dev.ws.send(header[10:])
+        if self._read_resp() != 0:
+            raise DeviceException(f'WebREPL: {remote} transfer refused')
+
+    def _put_data(self, remote, local_file, size):
+        if not self.webrepl:
+            return super()._put_data(remote, local_file, size)
+        self._send_header(_WEBREPL_PUT, remote, size)
+        chunk_size = self.chunk_size or _WEBREPL_CHUNK
+        for chunk in iter(lambda: local_file.read(chunk_size), b''):
+            self.dev.ws.send(chunk)
+        if self._read_resp() != 0:
+            raise DeviceException(f'WebREPL: {remote} put failed')
+
+    def _get_data(self, remote, local_file):
+        if not self.webrepl:
+            return super()._get_data(remote, local_file)
+        self._send_header(_WEBREPL_GET, remote)
+        while True:
+            self.dev.ws.send(b'\x00')
+            size, = struct.unpack('<H', self._ws_read(2))
+            if size == 0:
+                break
+            local_file.write(self._ws_read(size))
+        if self._read_resp() != 0:
+            raise DeviceException(f'WebREPL: {remote} get failed')
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""asyncio TCP connect scanner for WebREPL devices"""
+
+import asyncio
+import socket
+import ssl as sslib
+import threading
+import time
+
+WEBREPL_PORT = 8266
+WEBREPL_SSL_PORT = 8833
+
+_HANDSHAKE = (b'GET / HTTP/1.1\r\nHost: {}\r\nConnection: Upgrade\r\n'
+              b'Upgrade: websocket\r\nSec-WebSocket-Key: foo\r\n\r\n')
+
+# (subnet, ports, probe) : (timestamp, devices)
+_SCAN_CACHE = {}
+
+
+def find_localip():
+    ip_soc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        ip_soc.connect(('8.8.8.8', 1))
+        return ip_soc.getsockname()[0]
+    finally:
+        ip_soc.close()
+
+
+def subnet_hosts(subnet=None):
+    """Hosts of a /24 subnet given as 'a.b.c' or 'a.b.c.0/24' (default: local)"""
+    if subnet is None:
+        subnet = find_localip().rsplit('.', 1)[0]
+    subnet = subnet.split('/')[0]
+    if subnet.count('.') == 3:
+        subnet = subnet.rsplit('.', 1)[0]
+    return subnet, ['{}.{}'.format(subnet, i) for i in range(1, 255)]
+
+
+def run_coro(coro):
+    """Run a coroutine from sync code, also if an event loop is running"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    result = {}
+
+    def target():
+        try:
+            result['value'] = asyncio.run(coro)
+        except BaseException as e:
+            result['error'] = e
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+async def as_probe_webrepl(reader, writer, host, timeout):
+    """WebSocket handshake + read WebREPL 'Password:' prompt"""
+    writer.write(_HANDSHAKE.replace(b'{}', host.encode()))
+    await writer.drain()
+    header = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+    if b' 101 ' not in header.split(b'\r\n', 1)[0]:
+        return False
+    banner = await asyncio.wait_for(reader.read(64), timeout)
+    return b'Password:' in banner
+
+
+async def as_tcp_connect(host, port, timeout=0.5, probe=False, ssl=False):
+    """
+    TCP connect to host:port, returns dict with host, port, status
+    ('open'/'closed'), latency (ms) and webrepl (probe result or None)
+    """
+    ssl_ctx = None
+    if ssl:
+        ssl_ctx = sslib.SSLContext(sslib.PROTOCOL_TLS_CLIENT)
+        ssl_ctx.check_hostname = False
+        ssl_ctx.verify_mode = sslib.CERT_NONE
+    result = {'host': host, 'port': port, 'state': 'down', 'status': 'closed',
+              'latency': None, 'webrepl': None}
+    t0 = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_ctx), timeout)
+    except ConnectionRefusedError:
+        # host answered with RST, it is up but port is closed
+        result['state'] = 'up'
+        result['latency'] = (time.perf_counter() - t0) * 1000
+        return result
+    except (OSError, asyncio.TimeoutError):
+        return result
+    result.update(state='up', status='open',
+                  latency=(time.perf_counter() - t0) * 1000)
+    try:
+        if probe:
+            try:
+                result['webrepl'] = await as_probe_webrepl(reader, writer,
+                                                           host, timeout)
+            except (OSError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                result['webrepl'] = False
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+    return result
+
+
+async def as_scan(hosts, ports=(WEBREPL_PORT,), timeout=0.5, concurrency=256,
+                  probe=False):
+    """Concurrent TCP connect scan, returns open host/port results"""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def connect(host, port):
+        async with sem:
+            return await as_tcp_connect(host, port, timeout=timeout,
+                                        probe=probe,
+                                        ssl=port == WEBREPL_SSL_PORT)
+    results = await asyncio.gather(*[connect(host, port) for host in hosts
+                                     for port in ports])
+    return [res for res in results if res['status'] == 'open']
+
+
+def scan(subnet=None, ports=(WEBREPL_PORT,), timeout=0.5, concurrency=256,
+         probe=False, n=1, cache_ttl=0):
+    """
+    Scan a /24 subnet n times (results merged), if cache_ttl (s) > 0
+    results per subnet are reused while fresh.
+    """
+    subnet, hosts = subnet_hosts(subnet)
+    key = (subnet, tuple(ports), probe)
+    if cache_ttl and key in _SCAN_CACHE:
+        timestamp, devs = _SCAN_CACHE[key]
+        if time.time() - timestamp < cache_ttl:
+            return devs
+    found = {}
+    for i in range(n):
+        for dev in run_coro(as_scan(hosts, ports, timeout=timeout,
+                                    concurrency=concurrency, probe=probe)):
+            found.setdefault((dev['host'], dev['port']), dev)
+    devs = sorted(found.values(),
+                  key=lambda dev: (socket.inet_aton(dev['host']), dev['port']))
+    _SCAN_CACHE[key] = (time.time(), devs)
+    return devs
+
+
+def clear_cache():
+    _SCAN_CACHE.clear()
+
+
+# REACHABILITY
+
+def latency_summary(host, port, latencies, n_tries):
+    """Reachability dict from a list of latencies (None for lost tries)"""
+    rtts = [lat for lat in latencies if lat is not None]
+    summary = {'host': host, 'port': port, 'reachable': bool(rtts),
+               'n_tries': n_tries, 'lost': n_tries - len(rtts),
+               'loss(%)': round(100 * (n_tries - len(rtts)) / n_tries, 2),
+               'latency(ms)': None, 'min(ms)': None, 'max(ms)': None}
+    if rtts:
+        summary.update({'latency(ms)': round(sum(rtts) / len(rtts), 3),
+                        'min(ms)': round(min(rtts), 3),
+                        'max(ms)': round(max(rtts), 3)})
+    return summary
+
+
+async def as_tcp_ping(host, port=WEBREPL_PORT, timeout=0.5, n_tries=1):
+    """
+    TCP connect latency to host:port, a refused connection still means the
+    host is up and counts as reachable.
+    """
+    latencies = []
+    for i in range(n_tries):
+        res = await as_tcp_connect(host, port, timeout=timeout)
+        latencies.append(res['latency'])
+    return latency_summary(host, port, latencies, n_tries)
+
+
+def tcp_ping(host, port=WEBREPL_PORT, timeout=0.5, n_tries=1):
+    return run_coro(as_tcp_ping(host, port, timeout=timeout, n_tries=n_tries))
+
+
+async def as_check_reachable(targets, timeout=0.5, n_tries=1,
+                             concurrency=64):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def check(target):
+        host, port = target if isinstance(target, tuple) else (
+            target, WEBREPL_PORT)
+        async with sem:
+            return await as_tcp_ping(host, port, timeout=timeout,
+                                     n_tries=n_tries)
+    return await asyncio.gather(*[check(target) for target in targets])
+
+
+def check_reachable(targets, timeout=0.5, n_tries=1, concurrency=64):
+    """
+    Concurrent reachability of hosts or (host, port) targets, returns
+    {host: summary} with latency stats.
+    Do not use on devices with an open WebREPL connection (the device
+    prints a rejected connection message), use device.ping() instead.
+    """
+    results = run_coro(as_check_reachable(targets, timeout=timeout,
+                                          n_tries=n_tries,
+                                          concurrency=concurrency))
+    return {res['host']: res for res in results}
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Follow mode output pipeline and sinks"""
+
+import codecs
+import queue
+import sys
+import threading
+
+STDOUT = 'stdout'
+STDERR = 'stderr'
+PROMPT = 'prompt'
+
+_TRACEBACK = 'Traceback (most recent call last):'
+_PROMPT = '>>> '
+
+
+class OutputPipeline:
+    """
+    Decode and classify device output (stdout, traceback, prompt) as it is
+    received and dispatch it to sinks from a worker thread, through a bounded
+    queue so slow sinks do not stall device reads.
+
+    Pass it as pipe in follow mode: dev.wr_cmd(cmd, follow=True, pipe=pipeline)
+    Sinks are callables sink(text, std) with std 'stdout', 'stderr' or
+    'prompt'. If the queue is full events are dropped (block=False) or the
+    reader waits (block=True).
+    """
+
+    def __init__(self, *sinks, maxsize=1024, block=False):
+        self.sinks = list(sinks)
+        self.block = block
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.errors = 0
+        self._decoder = codecs.getincrementaldecoder('utf-8')('ignore')
+        self._partial = ''
+        self._in_traceback = False
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._dispatch,
+                                                daemon=True)
+                self._worker.start()
+
+    def _dispatch(self):
+        while True:
+            event = self.queue.get()
+            try:
+                if event is None:
+                    return
+                text, std = event
+                for sink in self.sinks:
+                    try:
+                        sink(text, std)
+                    except Exception:
+                        self.errors += 1
+            finally:
+                self.queue.task_done()
+
+    def emit(self, text, std=STDOUT):
+        self._start()
+        try:
+            self.queue.put((text, std), block=self.block)
+        except queue.Full:
+            self.dropped += 1
+
+    def _classify(self, line):
+        if line.startswith(_TRACEBACK):
+            self._in_traceback = True
+        elif _TRACEBACK in line:
+            stdout, tb = line.split(_TRACEBACK, 1)
+            self.emit(stdout, STDOUT)
+            self._in_traceback = True
+            line = _TRACEBACK + tb
+        self.emit(line, STDERR if self._in_traceback else STDOUT)
+
+    def feed(self, data):
+        """Feed raw bytes received from the device"""
+        text = self._decoder.decode(data)
+        if not text:
+            return
+        text = self._partial + text.replace('\r', '')
+        lines = text.split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._classify(line + '\n')
+        if self._partial.endswith(_PROMPT):
+            if self._partial != _PROMPT:
+                self._classify(self._partial[:-len(_PROMPT)])
+            self._partial = ''
+            self._in_traceback = False
+            self.emit(_PROMPT, PROMPT)
+
+    def flush(self):
+        """Emit pending partial line (end of command)"""
+        text = self._partial + self._decoder.decode(b'', final=True)
+        self._partial = ''
+        if text:
+            self._classify(text)
+        self._in_traceback = False
+
+    def __call__(self, text, std=STDOUT, execute_prompt=False):
+        # legacy pipe(text, std='stderr') callback interface
+        self.emit(text, std)
+
+    def join(self):
+        """Wait until sinks processed all queued output"""
+        if self._worker is not None and self._worker.is_alive():
+            self.queue.join()
+
+    def close(self):
+        self.flush()
+        if self._worker is not None and self._worker.is_alive():
+            self.queue.put(None)
+            self._worker.join()
+        self._worker = None
+
+
+# SINKS
+
+class TerminalSink:
+    """Print stdout/stderr, prompt is not printed"""
+
+    def __init__(self, stdout=None, stderr=None):
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def __call__(self, text, std=STDOUT):
+        if std == PROMPT:
+            return
+        if std == STDERR:
+            stream = self.stderr or sys.stderr
+        else:
+            stream = self.stdout or sys.stdout
+        stream.write(text)
+        stream.flush()
+
+
+class FileSink:
+    """Append output to a file, optionally including stderr"""
+
+    def __init__(self, filename, mode='a', stderr=True):
+        self.file = open(filename, mode)
+        self.stderr = stderr
+
+    def __call__(self, text, std=STDOUT):
+        if std == PROMPT or (std == STDERR and not self.stderr):
+            return
+        self.file.write(text)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class QueueSink:
+    """Put (text, std) events in a queue (queue.Queue or asyncio.Queue + loop)"""
+
+    def __init__(self, out_queue, loop=None):
+        self.queue = out_queue
+        self.loop = loop
+
+    def __call__(self, text, std=STDOUT):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, (text, std))
+        else:
+            self.queue.put((text, std))
+
+
+class SocketSink:
+    """Send output through a connected socket"""
+
+    def __init__(self, sock, encoding='utf-8'):
+        self.sock = sock
+        self.encoding = encoding
+
+    def __call__(self, text, std=STDOUT):
+        if std == PROMPT:
+            return
+        self.sock.sendall(text.encode(self.encoding))
+
+
+class PipeSink:
+    """Adapt a legacy pipe(text, std='stderr') callback"""
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+
+    def __call__(self, text, std=STDOUT):
+        if std == STDERR:
+            self.pipe(text, std='stderr')
+        elif std == STDOUT:
+            self.pipe(text)
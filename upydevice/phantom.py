@@ -24,8 +24,8 @@
 
 """Phantom classes collection"""
 
-from .upydevice import (upy_cmd_c_r, upy_cmd_c_raw_r, upy_cmd_c_r_in_callback,
-                        upy_cmd_c_r_nb, upy_cmd_c_r_nb_in_callback)
+from .decorators import (upy_cmd_c_r, upy_cmd_c_r_in_callback, upy_cmd_c_r_nb,
+                         upy_cmd_c_r_nb_in_callback)
 import time
 import socket
 import struct
@@ -34,6 +34,10 @@ from datetime import datetime
 from binascii import hexlify
 import json
 import os
+import statistics
+import threading
+import asyncio
+from collections import namedtuple
 
 
 # MICROPYTHON DEFAULT CLASSES
@@ -413,6 +417,17 @@ class AP:
 
 # IRQ UTILS
 
+# IRQ event frame header: magic, pin value, irq count, device ticks_ms
+IRQ_EVENT_HEADER = '!BBHI'
+IRQ_EVENT_HEADER_SIZE = struct.calcsize(IRQ_EVENT_HEADER)
+IRQ_EVENT_MAGIC = 0xA5
+# once a frame started, the rest must arrive within this time (s)
+IRQ_FRAME_TIMEOUT = 5
+
+IRQ_EVENT = namedtuple('IRQ_EVENT', ['value', 'count', 'ticks', 'data',
+                                     'timestamp'])
+
+
 class IRQ_MG:
     def __init__(self, device, name, init_soc=False, port=8005, p_format='f',
                  n_vars=3, sensor=None, log_dir=None, logg=None):
@@ -428,6 +443,9 @@ class IRQ_MG:
         self.data_length = struct.calcsize(self.p_format*self.n_vars)
         self.buffer = []
         self.log_dir = log_dir
+        self.event_size = IRQ_EVENT_HEADER_SIZE + self.data_length
+        self._listener = None
+        self._listening = threading.Event()
         # self.sensor, class U_IMU_IRQ (read_data, set_mode)
 
     @upy_cmd_c_r(rtn=False)
@@ -537,6 +555,113 @@ class IRQ_MG:
         except Exception as e:
             return None
 
+    # EVENT SUBSCRIPTION (device pushes event frames, no polling)
+
+    @upy_cmd_c_r(rtn=False)
+    def subscribe(self, trigger=3, debounce=50):
+        return self.dev_dict
+
+    @upy_cmd_c_r(rtn=False)
+    def unsubscribe(self):
+        return self.dev_dict
+
+    def recv_event(self, frame_timeout=IRQ_FRAME_TIMEOUT):
+        """
+        Read one event frame, returns IRQ_EVENT or None on timeout (or if
+        the listener is stopped), raises TimeoutError if a started frame is
+        not complete after frame_timeout s
+        """
+        frame = b''
+        deadline = None
+        while len(frame) < self.event_size:
+            try:
+                chunk = self.soc.conn.recv(self.event_size - len(frame))
+            except socket.timeout:
+                if not frame:
+                    return None
+                if (self._listener is not None
+                        and not self._listening.is_set()):
+                    return None
+                if time.monotonic() > deadline:
+                    raise TimeoutError('Incomplete IRQ event frame: {}'.format(
+                        hexlify(frame)))
+                continue
+            if not chunk:
+                raise ConnectionError('IRQ event socket closed')
+            if deadline is None:
+                deadline = time.monotonic() + frame_timeout
+            frame += chunk
+        magic, value, count, ticks = struct.unpack_from(IRQ_EVENT_HEADER,
+                                                        frame)
+        if magic != IRQ_EVENT_MAGIC:
+            raise ValueError('Bad IRQ event frame: {}'.format(hexlify(frame)))
+        data = struct.unpack_from(self.p_format*self.n_vars, frame,
+                                  IRQ_EVENT_HEADER_SIZE)
+        return IRQ_EVENT(value, count, ticks, data, time.time())
+
+    def _put_event(self, queue, loop, event):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+        except RuntimeError:  # consumer loop already closed
+            self._listening.clear()
+
+    def _dispatch_events(self, on_event, queue, loop):
+        while self._listening.is_set():
+            try:
+                event = self.recv_event()
+            except Exception as e:
+                if self._listening.is_set() and queue is not None:
+                    self._put_event(queue, loop, e)
+                self._listening.clear()
+                break
+            if event is None:
+                continue
+            self.d.output = event
+            if on_event is not None:
+                on_event(event)
+            if queue is not None:
+                self._put_event(queue, loop, event)
+
+    def listen(self, on_event=None, queue=None, loop=None):
+        """
+        Dispatch device event frames to on_event callback and/or asyncio queue
+        from a listener thread, needs start_server() and subscribe() first.
+        Connection errors are put in the queue to stop consumers.
+        """
+        if queue is not None and loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = asyncio.get_event_loop()
+        self.stop_listen()
+        self._listening.set()
+        self._listener = threading.Thread(target=self._dispatch_events,
+                                          args=(on_event, queue, loop),
+                                          daemon=True)
+        self._listener.start()
+        return self._listener
+
+    def stop_listen(self, timeout=None):
+        self._listening.clear()
+        if self._listener is not None:
+            if self._listener is not threading.current_thread():
+                self._listener.join(timeout or self.soc.soc_timeout + 1)
+            self._listener = None
+
+    async def events(self, maxsize=0):
+        """Async iterator of IRQ_EVENT pushed by the device"""
+        queue = asyncio.Queue(maxsize=maxsize)
+        self.listen(queue=queue, loop=asyncio.get_running_loop())
+        try:
+            while True:
+                event = await queue.get()
+                if isinstance(event, Exception):
+                    raise event
+                yield event
+        finally:
+            # do not block the event loop joining the listener thread
+            self._listening.clear()
+
     # + LOG_OPTION
     def async_soc_irq_listener_loop(self, on_irq, func_loop=None,
                                     wait_time=0.05, log_nf=False,
@@ -669,19 +794,151 @@ class IRQ_MG:
         self.buffer = []
 
 
+# UDP STREAM
+
+# datagram header: sequence number, device ticks_ms
+UDP_HEADER = '!II'
+UDP_HEADER_SIZE = struct.calcsize(UDP_HEADER)
+TICKS_PERIOD = 1 << 30  # MicroPython ticks_ms wrap around
+UDP_SEQ_PERIOD = 1 << 32  # sequence numbers wrap around at the field size
+
+
+class UDP_STREAM_TRACKER:
+    """
+    Reorders UDP stream datagrams by sequence number and keeps loss stats.
+    Sequence numbers are unwrapped (UDP_SEQ_PERIOD), gaps are datagrams
+    lost in the network; samples dropped in the device are reported by
+    U_STREAMER.udp_stats.
+    """
+
+    def __init__(self, reorder_window=8, samples_per_packet=1):
+        self.reorder_window = reorder_window
+        self.samples_per_packet = samples_per_packet
+        self.reset()
+
+    def reset(self):
+        self.next_seq = None
+        self.first_seq = None
+        self.pending = {}
+        self.lost_seqs = set()
+        self.received = 0
+        self.released = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.late = 0
+        self.last_ts = None
+        self.ts_span = 0
+        self.t0 = None
+        self.t1 = None
+
+    def push(self, seq, ts, data):
+        """Add a datagram, returns the datagrams that can be released in
+        order as a list of (seq, ts, data)"""
+        now = time.time()
+        if self.t0 is None:
+            self.t0 = now
+        self.t1 = now
+        self.received += 1
+        packet = (seq, ts, data)
+        if self.next_seq is None:
+            self.next_seq = seq
+            self.first_seq = seq
+        seq = self._unwrap(seq)
+        if seq < self.next_seq:
+            if seq in self.lost_seqs:
+                # arrived after its gap was declared lost
+                self.lost_seqs.discard(seq)
+                self.late += 1
+            else:
+                self.duplicates += 1
+            return []
+        if seq in self.pending:
+            self.duplicates += 1
+            return []
+        if self.pending and seq < max(self.pending):
+            self.reordered += 1
+        self.pending[seq] = packet
+        return self._release()
+
+    def _unwrap(self, seq):
+        # nearest sequence number to next_seq (keeps growing past the wrap)
+        delta = (seq - self.next_seq) % UDP_SEQ_PERIOD
+        if delta >= UDP_SEQ_PERIOD // 2:
+            delta -= UDP_SEQ_PERIOD
+        return self.next_seq + delta
+
+    def flush(self):
+        """Release all pending datagrams, missing ones are counted as lost"""
+        return self._release(force=True)
+
+    def _release(self, force=False):
+        released = []
+        while self.pending:
+            if self.next_seq in self.pending:
+                packet = self.pending.pop(self.next_seq)
+                if self.last_ts is not None:
+                    self.ts_span += (packet[1] - self.last_ts) % TICKS_PERIOD
+                self.last_ts = packet[1]
+                released.append(packet)
+                self.released += 1
+                self.next_seq += 1
+            elif force or len(self.pending) > self.reorder_window:
+                # give up waiting for the gap
+                next_seq = min(self.pending)
+                self.lost += next_seq - self.next_seq
+                self.lost_seqs.update(range(self.next_seq, next_seq))
+                if len(self.lost_seqs) > 1024:
+                    self.lost_seqs = {lseq for lseq in self.lost_seqs
+                                      if lseq > next_seq - 1024}
+                self.next_seq = next_seq
+            else:
+                break
+        return released
+
+    def stats(self):
+        n_expected = self.released + self.lost
+        spp = self.samples_per_packet
+        stats = {'packets': self.released, 'samples': self.released * spp,
+                 'lost': self.lost, 'lost_samples': self.lost * spp,
+                 'loss(%)': 0.0, 'reordered': self.reordered,
+                 'duplicates': self.duplicates, 'late': self.late,
+                 'duration(s)': 0.0, 'fs(hz)': None, 'effective_fs(hz)': None,
+                 'host_fs(hz)': None}
+        if n_expected:
+            stats['loss(%)'] = round(100 * self.lost / n_expected, 2)
+        if self.ts_span:
+            span = self.ts_span / 1000
+            stats['duration(s)'] = span
+            # packets sent over the span = released + lost - 1
+            stats['fs(hz)'] = round((n_expected - 1) * spp / span, 2)
+            stats['effective_fs(hz)'] = round((self.released - 1) * spp / span,
+                                              2)
+        if self.t0 is not None and self.t1 > self.t0:
+            stats['host_fs(hz)'] = round(
+                (self.released - 1) * spp / (self.t1 - self.t0), 2)
+        return stats
+
+
 # TCP STREAMER
 class STREAMER:
     def __init__(self, device, name, init_soc=False, port=8005, p_format='f',
                  n_vars=3, log_dir=None, chunk_buffer_size=20, soc_timeout=1,
-                 logg=None):
+                 logg=None, udp=False, reorder_window=8):
         self.d = device
         self.name = name
         self.dev_dict = {'name': self.name, 'dev': device}
         self.soc = None
         self.port = port
+        self.udp = udp
         if init_soc:
-            self.soc = socket_server(port=self.port, soc_timeout=soc_timeout,
-                                     logg=logg)
+            if udp:
+                self.soc = udp_socket_server(port=self.port,
+                                             soc_timeout=soc_timeout,
+                                             logg=logg)
+            else:
+                self.soc = socket_server(port=self.port,
+                                         soc_timeout=soc_timeout, logg=logg)
         self.p_format = p_format
         self.n_vars = n_vars
         self.data_length = struct.calcsize(self.p_format*self.n_vars)
@@ -694,6 +951,9 @@ class STREAMER:
         self.time_test = 0
         self._json_errors = 0
         self._json_buffer = ' '
+        self.udp_tracker = UDP_STREAM_TRACKER(reorder_window=reorder_window)
+        self._udp_chunk = False
+        self.stream_test_result = None
 
     # STREAM CLASS INHERITANCE
     @upy_cmd_c_r()
@@ -760,6 +1020,61 @@ class STREAMER:
         else:
             return False
 
+    # UDP
+
+    @upy_cmd_c_r(debug=True)
+    def connect_UDP(self, host, port, chunk=False):
+        return self.dev_dict
+
+    @upy_cmd_c_r(rtn=False)
+    def disconnect_UDP(self):
+        return self.dev_dict
+
+    @upy_cmd_c_r()
+    def udp_stats(self):
+        return self.dev_dict
+
+    def start_udp_server(self, chunk=False):
+        self._udp_chunk = chunk
+        self.udp_tracker.samples_per_packet = 1
+        if chunk:
+            self.udp_tracker.samples_per_packet = self.chunk_buffer_size
+        self.udp_tracker.reset()
+        self.soc.start_SOC()
+        self.connect_UDP(self.soc.host, self.port, chunk=chunk)
+
+    def stop_udp_server(self):
+        self.disconnect_UDP()
+        self.soc.close()
+
+    def soc_recv_udp_message(self):
+        """Returns the datagrams released in sequence order as a list of
+        (seq, ts, data)"""
+        try:
+            data = self.soc.recv_datagram()
+            seq, ts = struct.unpack_from(UDP_HEADER, data)
+            if self._udp_chunk:
+                data_unpack = struct.unpack_from(
+                    self.p_format*self.chunk_buffer_size, data,
+                    UDP_HEADER_SIZE)
+            else:
+                data_unpack = struct.unpack_from(self.p_format*self.n_vars,
+                                                 data, UDP_HEADER_SIZE)
+        except Exception as e:
+            return []
+        released = self.udp_tracker.push(seq, ts, data_unpack)
+        if released:
+            self.d.output = released[-1][2]
+        return released
+
+    def get_udp_stats(self, device=False):
+        stats = self.udp_tracker.stats()
+        if device:
+            dev_stats = self.udp_stats()
+            if isinstance(dev_stats, list):
+                stats['dev_seq'], stats['dev_dropped'] = dev_stats
+        return stats
+
     # STREAM METHODS
     @upy_cmd_c_r_nb(rtn=False)
     def sample_send(self):
@@ -848,6 +1163,50 @@ class STREAMER:
                     print('Done!')
                     break
 
+    # CONTINUOS UDP STREAM (+ LOG_OPTION (FILE OR BUFFER))
+    def continuous_udp_stream(self, on_message, timeout=100, init=True,
+                              chunk=False, log=False, buffer=False,
+                              on_init=None, n_samples=None):
+        if init:
+            self.fq = 1/(timeout/1000)
+            self.header['fq(hz)'] = self.fq
+            sampling_callback = self.udp_sample_send_call
+            if chunk:
+                sampling_callback = self.udp_chunk_send_call
+            self.start_send(sampling_callback=sampling_callback,
+                            timeout=timeout, on_init=on_init)
+        if log:
+            name_file = self.lognow(self.sens_mode)
+
+        def _on_packets(packets):
+            for seq, ts, soc_data in packets:
+                on_message(soc_data)
+                if log:
+                    if chunk:
+                        self.log_data_chunk(name_file, soc_data)
+                    else:
+                        self.log_data(name_file, soc_data)
+                if buffer:
+                    if chunk:
+                        self.log_data_chunk_buff(soc_data)
+                    else:
+                        self.log_data_buff(soc_data)
+
+        while True:
+            try:
+                _on_packets(self.soc_recv_udp_message())
+                if n_samples is not None:
+                    if self.udp_tracker.stats()['samples'] >= n_samples:
+                        raise KeyboardInterrupt
+            except KeyboardInterrupt:
+                self.stop_send()
+                _on_packets(self.udp_tracker.flush())
+                print('\n')
+                self.soc.flush()
+                print('Done!')
+                break
+        return self.get_udp_stats()
+
     def data_print(self, x):
         try:
             print(self.data_print_msg.format(*x, self.header['UNIT']))
@@ -1005,6 +1364,12 @@ class STREAMER:
     def chunk_send_json(self, x):
         pass
 
+    def udp_sample_send_call(self, x):
+        pass
+
+    def udp_chunk_send_call(self, x):
+        pass
+
     # LOG methods
 
     # FILE LOG
@@ -1145,33 +1510,199 @@ class STREAMER:
         self.buffer = []
 
     # STREAM TEST
-    def get_stream_test(self, chunk=False, json=False):
-        print('STREAM TEST RESULTS ARE:')
-        print('TEST DURATION : {} (s)'.format(self.time_test))
-        # # FIND SAMPLING RATE
-        # Method 1:
-        N_DATA_PACKETS = len(self.buffer)  # Number of batches received
-        print('DATA PACKETS : {} packets'.format(N_DATA_PACKETS))
-        # (assuming al batches = buffer_size long)
+    def stream_test(self, duration=None, n_samples=None, mode='sample',
+                    timeout=100, init=True, on_init=None, bins=10):
+        """Run a stream benchmark for a fixed duration (s) or number of
+        samples, mode: 'sample', 'chunk' or 'udp'. Returns STREAM_TEST_RESULT"""
+        if duration is None and n_samples is None:
+            duration = 10
+        if mode == 'chunk':
+            recv = self.soc_recv_chunk_message
+            sampling_callback = self.chunk_send_call
+            spp = self.chunk_buffer_size
+            packet_size = self.chunk_buffer_data_length
+        elif mode == 'udp':
+            recv = self.soc_recv_udp_message
+            sampling_callback = self.udp_sample_send_call
+            spp = self.udp_tracker.samples_per_packet
+            if self._udp_chunk:
+                sampling_callback = self.udp_chunk_send_call
+                packet_size = UDP_HEADER_SIZE + self.chunk_buffer_data_length
+            else:
+                packet_size = UDP_HEADER_SIZE + self.data_length
+        else:
+            recv = self.soc_recv_message
+            sampling_callback = self.sample_send_call
+            spp = 1
+            packet_size = self.data_length
+        if init:
+            self.fq = 1/(timeout/1000)
+            self.start_send(sampling_callback=sampling_callback,
+                            timeout=timeout, on_init=on_init)
+        arrivals = []
+        t0 = time.perf_counter()
+        try:
+            while True:
+                if duration is not None:
+                    if time.perf_counter() - t0 >= duration:
+                        break
+                if n_samples is not None:
+                    if len(arrivals) * spp >= n_samples:
+                        break
+                soc_data = recv()
+                if mode == 'udp':
+                    arrivals += [time.perf_counter() for packet in soc_data]
+                elif soc_data is not None:
+                    arrivals.append(time.perf_counter())
+        except KeyboardInterrupt:
+            pass
+        self.time_test = time.perf_counter() - t0
+        if init:
+            self.stop_send()
+        lost = None
+        if mode == 'udp':
+            arrivals += [time.perf_counter() for packet in
+                         self.udp_tracker.flush()]
+            lost = self.udp_tracker.lost
+        elif init and self.fq:
+            # chunk callbacks send one packet every BUFFERSIZE + 1 ticks
+            period = 1/self.fq
+            if mode == 'chunk':
+                period *= spp + 1
+            lost = max(0, int(self.time_test / period) - len(arrivals))
+        self.stream_test_result = STREAM_TEST_RESULT(
+            arrivals, packet_size=packet_size, samples_per_packet=spp,
+            n_vars=self.n_vars, duration=self.time_test, lost=lost, bins=bins)
+        return self.stream_test_result
+
+    def get_stream_test(self, chunk=False, json=False, prnt=True):
         BUFFERSIZE = self.chunk_buffer_size
         if not chunk:
             BUFFERSIZE = 1
-        Fs = ((N_DATA_PACKETS+1)*BUFFERSIZE/self.time_test)
-        print('SAMPLES PER PACKET : {}'.format(BUFFERSIZE))
-        print('VARIABLES PER SAMPLE : {}; {}'.format(
-            len(self.header['VAR']), self.header['VAR']))
         packet_size = self.chunk_buffer_data_length
         if not chunk:
             packet_size = self.data_length
         if json:
             packet_size = self.chunk_buffer_json_size
-        print('SIZE OF PACKETS: {} bytes'.format(packet_size))
-        print('Period: {} ms ; Fs:{} Hz, Data send rate: {} packets/s of {} samples'.format(
-            round((1/Fs)*1e3), round(Fs, -1),
-            round(N_DATA_PACKETS/self.time_test), BUFFERSIZE))
-        kBs = round(N_DATA_PACKETS/self.time_test)*packet_size/1024
-        print('DATA TRANSFER RATE (kBps): {} kB/s'.format(kBs))
-        print('DATA TRANSFER RATE (Mbps): {} Mbps'.format((kBs*8)/1000))
+        # packets in buffer, arrival times were not recorded
+        result = STREAM_TEST_RESULT([], packet_size=packet_size,
+                                    samples_per_packet=BUFFERSIZE,
+                                    n_vars=self.n_vars,
+                                    duration=self.time_test,
+                                    n_packets=len(self.buffer))
+        if prnt:
+            print(result)
+        return result
+
+
+class STREAM_TEST_RESULT:
+    """
+    Stream benchmark results: inter-arrival times, jitter, throughput and loss
+    """
+
+    def __init__(self, arrivals, packet_size, samples_per_packet=1, n_vars=1,
+                 duration=None, lost=None, bins=10, n_packets=None):
+        self.arrivals = arrivals
+        self.packet_size = packet_size
+        self.samples_per_packet = samples_per_packet
+        self.n_vars = n_vars
+        self.n_packets = len(arrivals) if n_packets is None else n_packets
+        self.n_samples = self.n_packets * samples_per_packet
+        self.n_bytes = self.n_packets * packet_size
+        self.duration = duration
+        if self.duration is None:
+            self.duration = arrivals[-1] - arrivals[0] if arrivals else 0
+        self.lost = lost
+        self.loss = None
+        if lost is not None and (self.n_packets + lost):
+            self.loss = round(100 * lost / (self.n_packets + lost), 2)
+        self.inter_arrival = [(t1 - t0) * 1e3 for t0, t1 in zip(arrivals[:-1],
+                                                                arrivals[1:])]
+        self.histogram = self._histogram(bins)
+
+    @property
+    def packets_per_s(self):
+        if self.duration:
+            return self.n_packets / self.duration
+
+    @property
+    def samples_per_s(self):
+        if self.duration:
+            return self.n_samples / self.duration
+
+    @property
+    def bytes_per_s(self):
+        if self.duration:
+            return self.n_bytes / self.duration
+
+    @property
+    def mean_interval(self):
+        if self.inter_arrival:
+            return statistics.mean(self.inter_arrival)
+
+    @property
+    def jitter(self):
+        if len(self.inter_arrival) > 1:
+            return statistics.stdev(self.inter_arrival)
+
+    def percentile(self, pc):
+        if self.inter_arrival:
+            data = sorted(self.inter_arrival)
+            return data[min(len(data) - 1, int(round(pc/100 * (len(data) - 1))))]
+
+    def _histogram(self, bins):
+        if not self.inter_arrival:
+            return []
+        lo, hi = min(self.inter_arrival), max(self.inter_arrival)
+        width = (hi - lo) / bins or 1
+        counts = [0] * bins
+        for val in self.inter_arrival:
+            counts[min(bins - 1, int((val - lo) / width))] += 1
+        return [(lo + i * width, lo + (i + 1) * width, counts[i])
+                for i in range(bins)]
+
+    def as_dict(self):
+        return {'duration(s)': self.duration, 'packets': self.n_packets,
+                'samples': self.n_samples, 'bytes': self.n_bytes,
+                'samples_per_packet': self.samples_per_packet,
+                'packet_size': self.packet_size,
+                'packets/s': self.packets_per_s,
+                'samples/s': self.samples_per_s, 'bytes/s': self.bytes_per_s,
+                'interval(ms)': self.mean_interval, 'jitter(ms)': self.jitter,
+                'p50(ms)': self.percentile(50), 'p95(ms)': self.percentile(95),
+                'p99(ms)': self.percentile(99), 'lost': self.lost,
+                'loss(%)': self.loss, 'histogram': self.histogram}
+
+    def __repr__(self):
+        lines = ['STREAM TEST RESULTS ARE:',
+                 'TEST DURATION : {} (s)'.format(self.duration),
+                 'DATA PACKETS : {} packets'.format(self.n_packets),
+                 'SAMPLES PER PACKET : {}'.format(self.samples_per_packet),
+                 'VARIABLES PER SAMPLE : {}'.format(self.n_vars),
+                 'SIZE OF PACKETS: {} bytes'.format(self.packet_size)]
+        if self.duration:
+            lines.append('Fs: {:.1f} Hz, Data send rate: {:.1f} packets/s of {}'
+                         ' samples'.format(self.samples_per_s,
+                                           self.packets_per_s,
+                                           self.samples_per_packet))
+            lines.append('DATA TRANSFER RATE (kBps): {:.3f} kB/s'.format(
+                self.bytes_per_s/1024))
+            lines.append('DATA TRANSFER RATE (Mbps): {:.5f} Mbps'.format(
+                self.bytes_per_s*8/1e6))
+        if self.inter_arrival:
+            lines.append('INTER-ARRIVAL (ms): mean {:.2f}, p50 {:.2f}, '
+                         'p95 {:.2f}, p99 {:.2f}'.format(
+                             self.mean_interval, self.percentile(50),
+                             self.percentile(95), self.percentile(99)))
+        if self.jitter is not None:
+            lines.append('JITTER (ms): {:.2f}'.format(self.jitter))
+        if self.lost is not None:
+            lines.append('LOST PACKETS: {} ({} %)'.format(self.lost, self.loss))
+        for lo, hi, count in self.histogram:
+            lines.append('{:>9.2f} - {:<9.2f} ms | {}'.format(lo, hi, count))
+        return '\n'.join(lines)
+
+
 #############################################
 # SENSORS
 
@@ -1346,12 +1877,12 @@ class ADS_IRQ(IRQ_MG):
 class IMU_STREAMER(STREAMER):
     def __init__(self, device, name, init_soc=False, port=8005, p_format='f',
                  n_vars=3, log_dir=None, max_digit=8, chunk_buff_size=32,
-                 soc_timeout=1):
+                 soc_timeout=1, udp=False):
         super().__init__(device, name, init_soc=init_soc, port=port,
                          p_format=p_format,
                          n_vars=n_vars, log_dir=log_dir,
                          chunk_buffer_size=chunk_buff_size,
-                         soc_timeout=soc_timeout)
+                         soc_timeout=soc_timeout, udp=udp)
         # CUSTOM SENS
         self.header = {'VAR': ['X', 'Y', 'Z'], 'UNIT': 'g=-9.8m/s^2',
                        'fq(hz)': self.fq}
@@ -1393,11 +1924,11 @@ class IMU_STREAMER(STREAMER):
 
 class BME_STREAMER(STREAMER):
     def __init__(self, device, name, init_soc=False, port=8005, p_format='f',
-                 n_vars=3, log_dir=None, soc_timeout=1, logg=None):
+                 n_vars=3, log_dir=None, soc_timeout=1, logg=None, udp=False):
         super().__init__(device, name, init_soc=init_soc, port=port,
                          p_format=p_format,
                          n_vars=n_vars, log_dir=log_dir,
-                         soc_timeout=soc_timeout, logg=logg)
+                         soc_timeout=soc_timeout, logg=logg, udp=udp)
         # CUSTOM SENS
         self.header = {'VAR': ['Temp', 'Press', 'RH'], 'UNIT': 'C ; Pa ; %',
                        'fq(hz)': self.fq}
@@ -1410,11 +1941,11 @@ class BME_STREAMER(STREAMER):
 
 class ADS_STREAMER(STREAMER):
     def __init__(self, device, name, init_soc=False, port=8005, p_format='f',
-                 n_vars=1, log_dir=None, channel=0, soc_timeout=1):
+                 n_vars=1, log_dir=None, channel=0, soc_timeout=1, udp=False):
         super().__init__(device, name, init_soc=init_soc, port=port,
                          p_format=p_format,
                          n_vars=n_vars, log_dir=log_dir,
-                         soc_timeout=soc_timeout)
+                         soc_timeout=soc_timeout, udp=udp)
 
         # CUSTOM SENS
         self.channel = channel
@@ -1465,20 +1996,22 @@ class socket_server:
     Socket server simple class
     """
 
-    def __init__(self, port, buff=1024, soc_timeout=1, logg=None):
+    def __init__(self, port, buff=1024, soc_timeout=1, logg=None, host=None):
         self.log = logg
-        try:
-            self.host = self.find_localip()
-            if self.log is not None:
-                self.log.info('Host IP: {}'.format(self.host))
-            else:
-                print(self.host)
-        except Exception as e:
-            if self.log is not None:
-                self.log.error('Connection ERROR', exc_info=True)
-            else:
-                print(str(e))
-            pass
+        self.host = host
+        if host is None:
+            try:
+                self.host = self.find_localip()
+                if self.log is not None:
+                    self.log.info('Host IP: {}'.format(self.host))
+                else:
+                    print(self.host)
+            except Exception as e:
+                if self.log is not None:
+                    self.log.error('Connection ERROR', exc_info=True)
+                else:
+                    print(str(e))
+                pass
         self.host_ap = '192.168.4.1'
         self.port = port
         self.serv_soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -1555,6 +2088,76 @@ class socket_server:
         print(self.buff.decode())
 
 
+# UDP SOCKET SERVER
+
+class udp_socket_server:
+    """
+    UDP socket server simple class
+    """
+
+    def __init__(self, port, buff=1024, soc_timeout=1, logg=None, host=None):
+        self.log = logg
+        self.host = host
+        if host is None:
+            try:
+                self.host = self.find_localip()
+                if self.log is not None:
+                    self.log.info('Host IP: {}'.format(self.host))
+                else:
+                    print(self.host)
+            except Exception as e:
+                if self.log is not None:
+                    self.log.error('Connection ERROR', exc_info=True)
+                else:
+                    print(str(e))
+                pass
+        self.port = port
+        self.serv_soc = None
+        self.buff_size = buff
+        self.addr_client = None
+        self.soc_timeout = soc_timeout
+
+    def find_localip(self):
+        ip_soc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        ip_soc.connect(('8.8.8.8', 1))
+        local_ip = ip_soc.getsockname()[0]
+        ip_soc.close()
+        return local_ip
+
+    def start_SOC(self, recv_sock=None):
+        self.serv_soc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.serv_soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.serv_soc.bind((self.host, self.port))
+        self.serv_soc.settimeout(self.soc_timeout)
+        if self.log is not None:
+            self.log.info('UDP Server listening...')
+        else:
+            print('UDP Server listening...')
+        if recv_sock:
+            recv_sock(self.host, self.port)
+
+    def flush(self):
+        self.serv_soc.settimeout(0)
+        flushed = 0
+        while flushed == 0:
+            try:
+                self.serv_soc.recv(self.buff_size)
+            except Exception as e:
+                flushed = 1
+                if self.log is not None:
+                    self.log.info('Flushed!')
+                else:
+                    print('Flushed!')
+        self.serv_soc.settimeout(self.soc_timeout)
+
+    def recv_datagram(self):
+        data, self.addr_client = self.serv_soc.recvfrom(self.buff_size)
+        return data
+
+    def close(self):
+        self.serv_soc.close()
+
+
 # SOCKET CLIENT
 
 class socket_client:
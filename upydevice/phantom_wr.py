@@ -23,9 +23,7 @@
 
 """Phantom WR classes collection"""
 
-from .upydevice import (upy_cmd_c_r, upy_cmd_c_raw_r, upy_cmd_c_r_in_callback,
-                        upy_cmd_c_r_nb, upy_cmd_c_r_nb_in_callback,
-                        upy_wrcmd_c_r, upy_wrcmd_c_r_in_callback)
+from .decorators import upy_wrcmd_c_r
 import time
 import socket
 import struct
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+"""Host side mpy-cross precompilation of code definitions and loaded modules"""
+
+from collections import namedtuple
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from .devtools import dev_path
+from .decorators import repl_exec
+from .exceptions import DeviceException
+from .filetransfer import file_hash
+
+# .mpy ABI of the device firmware (sys.implementation._mpy) and os.uname()
+# release/machine
+MPY_ABI = namedtuple('MPY_ABI', ['version', 'sub_version', 'arch', 'release',
+                                 'machine'])
+
+# sys.implementation._mpy arch field (py/persistentcode.h), mpy-cross -march
+ARCHS = ('', 'x86', 'x64', 'armv6', 'armv6m', 'armv7m', 'armv7em',
+         'armv7emsp', 'armv7emdp', 'xtensa', 'xtensawin', 'rv32imc')
+
+# os.uname().machine -> -march, for firmware that does not report it (ports
+# without native code emitter), first match wins
+MACHINE_ARCHS = (('ESP32C3', 'rv32imc'), ('ESP32-C3', 'rv32imc'),
+                 ('ESP32', 'xtensawin'), ('ESP8266', 'xtensa'),
+                 ('RP2040', 'armv6m'), ('STM32F4', 'armv7emsp'),
+                 ('STM32F7', 'armv7emdp'), ('STM32H7', 'armv7emdp'),
+                 ('nRF52', 'armv7emsp'), ('SAMD21', 'armv6m'),
+                 ('SAMD51', 'armv7emsp'))
+
+CACHE_DIR = os.path.join(dev_path, 'mpy_cache')
+
+# device directory of uploaded .mpy files (appended to sys.path), module
+# name prefixes of code definitions and loaded files
+DEVICE_DIR = '/.upyd_mpy'
+FUNC_PREFIX = '_upyd_f_'
+MODULE_PREFIX = '_upyd_m_'
+
+# device side helper: import the uploaded module and copy its names into
+# the REPL globals
+_MPY_CODE = """def _upyd_mpyi(mod, path={!r}):
+    import sys
+    if path not in sys.path:
+        sys.path.append(path)
+    sys.modules.pop(mod, None)
+    m = __import__(mod)
+    sys.modules.pop(mod, None)
+    g = globals()
+    for k in dir(m):
+        if not k.startswith('__'):
+            g[k] = getattr(m, k)
+""".format(DEVICE_DIR)
+
+_MPY_NAME = '_upyd_mpy'
+
+_ABI_CMD = ("import sys, os; [getattr(sys.implementation, '_mpy', 0), "
+            "os.uname().release, os.uname().machine]")
+
+
+def machine_arch(machine):
+    """mpy-cross -march of an os.uname().machine string ('' if unknown)"""
+    for key, arch in MACHINE_ARCHS:
+        if key.lower() in machine.lower():
+            return arch
+    return ''
+
+
+def parse_abi(mpy, release, machine):
+    """MPY_ABI of sys.implementation._mpy and os.uname() release/machine"""
+    arch = mpy >> 10
+    arch = ARCHS[arch] if arch < len(ARCHS) else ''
+    return MPY_ABI(mpy & 0xff, (mpy >> 8) & 3, arch or machine_arch(machine),
+                   release, machine)
+
+
+def abi_tag(abi):
+    return 'v{}.{}-{}'.format(abi.version, abi.sub_version, abi.arch or 'any')
+
+
+class MpyCross:
+    """
+    mpy-cross compiler: path, MPY_CROSS environment variable, mpy-cross in
+    PATH or the mpy-cross pip package, in this order. available is False
+    if none is found (sources are sent as is).
+    """
+
+    def __init__(self, path=None, timeout=30):
+        self.path = path or self._find()
+        self.timeout = timeout
+        self._version = None
+
+    @staticmethod
+    def _find():
+        path = os.environ.get('MPY_CROSS') or shutil.which('mpy-cross')
+        if path is None:
+            try:
+                import mpy_cross
+                path = getattr(mpy_cross, 'mpy_cross', None)
+            except ImportError:
+                pass
+        return path
+
+    @property
+    def available(self):
+        return bool(self.path) and os.path.isfile(self.path)
+
+    @property
+    def version(self):
+        """(mpy version, sub version) emitted, None if unknown"""
+        if self._version is None and self.available:
+            try:
+                out = subprocess.run([self.path, '--version'],
+                                     capture_output=True, text=True,
+                                     timeout=self.timeout).stdout
+            except (OSError, subprocess.SubprocessError):
+                return None
+            # e.g. "...; mpy-cross emitting mpy v6" or "mpy v6.1"
+            match = re.search(r'mpy v(\d+)(?:\.(\d+))?', out)
+            if match:
+                self._version = (int(match.group(1)),
+                                 int(match.group(2) or 0))
+        return self._version
+
+    def compile(self, source, name, arch=''):
+        """.mpy bytes of source (module name.py), None on compile errors"""
+        with tempfile.TemporaryDirectory(prefix='upyd_mpy_') as tmp:
+            src = os.path.join(tmp, name + '.py')
+            out = os.path.join(tmp, name + '.mpy')
+            with open(src, 'w') as src_file:
+                src_file.write(source)
+            cmd = [self.path, '-o', out, '-s', name + '.py']
+            if arch:
+                cmd.append('-march={}'.format(arch))
+            try:
+                subprocess.run(cmd + [src], capture_output=True,
+                               timeout=self.timeout, check=True)
+            except (OSError, subprocess.SubprocessError):
+                return None
+            with open(out, 'rb') as mpy_file:
+                return mpy_file.read()
+
+
+class MpyCache:
+    """
+    Compiled .mpy files by source hash and ABI tag in directory, shared by
+    devices and host sessions so unchanged code is compiled once.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def path(self, source, name, abi):
+        digest = hashlib.sha256('{}\0{}'.format(name, source).encode(
+            'utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, '{}-{}.mpy'.format(digest,
+                                                                abi_tag(abi)))
+
+    def get(self, source, name, abi, compiler):
+        """Local path of the compiled source, None on compile errors"""
+        path = self.path(source, name, abi)
+        if os.path.isfile(path):
+            with self._lock:
+                self.hits += 1
+            return path
+        data = compiler.compile(source, name, abi.arch)
+        if data is None:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        # atomic, other processes may compile the same source
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self.misses += 1
+        return path
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.mpy'):
+                    os.remove(os.path.join(self.directory, name))
+
+
+MPY_CACHE = MpyCache()
+
+
+class DevicePrecompile:
+    """
+    Code definitions (DeviceCodeCache.define) and load() uploaded as .mpy
+    compiled on the host for the device ABI, opt-in:
+
+        dev.precompile.enabled = True
+
+    The device skips parsing and compiling (less RAM and import time).
+    Definitions run as a module: functions see their module globals, not
+    the REPL globals, so they must import what they use.
+    Without a compatible mpy-cross (missing or other mpy version than the
+    firmware) sources are sent as is.
+    """
+
+    def __init__(self, device, enabled=False, compiler=None, cache=MPY_CACHE):
+        self.dev = device
+        self.enabled = enabled
+        self.compiler = compiler or MpyCross()
+        self.cache = cache
+        self._abi = None
+
+    def _exec(self, cmd):
+        return repl_exec(self.dev, cmd)
+
+    def setup(self):
+        self.dev.code_cache.define_exec(_MPY_NAME, _MPY_CODE)
+
+    @property
+    def abi(self):
+        """MPY_ABI of the device firmware"""
+        if self._abi is None:
+            abi = self._exec(_ABI_CMD)
+            if not isinstance(abi, list):
+                raise DeviceException(self.dev.response)
+            self._abi = parse_abi(*abi)
+        return self._abi
+
+    @property
+    def compatible(self):
+        """mpy-cross available and emitting the firmware mpy version"""
+        if not self.compiler.available:
+            return False
+        abi = self.abi
+        return self.compiler.version == (abi.version, abi.sub_version)
+
+    def use(self, precompile=None):
+        """precompile argument (None: enabled) and compatible mpy-cross"""
+        if precompile is None:
+            precompile = self.enabled
+        return bool(precompile) and self.compatible
+
+    def compile(self, source, name):
+        """Local .mpy path of source (module name), None on compile errors"""
+        return self.cache.get(source, name, self.abi, self.compiler)
+
+    def _upload(self, source, module):
+        path = self.compile(source, module)
+        if path is None:
+            return False
+        remote = '{}/{}.mpy'.format(DEVICE_DIR, module)
+        # kept across reboots, only sent if changed
+        stat = (os.path.getsize(path), file_hash(path))
+        if self.dev.filetransfer.remote_stats([remote])[0] != stat:
+            self.dev.put(path, remote, verify=False)
+        self.setup()
+        return True
+
+    def define(self, name, str_func, register):
+        """
+        Define code from a compiled module, returns False if it does not
+        compile (code_cache pastes it, the device reports the error)
+        """
+        module = FUNC_PREFIX + name
+        if not self._upload(str_func, module):
+            return False
+        self._exec(f"_upyd_mpyi({module!r}); {register}")
+        return True
+
+    def load(self, file):
+        """Run a local file as a compiled module, its names in the REPL"""
+        with open(file, 'r') as upy_file:
+            source = upy_file.read()
+        stem = os.path.splitext(os.path.basename(file))[0]
+        module = MODULE_PREFIX + re.sub(r'\W', '_', stem)
+        if not self._upload(source, module):
+            return False
+        self.dev.wr_cmd(f"_upyd_mpyi({module!r})", follow=True)
+        return True
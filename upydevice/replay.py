@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Record device sessions to trace files and replay them offline"""
+
+from collections import namedtuple
+import json
+import struct
+import threading
+import time
+from .simulator import REPLSimulator
+from .wsprotocol import OP_BYTES, OP_TEXT
+
+WRITE = 0
+READ = 1
+
+TRACE = namedtuple('TRACE', ['meta', 'events'])
+# t: s since the recording started, kind: websocket opcode (0 serial/BLE)
+TRACE_EVENT = namedtuple('TRACE_EVENT', ['t', 'direction', 'kind', 'data'])
+
+_MAGIC = b'UPYT'
+_VERSION = 1
+_HEADER = '<BI'
+_EVENT = '<BBdI'
+_EVENT_SIZE = struct.calcsize(_EVENT)
+
+
+def save_trace(trace, path):
+    meta = json.dumps(trace.meta).encode()
+    with open(path, 'wb') as trace_file:
+        trace_file.write(_MAGIC + struct.pack(_HEADER, _VERSION, len(meta)))
+        trace_file.write(meta)
+        for event in trace.events:
+            trace_file.write(struct.pack(_EVENT, event.direction, event.kind,
+                                         event.t, len(event.data)))
+            trace_file.write(event.data)
+
+
+def load_trace(path):
+    with open(path, 'rb') as trace_file:
+        data = trace_file.read()
+    if data[:4] != _MAGIC:
+        raise ValueError('{} is not a upydevice trace'.format(path))
+    version, meta_len = struct.unpack_from(_HEADER, data, 4)
+    offset = 4 + struct.calcsize(_HEADER)
+    meta = json.loads(data[offset:offset + meta_len])
+    offset += meta_len
+    events = []
+    while offset < len(data):
+        direction, kind, t, size = struct.unpack_from(_EVENT, data, offset)
+        offset += _EVENT_SIZE
+        events.append(TRACE_EVENT(t, direction, kind,
+                                  data[offset:offset + size]))
+        offset += size
+    return TRACE(meta, events)
+
+
+# RECORD
+
+class _RecordingSerial:
+    def __init__(self, serial, recorder):
+        self._serial = serial
+        self._rec = recorder
+
+    def write(self, data):
+        self._rec.add(WRITE, data)
+        return self._serial.write(data)
+
+    def read(self, size=1):
+        data = self._serial.read(size)
+        self._rec.add(READ, data)
+        return data
+
+    def read_all(self):
+        data = self._serial.read_all()
+        self._rec.add(READ, data)
+        return data
+
+    def __getattr__(self, attr):
+        return getattr(self._serial, attr)
+
+
+class _RecordingWebsocket:
+    def __init__(self, ws, recorder):
+        self._ws = ws
+        self._rec = recorder
+
+    def send(self, buf):
+        if isinstance(buf, str):
+            self._rec.add(WRITE, buf.encode('utf-8'), OP_TEXT)
+        else:
+            self._rec.add(WRITE, buf, OP_BYTES)
+        return self._ws.send(buf)
+
+    def write_frame(self, opcode, data=b''):
+        self._rec.add(WRITE, data, opcode)
+        return self._ws.write_frame(opcode, data)
+
+    def read_frame(self, *args, **kargs):
+        fin, opcode, data = self._ws.read_frame(*args, **kargs)
+        self._rec.add(READ, data, opcode)
+        return fin, opcode, data
+
+    def __getattr__(self, attr):
+        return getattr(self._ws, attr)
+
+
+class _RecordingBleakClient:
+    def __init__(self, client, recorder):
+        self._client = client
+        self._rec = recorder
+
+    async def write_gatt_char(self, char, data, *args, **kargs):
+        self._rec.add(WRITE, bytes(data))
+        return await self._client.write_gatt_char(char, data, *args, **kargs)
+
+    async def start_notify(self, char, callback, **kargs):
+        def recording_callback(sender, data):
+            self._rec.add(READ, bytes(data))
+            return callback(sender, data)
+        return await self._client.start_notify(char, recording_callback,
+                                               **kargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._client, attr)
+
+
+class TraceRecorder:
+    """
+    Records every chunk (serial), frame (WebREPL) or notification (BLE)
+    written to and read from a connected device, with timestamps:
+
+        with TraceRecorder(dev, 'session.upyt'):
+            dev.wr_cmd(...)
+
+    The transport object is wrapped while recording, a reconnection
+    (e.g. WebREPL reset) ends the recording.
+    """
+
+    _ATTRS = {'SerialDevice': ('serial', _RecordingSerial),
+              'WebSocketDevice': ('ws', _RecordingWebsocket),
+              'BleDevice': ('ble_client', _RecordingBleakClient)}
+
+    def __init__(self, device, path=None):
+        self.dev = device
+        self.path = path
+        self.events = []
+        self.t0 = None
+        self._lock = threading.Lock()
+        self._wrapped = None
+        dev_class = getattr(device, 'dev_class', None)
+        if dev_class not in self._ATTRS:
+            raise ValueError('Can not record {} devices'.format(dev_class))
+        self._attr, self._proxy = self._ATTRS[dev_class]
+
+    @property
+    def meta(self):
+        return {'dev_class': self.dev.dev_class,
+                'name': getattr(self.dev, 'name', None),
+                'platform': getattr(self.dev, 'dev_platform', None),
+                'created': time.time()}
+
+    def add(self, direction, data, kind=0):
+        if not data:
+            return
+        with self._lock:
+            self.events.append(TRACE_EVENT(time.perf_counter() - self.t0,
+                                           direction, kind, bytes(data)))
+
+    def start(self):
+        self.t0 = time.perf_counter()
+        self._wrapped = getattr(self.dev, self._attr)
+        setattr(self.dev, self._attr, self._proxy(self._wrapped, self))
+        return self
+
+    def stop(self):
+        proxy = getattr(self.dev, self._attr)
+        if isinstance(proxy, self._proxy):
+            setattr(self.dev, self._attr, self._wrapped)
+        self._wrapped = None
+        if self.path:
+            self.save(self.path)
+        return self.trace
+
+    @property
+    def trace(self):
+        with self._lock:
+            return TRACE(self.meta, list(self.events))
+
+    def save(self, path):
+        save_trace(self.trace, path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+# REPLAY
+
+class TracePlayer:
+    """
+    Device side of a recorded session, used as the repl of SerialSimulator,
+    WebREPLSimulator or BleSimulator. Until start() the device is served by
+    a REPLSimulator (connection, init commands), then recorded reads are
+    sent once the host has written as many bytes as the recording had
+    before them, with the recorded gaps scaled by 1/speed (speed=None: as
+    fast as possible):
+
+        player = TracePlayer('session.upyt', speed=None)
+        with SerialSimulator(repl=player) as sim:
+            dev = SerialDevice(sim.port, init=True)
+            with player:
+                for cmd in player.commands():
+                    dev.wr_cmd(cmd, silent=True)
+
+    Resets and WebREPL binary (file transfer) frames are not replayed.
+    """
+
+    def __init__(self, trace, speed=1.0, repl=None, **repl_kargs):
+        self.trace = load_trace(trace) if isinstance(trace, str) else trace
+        self.events = [event for event in self.trace.events
+                       if event.kind != OP_BYTES]
+        self.speed = speed
+        self.repl = repl or REPLSimulator(**repl_kargs)
+        self.playing = False
+        self.done = threading.Event()
+        self.n_reads = 0
+        self._output = None
+        self._fed = 0
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @property
+    def output(self):
+        return self._output
+
+    @output.setter
+    def output(self, output):
+        self._output = output
+        self.repl.output = output
+
+    def __getattr__(self, attr):
+        # on_reset, booting, path, ... of the setup REPL
+        if 'repl' not in self.__dict__:
+            raise AttributeError(attr)
+        return getattr(self.repl, attr)
+
+    def __setattr__(self, attr, value):
+        if attr == 'on_reset':
+            self.repl.on_reset = value
+        else:
+            super().__setattr__(attr, value)
+
+    def commands(self):
+        """Command lines written in the recording (without the '\\r')"""
+        written = b''.join(event.data for event in self.events
+                           if event.direction == WRITE)
+        return [line for line in written.decode('utf-8', 'ignore').split(
+            '\r')[:-1]]
+
+    def feed(self, data):
+        if self.playing:
+            with self._cond:
+                self._fed += len(data)
+                self._cond.notify()
+        else:
+            self.repl.feed(data)
+
+    def start(self):
+        self._fed = 0
+        self._stopped = False
+        self.n_reads = 0
+        self.done.clear()
+        self.playing = True
+        self._thread = threading.Thread(target=self._play, daemon=True)
+        self._thread.start()
+        return self
+
+    def _play(self):
+        needed = 0
+        ref_clock, ref_t = time.perf_counter(), 0.0
+        try:
+            for event in self.events:
+                if event.direction == WRITE:
+                    needed += len(event.data)
+                    with self._cond:
+                        self._cond.wait_for(
+                            lambda: self._fed >= needed or self._stopped)
+                    if self._stopped:
+                        return
+                    ref_clock, ref_t = time.perf_counter(), event.t
+                    continue
+                if self.speed:
+                    ref_clock += (event.t - ref_t) / self.speed
+                    ref_t = event.t
+                    delay = ref_clock - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                if self._output is not None:
+                    self._output(event.data)
+                self.n_reads += 1
+        finally:
+            self.playing = False
+            self.done.set()
+
+    def wait(self, timeout=None):
+        """Wait until all the recorded reads have been sent"""
+        return self.done.wait(timeout)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        self.repl.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,828 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Binary RPC agent: typed calls to a device without REPL scraping"""
+
+from collections import deque
+from concurrent.futures import Future
+import asyncio
+import socket
+import struct
+import threading
+import time
+from .exceptions import DeviceException
+from . import wsprotocol
+
+# frame: magic, type, request id, payload size, payload (packed value)
+MAGIC = b'\x00\xa5'
+HEADER = '<BHI'
+HEADER_SIZE = len(MAGIC) + struct.calcsize(HEADER)
+PROTOCOL_VERSION = 1
+
+# request types
+CALL = 0x01
+EVAL = 0x02
+EXEC = 0x03
+STREAM = 0x04
+OPEN = 0x05
+CREDIT = 0x06
+CLOSE = 0x07
+STOP = 0x7f
+# response types
+OK = 0x80
+ERROR = 0x81
+CHUNK = 0x82
+DATA = 0x83
+CLOSED = 0x84
+
+# channel items buffered in the host before the device is paused
+CHANNEL_WINDOW = 32
+
+# device side agent, defined once per boot session (see DeviceCodeCache).
+# Frames are read from stdin and written to stdout (serial, WebREPL and
+# BLE UART alike), anything else written to stdout (print) goes between
+# frames. Channels (_upyd_ch) are polled between requests and send DATA
+# frames while they have credit.
+_AGENT_CODE = """import struct as _upyd_st
+try:
+    import micropython as _upyd_mp
+except ImportError:
+    _upyd_mp = None
+def _upyd_pk(v, out):
+    t = type(v)
+    if v is None:
+        out.append(b'N')
+    elif t is bool:
+        out.append(b'T' if v else b'F')
+    elif t is int and -0x8000000000000000 <= v < 0x8000000000000000:
+        out.append(b'i' + _upyd_st.pack('<q', v))
+    elif t is float:
+        out.append(b'f' + _upyd_st.pack('<d', v))
+    elif t is list or t is tuple or t is dict:
+        out.append((b'l' if t is list else b't' if t is tuple else b'd')
+                   + _upyd_st.pack('<I', len(v)))
+        for x in v:
+            _upyd_pk(x, out)
+            if t is dict:
+                _upyd_pk(v[x], out)
+    else:
+        if t is str:
+            tag, v = b's', v.encode()
+        elif t is int:
+            tag, v = b'I', str(v).encode()
+        elif t is bytearray:
+            tag = b'y'
+        elif t is bytes or t is memoryview:
+            tag, v = b'b', bytes(v)
+        else:
+            tag, v = b'r', repr(v).encode()
+        out.append(tag + _upyd_st.pack('<I', len(v)))
+        out.append(v)
+def _upyd_upk(b, p):
+    t = b[p]
+    p += 1
+    if t == 78:
+        return None, p
+    if t == 84 or t == 70:
+        return t == 84, p
+    if t == 105:
+        return _upyd_st.unpack_from('<q', b, p)[0], p + 8
+    if t == 102:
+        return _upyd_st.unpack_from('<d', b, p)[0], p + 8
+    n = _upyd_st.unpack_from('<I', b, p)[0]
+    p += 4
+    if t == 100:
+        d = {}
+        for i in range(n):
+            k, p = _upyd_upk(b, p)
+            d[k], p = _upyd_upk(b, p)
+        return d, p
+    if t == 108 or t == 116:
+        l = []
+        for i in range(n):
+            x, p = _upyd_upk(b, p)
+            l.append(x)
+        return (l if t == 108 else tuple(l)), p
+    v = b[p:p + n]
+    if t == 115 or t == 114:
+        v = v.decode()
+    elif t == 73:
+        v = int(v.decode())
+    elif t == 121:
+        v = bytearray(v)
+    return v, p + n
+def _upyd_rpc_tx(wr, typ, rid, v):
+    out = []
+    _upyd_pk(v, out)
+    body = b''.join(out)
+    wr(b'\\x00\\xa5' + _upyd_st.pack('<BHI', typ, rid, len(body)))
+    wr(body)
+def _upyd_rpc_rx(rd, n):
+    b = b''
+    while len(b) < n:
+        c = rd(n - len(b))
+        if not c:
+            return None
+        b += c
+    return b
+def _upyd_rpc_get(target):
+    names = target.split('.')
+    g = globals()
+    if names[0] in g:
+        o = g[names[0]]
+    else:
+        import builtins
+        o = getattr(builtins, names[0], None)
+        if o is None:
+            o = __import__(names[0])
+    for a in names[1:]:
+        o = getattr(o, a)
+    return o
+_upyd_ch = {}
+def _upyd_rpc_pump(wr):
+    import time
+    wait = -1
+    for cid in list(_upyd_ch):
+        c = _upyd_ch[cid]
+        while c[2] > 0:
+            if c[1] is not None:
+                d = time.ticks_diff(c[3], time.ticks_ms())
+                if d > 0:
+                    wait = d if wait < 0 else min(wait, d)
+                    break
+            try:
+                v = next(c[0]) if c[1] is None else c[0]()
+            except Exception as e:
+                del _upyd_ch[cid]
+                _upyd_rpc_tx(wr, 0x84, cid, None if isinstance(
+                    e, StopIteration) else [type(e).__name__, str(e)])
+                break
+            _upyd_rpc_tx(wr, 0x83, cid, v)
+            c[2] -= 1
+            if c[1] is None:
+                wait = 0
+                break
+            c[3] = time.ticks_add(c[3], c[1])
+            if time.ticks_diff(time.ticks_ms(), c[3]) > c[1]:
+                c[3] = time.ticks_ms()
+    return wait
+def _upyd_rpc_open(rid, target, args, kwargs, period, window):
+    import time
+    f = _upyd_rpc_get(target)
+    if period is None:
+        src = iter(f(*args, **kwargs))
+    else:
+        src = lambda: f(*args, **kwargs)
+    _upyd_ch[rid] = [src, period, window, time.ticks_ms()]
+    return rid
+def _upyd_rpc_serve():
+    import sys
+    try:
+        import select
+    except ImportError:
+        import uselect as select
+    rd = sys.stdin.buffer.read
+    wr = getattr(sys.stdout, 'buffer', sys.stdout).write
+    poll = select.poll()
+    poll.register(sys.stdin, select.POLLIN)
+    if _upyd_mp:
+        _upyd_mp.kbd_intr(-1)
+    try:
+        _upyd_rpc_tx(wr, 0x80, 0, 1)
+        while True:
+            if _upyd_ch:
+                if not poll.poll(_upyd_rpc_pump(wr)):
+                    continue
+            h = _upyd_rpc_rx(rd, 9)
+            if h is None or h[:2] != b'\\x00\\xa5':
+                break
+            typ, rid, n = _upyd_st.unpack_from('<BHI', h, 2)
+            body = _upyd_rpc_rx(rd, n)
+            if body is None:
+                break
+            if typ == 0x7f:
+                _upyd_ch.clear()
+                _upyd_rpc_tx(wr, 0x80, rid, None)
+                break
+            try:
+                req = _upyd_upk(body, 0)[0]
+                if typ == 6:
+                    if rid in _upyd_ch:
+                        _upyd_ch[rid][2] += req
+                    continue
+                if typ == 7:
+                    if _upyd_ch.pop(rid, None):
+                        _upyd_rpc_tx(wr, 0x84, rid, None)
+                    continue
+                if typ == 1:
+                    res = _upyd_rpc_get(req[0])(*req[1], **req[2])
+                elif typ == 2:
+                    res = eval(req, globals())
+                elif typ == 3:
+                    res = exec(req, globals())
+                elif typ == 4:
+                    for x in _upyd_rpc_get(req[0])(*req[1], **req[2]):
+                        _upyd_rpc_tx(wr, 0x82, rid, x)
+                    res = None
+                elif typ == 5:
+                    res = _upyd_rpc_open(rid, *req)
+                else:
+                    raise ValueError('unknown request %d' % typ)
+                _upyd_rpc_tx(wr, 0x80, rid, res)
+            except Exception as e:
+                _upyd_rpc_tx(wr, 0x81, rid, [type(e).__name__, str(e)])
+    finally:
+        _upyd_ch.clear()
+        if _upyd_mp:
+            _upyd_mp.kbd_intr(3)
+"""
+
+_AGENT_NAME = '_upyd_rpc'
+
+
+# HOST SIDE CODEC (same encoding as device _upyd_pk/_upyd_upk)
+
+_INT64 = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_SIZE = struct.Struct('<I')
+
+
+def _pack(value, out):
+    value_type = type(value)
+    if value is None:
+        out.append(b'N')
+    elif value_type is bool:
+        out.append(b'T' if value else b'F')
+    elif value_type is int and -2**63 <= value < 2**63:
+        out.append(b'i' + _INT64.pack(value))
+    elif value_type is float:
+        out.append(b'f' + _FLOAT.pack(value))
+    elif value_type in (list, tuple, dict):
+        tag = {list: b'l', tuple: b't', dict: b'd'}[value_type]
+        out.append(tag + _SIZE.pack(len(value)))
+        for item in value:
+            _pack(item, out)
+            if value_type is dict:
+                _pack(value[item], out)
+    else:
+        if value_type is str:
+            tag, value = b's', value.encode('utf-8')
+        elif value_type is int:
+            tag, value = b'I', str(value).encode()
+        elif value_type is bytearray:
+            tag = b'y'
+        elif value_type in (bytes, memoryview):
+            tag, value = b'b', bytes(value)
+        else:
+            raise TypeError(f'RPC: can not send {value_type.__name__} '
+                            f'values')
+        out.append(tag + _SIZE.pack(len(value)))
+        out.append(bytes(value))
+
+
+def pack(value):
+    """Encode a value (None, bool, int, float, str, bytes, bytearray,
+    list, tuple, dict) in the RPC binary format"""
+    out = []
+    _pack(value, out)
+    return b''.join(out)
+
+
+def _unpack(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == 78:  # N
+        return None, pos
+    if tag in (84, 70):  # T, F
+        return tag == 84, pos
+    if tag == 105:  # i
+        return _INT64.unpack_from(data, pos)[0], pos + 8
+    if tag == 102:  # f
+        return _FLOAT.unpack_from(data, pos)[0], pos + 8
+    size, = _SIZE.unpack_from(data, pos)
+    pos += 4
+    if tag == 100:  # d
+        value = {}
+        for i in range(size):
+            key, pos = _unpack(data, pos)
+            value[key], pos = _unpack(data, pos)
+        return value, pos
+    if tag in (108, 116):  # l, t
+        items = []
+        for i in range(size):
+            item, pos = _unpack(data, pos)
+            items.append(item)
+        return (items if tag == 108 else tuple(items)), pos
+    value = bytes(data[pos:pos + size])
+    if tag in (115, 114):  # s, r (repr of other device types)
+        value = value.decode('utf-8')
+    elif tag == 73:  # I
+        value = int(value)
+    elif tag == 121:  # y
+        value = bytearray(value)
+    elif tag != 98:  # b
+        raise ValueError(f'RPC: unknown type tag {tag!r}')
+    return value, pos + size
+
+
+def unpack(data):
+    """Decode a value encoded with pack()"""
+    return _unpack(data, 0)[0]
+
+
+def frame(typ, rid, value):
+    body = pack(value)
+    return MAGIC + struct.pack(HEADER, typ, rid, len(body)) + body
+
+
+# TRANSPORTS: raw bytes to/from the device stdin/stdout
+
+class _SerialLink:
+    def __init__(self, device):
+        self.dev = device
+        self._timeout = None
+
+    def open(self):
+        self._timeout = self.dev.serial.timeout
+
+    def write(self, data):
+        self.dev.serial.write(data)
+
+    def read(self, timeout=None):
+        if self.dev.serial.timeout != timeout:
+            self.dev.serial.timeout = timeout
+        return self.dev.serial.read(self.dev.serial.in_waiting or 1)
+
+    def close(self):
+        self.dev.serial.timeout = self._timeout
+
+
+class _WebsocketLink:
+    def __init__(self, device):
+        self.dev = device
+
+    def open(self):
+        if not self.dev.connected:
+            self.dev.open_wconn(ssl=self.dev._ssl, auth=True)
+
+    def write(self, data):
+        self.dev.ws.write_frame(wsprotocol.OP_TEXT, data)
+
+    def read(self, timeout=None):
+        self.dev.ws.sock.settimeout(timeout)
+        try:
+            fin, opcode, data = self.dev.ws.read_frame()
+        except socket.timeout:
+            return b''
+        return data if opcode == wsprotocol.OP_TEXT else b''
+
+    def close(self):
+        self.dev.ws.sock.settimeout(None)
+
+
+class _BleLink:
+    def __init__(self, device):
+        self.dev = device
+        self._buff = bytearray()
+        self._event = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._submitted = []
+
+    def _run(self, coro):
+        # the device loop is run by one thread at a time, other threads
+        # (e.g. writes while a reader waits for notifications) submit to it
+        loop = self.dev.loop
+        with self._lock:
+            if self._running:
+                future = asyncio.run_coroutine_threadsafe(coro, loop)
+                self._submitted.append(future)
+            else:
+                future = None
+                self._running = True
+        if future is not None:
+            return future.result()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            while True:
+                with self._lock:
+                    pending = [asyncio.wrap_future(future, loop=loop)
+                               for future in self._submitted
+                               if not future.done()]
+                    self._submitted = []
+                    if not pending:
+                        self._running = False
+                        break
+                loop.run_until_complete(asyncio.wait(pending))
+
+    def _on_notify(self, sender, data):
+        self._buff += data
+        self._event.set()
+
+    async def _open(self):
+        self._event = asyncio.Event()
+        await self.dev.ble_client.start_notify(
+            self.dev.readables['Nordic UART TX'], self._on_notify)
+
+    def open(self):
+        self._buff = bytearray()
+        self._run(self._open())
+
+    async def _write(self, data):
+        rx = self.dev.writeables['Nordic UART RX']
+        for i in range(0, len(data), self.dev.len_buffer):
+            await self.dev.ble_client.write_gatt_char(
+                rx, data[i:i + self.dev.len_buffer])
+
+    def write(self, data):
+        self._run(self._write(data))
+
+    async def _read(self, timeout):
+        if not self._buff:
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return b''
+        data = bytes(self._buff)
+        self._buff.clear()
+        return data
+
+    def read(self, timeout=None):
+        return self._run(self._read(timeout))
+
+    def close(self):
+        self._run(self.dev.ble_client.stop_notify(
+            self.dev.readables['Nordic UART TX']))
+
+
+_LINKS = {'SerialDevice': _SerialLink, 'WebSocketDevice': _WebsocketLink,
+          'BleDevice': _BleLink}
+
+
+# CLIENT
+
+class RPCCall:
+    """
+    Pending request: result() reads responses (of this and earlier
+    pipelined requests) until this one is done.
+    """
+
+    def __init__(self, rpc, rid, typ):
+        self.rpc = rpc
+        self.id = rid
+        self.type = typ
+        self.future = Future()
+        self.chunks = deque()
+        self.channel = None
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        self.rpc._wait(self.done, timeout)
+        return self.future.result()
+
+
+class RPCChannel:
+    """
+    Data stream multiplexed with requests on the agent link: items of a
+    device generator, or of a function sampled every period (ms). The
+    device sends at most ``window`` items ahead of the host consumer
+    (credit based flow control), commands can be sent meanwhile.
+    """
+
+    def __init__(self, rpc, cid, window):
+        self.rpc = rpc
+        self.id = cid
+        self.window = window
+        self.items = deque()
+        self.closed = False
+        self.error = None
+        self.n_items = 0
+        self._consumed = 0
+
+    def _ready(self):
+        return bool(self.items) or self.closed
+
+    def get(self, timeout=None):
+        """Next item, raises StopIteration when the channel is closed"""
+        self.rpc._wait(self._ready, timeout)
+        if not self.items:
+            if self.error is not None:
+                raise self.error
+            raise StopIteration
+        item = self.items.popleft()
+        self._consumed += 1
+        if not self.closed and self._consumed >= self.window // 2:
+            self.rpc._write(CREDIT, self.id, self._consumed)
+            self._consumed = 0
+        return item
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get()
+            except StopIteration:
+                return
+
+    def close(self, timeout=None):
+        """Stop the device producer, items already received are kept"""
+        if not self.closed and self.rpc.active:
+            self.rpc._write(CLOSE, self.id, None)
+            self.rpc._wait(lambda: self.closed, timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class DeviceRPC:
+    """
+    Host side of the binary RPC agent. While started, the device runs
+    _upyd_rpc_serve() instead of the REPL and requests are length prefixed
+    frames with typed arguments and results (no echo, prompt or repr to
+    parse):
+
+        with dev.rpc:
+            dev.rpc.call('machine.freq')
+            calls = [dev.rpc.call_async('adc.read') for i in range(10)]
+            values = [call.result() for call in calls]  # pipelined
+            for value in dev.rpc.stream('sample', 100):
+                ...
+            # multiplexed with commands, 32 items ahead at most
+            with dev.rpc.open_channel('adc.read', period=10) as adc:
+                for value in adc:
+                    dev.rpc.call('led.value', value > 2048)
+
+    ``code`` decorated functions and phantom commands go through the agent
+    while it is started.
+    """
+
+    def __init__(self, device, timeout=None):
+        self.dev = device
+        self.timeout = timeout
+        self.active = False
+        self.on_output = None
+        self.n_calls = 0
+        self._link = None
+        self._rx = bytearray()
+        self._pending = {}
+        self._channels = {}
+        self._next_id = 0
+        self._reading = False
+        self._cond = threading.Condition()
+        self._wlock = threading.Lock()
+
+    def _output(self, data):
+        # device stdout outside frames (print)
+        if not data:
+            return
+        text = bytes(data).decode('utf-8', 'ignore')
+        if self.on_output is not None:
+            self.on_output(text)
+        else:
+            print(text, end='')
+
+    def _read_frame(self, deadline=None):
+        while True:
+            start = self._rx.find(MAGIC)
+            if start < 0:
+                # a trailing \x00 may be the start of the next header
+                start = len(self._rx) - self._rx.endswith(MAGIC[:1])
+            if start:
+                self._output(self._rx[:start])
+                del self._rx[:start]
+            if len(self._rx) >= HEADER_SIZE:
+                typ, rid, size = struct.unpack_from(HEADER, self._rx, 2)
+                end = HEADER_SIZE + size
+                if len(self._rx) >= end:
+                    value = unpack(self._rx[HEADER_SIZE:end])
+                    del self._rx[:end]
+                    return typ, rid, value
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise DeviceException('RPC: response timeout')
+            self._rx += self._link.read(timeout)
+
+    def _dispatch(self, typ, rid, value):
+        if typ in (DATA, CLOSED):
+            channel = self._channels.get(rid)
+            if channel is None:
+                return
+            if typ == DATA:
+                channel.items.append(value)
+                channel.n_items += 1
+            else:
+                del self._channels[rid]
+                if value is not None:
+                    channel.error = DeviceException('{}: {}'.format(*value))
+                channel.closed = True
+            return
+        call = self._pending.get(rid)
+        if call is None:
+            return
+        if typ == CHUNK:
+            call.chunks.append(value)
+            return
+        del self._pending[rid]
+        if typ == ERROR:
+            call.future.set_exception(DeviceException(
+                '{}: {}'.format(*value)))
+        else:
+            call.future.set_result(value)
+
+    def _wait(self, done, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # one thread reads frames at a time and dispatches them to every
+        # waiting call/channel
+        with self._cond:
+            while not done():
+                if self._reading:
+                    if deadline is None:
+                        self._cond.wait()
+                    elif not self._cond.wait(deadline - time.monotonic()):
+                        raise DeviceException('RPC: response timeout')
+                    continue
+                self._reading = True
+                self._cond.release()
+                try:
+                    typ, rid, value = self._read_frame(deadline)
+                finally:
+                    self._cond.acquire()
+                    self._reading = False
+                    self._cond.notify_all()
+                self._dispatch(typ, rid, value)
+
+    def _write(self, typ, rid, value):
+        with self._wlock:
+            self._link.write(frame(typ, rid, value))
+
+    def _send(self, typ, value, channel_window=None):
+        if not self.active:
+            raise DeviceException('RPC: agent not started (rpc.start())')
+        with self._wlock:
+            rid = self._next_id % 0xffff + 1
+            while rid in self._pending or rid in self._channels:
+                rid = rid % 0xffff + 1
+            self._next_id = rid
+            call = RPCCall(self, rid, typ)
+            self._pending[rid] = call
+            if channel_window is not None:
+                call.channel = RPCChannel(self, rid, channel_window)
+                self._channels[rid] = call.channel
+            self._link.write(frame(typ, rid, value))
+            self.n_calls += 1
+        return call
+
+    # LIFECYCLE
+
+    def setup(self):
+        self.dev.code_cache.define_exec(_AGENT_NAME, _AGENT_CODE)
+
+    def start(self, timeout=5):
+        """Define and start the device agent (leaves the REPL)"""
+        if self.active:
+            return self
+        self.setup()
+        link_class = _LINKS.get(getattr(self.dev, 'dev_class', None))
+        if link_class is None:
+            raise DeviceException('RPC: not supported by {}'.format(
+                type(self.dev).__name__))
+        self._link = link_class(self.dev)
+        self._link.open()
+        self._rx = bytearray()
+        self._pending = {}
+        self._channels = {}
+        ready = RPCCall(self, 0, None)
+        self._pending[0] = ready
+        on_output, self.on_output = self.on_output, lambda text: None
+        try:
+            # command echo is dropped
+            self._link.write(b'_upyd_rpc_serve()\r')
+            self._wait(ready.done, timeout)
+        except DeviceException:
+            self._link.close()
+            raise
+        finally:
+            self.on_output = on_output
+        if ready.future.result() != PROTOCOL_VERSION:
+            raise DeviceException('RPC: agent protocol version mismatch')
+        self.active = True
+        return self
+
+    def stop(self, timeout=5):
+        """Stop the device agent, back to the REPL"""
+        if not self.active:
+            return
+        call = self._send(STOP, None)
+        try:
+            call.result(timeout)
+            # prompt printed when _upyd_rpc_serve() returns
+            deadline = time.monotonic() + timeout
+            while not self._rx.endswith(self.dev.prompt):
+                if time.monotonic() > deadline:
+                    break
+                self._rx += self._link.read(deadline - time.monotonic())
+        finally:
+            self.active = False
+            self._pending = {}
+            for channel in self._channels.values():
+                channel.closed = True
+            self._channels = {}
+            self._rx = bytearray()
+            self._link.close()
+            self._link = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # REQUESTS
+
+    def call_async(self, target, *args, **kwargs):
+        """Call a device function (global name or dotted path,
+        e.g. 'machine.freq', 'led.value'), returns an RPCCall"""
+        return self._send(CALL, [target, list(args), kwargs])
+
+    def call(self, target, *args, **kwargs):
+        return self.call_async(target, *args, **kwargs).result()
+
+    def eval_async(self, expr):
+        return self._send(EVAL, expr)
+
+    def eval(self, expr):
+        """Evaluate an expression in the device globals"""
+        return self.eval_async(expr).result()
+
+    def exec(self, code):
+        """Execute statements in the device globals"""
+        return self._send(EXEC, code).result()
+
+    def stream(self, target, *args, **kwargs):
+        """Iterate over a device generator (or iterable), each item is
+        sent as soon as it is produced"""
+        call = self._send(STREAM, [target, list(args), kwargs])
+        while True:
+            self._wait(lambda: call.chunks or call.done())
+            while call.chunks:
+                yield call.chunks.popleft()
+            if call.done():
+                call.future.result()
+                return
+
+    def open_channel(self, target, *args, period=None, window=CHANNEL_WINDOW,
+                     **kwargs):
+        """
+        Open a data channel: items of target(*args, **kwargs) if it is a
+        generator (period=None) or target(*args, **kwargs) called every
+        period ms, returns an RPCChannel
+        """
+        call = self._send(OPEN, [target, list(args), kwargs, period,
+                                 window], channel_window=window)
+        try:
+            call.result()
+        except DeviceException:
+            self._channels.pop(call.id, None)
+            raise
+        return call.channel
+
+    def define(self, name, str_func, force=False):
+        """Define a function while the agent is running (see
+        DeviceCodeCache.define), returns True if sent"""
+        cache = self.dev.code_cache
+        digest = cache.hash_source(str_func)
+        if not force and cache.hashes.get(name) == digest:
+            return False
+        self.exec(f"{str_func.rstrip()}\n{cache._register(name, digest)}\n")
+        cache.hashes[name] = digest
+        return True
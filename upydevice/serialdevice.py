@@ -25,13 +25,23 @@ import ast
 import time
 import serial
 import serial.tools.list_ports  # BUG: This makes pyinstaller to fail
-import multiprocessing
 from array import array
 import glob
+import os
 from binascii import hexlify
 import sys
 from .exceptions import DeviceException, DeviceNotFound
-from .decorators import getsource
+from .decorators import (DeviceBatch, DeviceCodeCache, code_source,
+                         active_rpc)
+from .executor import DeviceExecutor
+from .rpc import DeviceRPC
+from .tracing import CommandTracer
+from .datalog import DatalogCapture
+from .output import OutputPipeline
+from .backoff import Backoff
+from .compression import DeviceCompression
+from .precompile import DevicePrecompile
+from .filetransfer import FileTransfer
 import functools
 import re
 
@@ -108,6 +118,13 @@ class BASE_SERIAL_DEVICE:
         self.output = None
         self.wr_cmd = self.cmd
         self.prompt = b'>>> '
+        self.code_cache = DeviceCodeCache(self)
+        self.filetransfer = FileTransfer(self)
+        self.executor = DeviceExecutor(self)
+        self.compression = DeviceCompression(self)
+        self.precompile = DevicePrecompile(self)
+        self.rpc = DeviceRPC(self)
+        self.tracer = CommandTracer(self)
         self.dev_description, self.manufacturer, self._hwid = self._get_serial_port_data(
             serial_port)
         self.serial = serial.Serial(serial_port, baudrate)
@@ -121,14 +138,18 @@ class BASE_SERIAL_DEVICE:
                 return (desc, port.manufacturer, port.hwid)
 
         if not serial_port_found:
-            serialport = serialport.replace('tty', 'cu')
+            cu_port = serialport.replace('tty', 'cu')
         for port in serial.tools.list_ports.comports():
-            if port.device == serialport:
+            if port.device == cu_port:
                 serial_port_found = True
                 desc = port.description.split('-')[0].strip()
                 return (desc, port.manufacturer, port.hwid)
 
-        raise DeviceNotFound('SerialDevice @ {} is not available'.format(serialport))
+        # pseudo terminals (pty, socat) are not listed by comports
+        if os.path.exists(serialport) and not os.path.isdir(serialport):
+            return ('Virtual serial port', None, None)
+
+        raise DeviceNotFound('SerialDevice @ {} is not available'.format(cu_port))
 
     def cmd(self, cmd, silent=False, rtn=True, long_string=False, rtn_resp=False):
         self.response = ''
@@ -167,6 +188,7 @@ class BASE_SERIAL_DEVICE:
 
     def reset(self, silent=False, reconnect=True, hr=False):
         self.buff = b''
+        self.code_cache.clear()
         if not silent:
             print('Rebooting device...')
         if not hr:
@@ -184,6 +206,43 @@ class BASE_SERIAL_DEVICE:
         if not silent:
             print('Done!')
 
+    def reset_ready(self, hr=False, timeout=10, silent=True):
+        """
+        Reset and wait until the boot banner ends with the REPL prompt,
+        (port reopened if it disappears on hard reset), returns elapsed s.
+        """
+        self.code_cache.clear()
+        if not silent:
+            print('Rebooting device...')
+        try:
+            self.serial.reset_input_buffer()
+            self.serial.write(bytes(self._hreset if hr else self._reset,
+                                    'utf-8'))
+        except (OSError, serial.SerialException):
+            pass
+        backoff = Backoff(timeout)
+        self.buff = b''
+        while True:
+            try:
+                if not self.serial.is_open:
+                    self.serial.open()
+                chunk = self.serial.read_all()
+                if chunk:
+                    self.buff += chunk
+                    if self.buff.endswith(self.prompt):
+                        break
+                    backoff.reset()
+                    continue
+            except (OSError, serial.SerialException):
+                # usb cdc port goes away while the device reboots
+                self.serial.close()
+            if not backoff.sleep():
+                raise DeviceNotFound('SerialDevice @ {} not ready after '
+                                     '{} s'.format(self.serial.port, timeout))
+        if not silent:
+            print('Done! ({:.2f} s)'.format(backoff.elapsed))
+        return backoff.elapsed
+
     def kbi(self, silent=True, pipe=None, long_string=False):
         if pipe is not None:
             self.wr_cmd(self._kbi, silent=silent)
@@ -232,7 +291,8 @@ class SERIAL_DEVICE(BASE_SERIAL_DEVICE):
         self.message = b''
         self.data_buff = ''
         self.datalog = []
-        self.output_queue = multiprocessing.Queue(maxsize=1)
+        self.dlog_capture = None
+        self._dlog = None
         self.paste_cmd = ''
         self.connected = True
         self.repl_CONN = self.connected
@@ -306,12 +366,15 @@ class SERIAL_DEVICE(BASE_SERIAL_DEVICE):
     def cmd(self, cmd, silent=False, rtn=True, long_string=False,
             rtn_resp=False, follow=False, pipe=None, multiline=False,
             dlog=False, nb_queue=None):
+        span = self.tracer.span(cmd)
         self._is_traceback = False
         self.response = ''
         self.output = None
         self.flush_conn()
+        span.mark('flush')
         self.buff = b''
         self.bytes_sent = self.serial.write(bytes(cmd+'\r', 'utf-8'))
+        span.mark('write')
         # time.sleep(0.2)
         # self.buff = self.serial.read_all()[self.bytes_sent+1:]
         if self.buff == b'':
@@ -319,16 +382,26 @@ class SERIAL_DEVICE(BASE_SERIAL_DEVICE):
                 time.sleep(0.2)
                 # self.read_until(b'\n')
                 self.buff = self.serial.read_all()
+                if self.buff:
+                    span.first_byte()
                 if self.buff == b'' or self.prompt not in self.buff:
+                    span.retry()
                     time.sleep(0.2)
                     self.buff += self.serial.read_all()
                     while self.prompt not in self.buff:
                         self.buff += self.serial.read_all()
+                        if self.buff:
+                            span.first_byte()
             else:
                 silent_pipe = silent
                 silent = True
                 rtn = False
                 rtn_resp = False
+                if dlog:
+                    # parse data lines as they arrive
+                    self._dlog = dlog if isinstance(
+                        dlog, DatalogCapture) else DatalogCapture()
+                    self.dlog_capture = self._dlog
                 try:
                     self.follow_output(cmd, pipe=pipe, multiline=multiline,
                                        silent=silent_pipe)
@@ -345,9 +418,18 @@ class SERIAL_DEVICE(BASE_SERIAL_DEVICE):
                     for i in range(1):
                         self.serial.write(b'\r')
                         self.flush_conn()
+        span.mark('prompt')
+        received = len(self.buff)
         cmd_filt = bytes(cmd + '\r\n', 'utf-8')
         self.buff = self.buff.replace(cmd_filt, b'', 1)
-        if dlog:
+        dlog_error = ''
+        if self._dlog is not None:
+            self._dlog.close()
+            dlog_error = self._dlog.error
+            self._dlog = None
+            self.data_buff = ''
+        elif dlog:
+            self.dlog_capture = None
             self.data_buff = self.buff.replace(b'\r', b'').replace(
                 b'\r\n>>> ', b'').replace(b'>>> ', b'').decode()
         if self._traceback in self.buff:
@@ -358,6 +440,10 @@ class SERIAL_DEVICE(BASE_SERIAL_DEVICE):
         else:
             self.response = self.buff.replace(b'\r\n', b'').replace(
                 b'\r\n>>> ', b'').replace(b'>>> ', b'').decode()
+        if dlog_error:
+            # datalog output is not kept in buff, only its traceback
+            self._is_traceback = True
+            self.response = dlog_error
         if not silent:
             if self.response != '\n' and self.response != '':
                 if pipe is None:
@@ -371,8 +457,10 @@ class SERIAL_DEVICE(BASE_SERIAL_DEVICE):
                         self.response = ''
             else:
                 self.response = ''
+        span.mark('decode')
         if rtn:
             self.get_output()
+            span.mark('parse')
             if self.output == '\n' and self.output == '':
                 self.output = None
             if self.output is None:
@@ -384,6 +472,7 @@ class SERIAL_DEVICE(BASE_SERIAL_DEVICE):
                 else:
                     nb_queue.get_nowait()
                     nb_queue.put((self.output), block=False)
+        span.end(sent=self.bytes_sent, received=received)
         if rtn_resp:
             return self.output
 
@@ -419,7 +508,14 @@ class SERIAL_DEVICE(BASE_SERIAL_DEVICE):
                         break
             self.buff += self.message
             self.raw_buff += self.message
-            if self.message == b'':
+            if self._dlog is not None:
+                # keep only prompt detection tail in memory
+                self._dlog.feed(self.message)
+                self.buff = self.buff[-len(self.prompt):]
+                self.raw_buff = self.raw_buff[-len(self.prompt):]
+            if isinstance(pipe, OutputPipeline):
+                pipe.feed(self.message)
+            elif self.message == b'':
                 pass
             else:
                 if self.message.startswith(b'\n') and 'ls(' not in inp:
@@ -512,6 +608,8 @@ class SERIAL_DEVICE(BASE_SERIAL_DEVICE):
                             print(msg.replace('>>> ', ''), end='')
             if self.buff.endswith(b'>>> '):
                 break
+        if isinstance(pipe, OutputPipeline):
+            pipe.flush()
         self.paste_cmd = ''
 
     def is_reachable(self):
@@ -550,7 +648,59 @@ class SERIAL_DEVICE(BASE_SERIAL_DEVICE):
             self.serial.write(bytes(line+'\n', 'utf-8'))
         self.flush_conn()
 
+    def _repl_exec(self, cmd, timeout=10):
+        # write and read until prompt, no fixed waits (bulk transfers)
+        self.output = None
+        self.serial.reset_input_buffer()
+        self.bytes_sent = self.serial.write(bytes(cmd+'\r', 'utf-8'))
+        deadline = time.monotonic() + timeout
+        self.buff = b''
+        # port is opened blocking (timeout None), poll so a silent
+        # device can not hang the read
+        port_timeout = self.serial.timeout
+        self.serial.timeout = 0.05
+        try:
+            while not self.buff.endswith(self.prompt):
+                self.buff += self.serial.read(self.serial.in_waiting or 1)
+                if time.monotonic() > deadline:
+                    raise DeviceException(
+                        'SerialDevice @ {} no prompt after {} s: {!r}'.format(
+                            self.serial.port, timeout, self.buff))
+        finally:
+            self.serial.timeout = port_timeout
+        self.buff = self.buff.replace(bytes(cmd + '\r\n', 'utf-8'), b'', 1)
+        self.response = self.buff.replace(b'\r\n', b'').replace(
+            b'>>> ', b'').decode('utf-8', 'ignore')
+        self.get_output()
+        return self.output
+
+    def put(self, local, remote=None, verify=True, compress=None):
+        """Upload a file, returns TRANSFER"""
+        return self.filetransfer.put(local, remote, verify=verify,
+                                     compress=compress)
+
+    def get(self, remote, local=None, verify=True, compress=None):
+        """Download a file, returns TRANSFER"""
+        return self.filetransfer.get(remote, local, verify=verify,
+                                     compress=compress)
+
+    def sync(self, local_dir, remote_dir='', verify=True, exclude=(),
+             **kargs):
+        """
+        Upload changed files of a directory (block delta for large files),
+        see FileTransfer.sync, returns list of TRANSFER
+        """
+        return self.filetransfer.sync(local_dir, remote_dir, verify=verify,
+                                      exclude=exclude, **kargs)
+
     def get_datalog(self, dvars=None, fs=None, time_out=None, units=None):
+        if self.dlog_capture is not None:
+            if dvars is None:
+                self.datalog = self.dlog_capture.rows()
+            else:
+                self.datalog = self.dlog_capture.as_dict(
+                    dvars=dvars, fs=fs, time_out=time_out, units=units)
+            return
         self.datalog = []
         self.output = None
         for line in self.data_buff.splitlines():
@@ -578,34 +728,36 @@ class SERIAL_DEVICE(BASE_SERIAL_DEVICE):
 
     def cmd_nb(self, command, silent=False, rtn=True, long_string=False,
                rtn_resp=False, follow=False, pipe=None, multiline=False,
-               dlog=False, block_dev=True):
+               dlog=False, block_dev=True, timeout=None):
         if block_dev:
-            self.dev_process_raw = multiprocessing.Process(
-                target=self.wr_cmd, args=(command, silent, rtn, long_string, rtn_resp,
-                                          follow, pipe, multiline, dlog,
-                                          self.output_queue))
-            self.dev_process_raw.start()
+            return self.executor.submit(self.wr_cmd, command, silent, rtn,
+                                        long_string, rtn_resp, follow, pipe,
+                                        multiline, dlog, timeout=timeout)
         else:
             self.bytes_sent = self.serial.write(bytes(command+'\r', 'utf-8'))
 
     def get_opt(self):
-        try:
-            self.output = self.output_queue.get(block=False)
-        except Exception:
-            pass
+        nb_cmd = self.executor.pop_last()
+        if nb_cmd is not None and not nb_cmd.cancelled():
+            if nb_cmd.exception() is None:
+                self.output = nb_cmd.result()
 
 
 class SerialDevice(SERIAL_DEVICE):
     def __init__(self, *args, **kargs):
         super().__init__(*args, **kargs)
 
+    def batch(self, max_calls=32):
+        return DeviceBatch(self, max_calls=max_calls)
+
     def code(self, func):
-        str_func = '\n'.join(getsource(func).split('\n')[1:])
-        self.paste_buff(str_func)
-        self.cmd('\x04', silent=True)
+        self.code_cache.define(func.__name__, code_source(func))
 
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
+            rpc = active_rpc(self)
+            if rpc is not None:
+                return rpc.call(func.__name__, *args, **kwargs)
             flags = ['>', '<', 'object', 'at', '0x']
             args_repr = [repr(a) for a in args if any(
                 f not in repr(a) for f in flags)]
@@ -619,9 +771,7 @@ class SerialDevice(SERIAL_DEVICE):
         return wrapper_cmd
 
     def code_follow(self, func):
-        str_func = '\n'.join(getsource(func).split('\n')[1:])
-        self.paste_buff(str_func)
-        self.cmd('\x04', silent=True)
+        self.code_cache.define(func.__name__, code_source(func))
 
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
@@ -638,6 +788,8 @@ class SerialDevice(SERIAL_DEVICE):
         return wrapper_cmd
 
     def load(self, file):
+        if self.precompile.use() and self.precompile.load(file):
+            return
         with open(file, 'r') as upy_file:
             upy_content = upy_file.read()
         self.paste_buff(upy_content)
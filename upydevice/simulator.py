@@ -0,0 +1,1223 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Local MicroPython REPL simulator for serial, WebREPL and BLE transports"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+from types import ModuleType, SimpleNamespace
+import ast
+import base64
+import builtins
+import codeop
+import ctypes
+import hashlib
+import marshal
+import os
+import queue
+import select
+import socket
+import struct
+import tempfile
+import threading
+import time
+import tty
+import zlib
+from upydevice import wsprotocol
+
+_OS_UNAME = namedtuple('uname_result', ['sysname', 'nodename', 'release',
+                                        'version', 'machine'])
+
+_ALIASES = {'ubinascii': 'binascii', 'uhashlib': 'hashlib',
+            'ustruct': 'struct', 'ujson': 'json', 'uio': 'io',
+            'ucollections': 'collections', 'uerrno': 'errno',
+            'urandom': 'random', 'ure': 're', 'uzlib': 'zlib',
+            'usocket': 'socket', 'uselect': 'select'}
+
+_PASTE_BANNER = '\r\npaste mode; Ctrl-C to cancel, Ctrl-D to finish\r\n=== '
+_PROMPT = '>>> '
+
+
+class _Reset(BaseException):
+    def __init__(self, hard=True):
+        self.hard = hard
+
+
+class LinkModel:
+    """
+    Transport model: latency (s per packet), bandwidth (bytes/s, None for
+    unlimited) and mtu (max bytes per packet, None for no split).
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, mtu=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.mtu = mtu
+
+    def delay(self, n_bytes):
+        if self.bandwidth:
+            return self.latency + n_bytes / self.bandwidth
+        return self.latency
+
+    def split(self, data):
+        if not self.mtu:
+            return [data]
+        return [data[i:i+self.mtu] for i in range(0, len(data), self.mtu)]
+
+
+class _Link:
+    """Delivers device output through a LinkModel from a worker thread"""
+
+    def __init__(self, send, model):
+        self.send = send
+        self.model = model
+        self.queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def put(self, data):
+        self.queue.put(data)
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            for packet in self.model.split(data):
+                delay = self.model.delay(len(packet))
+                if delay:
+                    time.sleep(delay)
+                try:
+                    self.send(packet)
+                except Exception:
+                    # host side gone, drop output
+                    pass
+
+    def close(self):
+        self.queue.put(None)
+
+
+# REPL
+
+class REPLSimulator:
+    """
+    MicroPython friendly REPL evaluated with CPython: echo, paste mode,
+    Ctrl-B/C/D, expression results, MicroPython style tracebacks and stub
+    machine/os/sys/time/gc/network modules. The device filesystem is the
+    root directory (a temporary directory by default), .py and .mpy files
+    (MpyCrossSimulator) in sys.path can be imported.
+
+    output: callable(bytes) set by the transport, on_reset: callable(hard)
+    called on soft/hard reset before the device reboots.
+    """
+
+    def __init__(self, platform='esp32', name='upydevice-sim',
+                 version='1.19.1', machine='ESP32 module with ESP32',
+                 root=None, boot_time=0.05, mpy=6):
+        self.platform = platform
+        self.name = name
+        self.version = version
+        self.machine = machine
+        # sys.implementation._mpy (.mpy version | sub version << 8 | arch << 10)
+        self.mpy = mpy
+        self.root = root or tempfile.mkdtemp(prefix='upyd_sim_')
+        self.boot_time = boot_time
+        self.output = None
+        self.on_reset = None
+        self.booting = False
+        self.t0 = time.monotonic()
+        self.n_resets = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._busy = False
+        self._kbd_intr = True
+        self._stdin = b''
+        self._line = ''
+        self._block = None
+        self._paste = None
+        self._cwd = '/'
+        self._init_namespace()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def banner(self):
+        return ('MicroPython v{} on 2022-06-18; {}\r\nType "help()" for more '
+                'information.\r\n'.format(self.version, self.machine))
+
+    # I/O
+
+    def _write(self, text):
+        if self.output is not None and text:
+            self.output(text.encode('utf-8'))
+
+    def _print(self, *args, sep=' ', end='\n', file=None):
+        if file is not None:
+            return builtins.print(*args, sep=sep, end=end, file=file)
+        self._write((sep.join(str(arg) for arg in args) + end).replace(
+            '\n', '\r\n'))
+
+    def _write_bytes(self, data):
+        if self.output is not None and data:
+            self.output(bytes(data))
+        return len(data)
+
+    def _read_bytes(self, n):
+        # sys.stdin.buffer.read, called from user code in the REPL thread
+        while len(self._stdin) < n:
+            data = self._queue.get()
+            if data is None:
+                self._queue.put(None)
+                break
+            self._stdin += data
+        data, self._stdin = self._stdin[:n], self._stdin[n:]
+        return data
+
+    def _poll_bytes(self, timeout_ms=-1):
+        # select.poll on sys.stdin: wait until host bytes are available
+        if not self._stdin:
+            try:
+                data = self._queue.get(timeout=None if timeout_ms < 0
+                                       else timeout_ms / 1000)
+            except queue.Empty:
+                return False
+            if data is None:
+                self._queue.put(None)
+            else:
+                self._stdin += data
+        return True
+
+    def feed(self, data):
+        """Bytes received from the host"""
+        if b'\x03' in data and self._kbd_intr:
+            with self._lock:
+                if self._busy:
+                    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                        ctypes.c_ulong(self._thread.ident),
+                        ctypes.py_object(KeyboardInterrupt))
+                    data = data.replace(b'\x03', b'', 1)
+        self._queue.put(data)
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            for char in data.decode('utf-8', 'ignore'):
+                try:
+                    self._process(char)
+                except KeyboardInterrupt:
+                    # interrupt landed outside user code
+                    self._write(self._traceback('KeyboardInterrupt', '')
+                                + _PROMPT)
+
+    def close(self):
+        self._queue.put(None)
+
+    # LINE DISCIPLINE
+
+    def _process(self, char):
+        if self._paste is not None:
+            if char == '\x04':
+                code, self._paste = self._paste, None
+                self._write('\r\n')
+                self._execute(code.replace('\r\n', '\n').replace('\r', '\n'),
+                              mode='exec')
+                self._write(_PROMPT)
+            elif char == '\x03':
+                self._paste = None
+                self._write('\r\n' + _PROMPT)
+            else:
+                self._paste += char
+                self._write('\r\n=== ' if char in '\r\n' else char)
+            return
+        if char == '\r':
+            line, self._line = self._line, ''
+            self._write('\r\n')
+            self._enter(line)
+        elif char == '\n':
+            pass
+        elif char == '\x03':
+            self._line, self._block = '', None
+            self._write('\r\n' + _PROMPT)
+        elif char == '\x02':
+            self._line, self._block = '', None
+            self._write('\r\n' + self.banner + _PROMPT)
+        elif char == '\x04':
+            if not self._line and self._block is None:
+                self._reset(hard=False)
+        elif char == '\x05':
+            self._paste = ''
+            self._write(_PASTE_BANNER)
+        elif char in '\x08\x7f':
+            if self._line:
+                self._line = self._line[:-1]
+                self._write('\x08 \x08')
+        elif char >= ' ' or char == '\t':
+            self._line += char
+            self._write(char)
+
+    def _enter(self, line):
+        if self._block is not None:
+            if line.strip():
+                self._block.append(line)
+                self._write('... ')
+                return
+            code, self._block = '\n'.join(self._block), None
+            self._execute(code, mode='exec')
+        elif line.strip():
+            try:
+                complete = codeop.compile_command(line, '<stdin>', 'single')
+            except SyntaxError:
+                complete = True
+            if complete is None:
+                self._block = [line]
+                self._write('... ')
+                return
+            self._execute(line)
+        self._write(_PROMPT)
+
+    # EXECUTION
+
+    def _traceback(self, exc_name, msg):
+        return ('Traceback (most recent call last):\r\n  File "<stdin>", '
+                'line 1, in <module>\r\n{}: {}\r\n'.format(exc_name, msg))
+
+    def _execute(self, code, mode='single'):
+        """Run code, returns False if the device was reset"""
+        try:
+            tree = ast.parse(code, '<stdin>', 'exec')
+        except SyntaxError as e:
+            self._write(self._traceback('SyntaxError', e.msg))
+            return True
+        reset = None
+        try:
+            with self._lock:
+                self._busy = True
+            for node in tree.body:
+                if mode == 'single' and isinstance(node, ast.Expr):
+                    expr = compile(ast.Expression(node.value), '<stdin>',
+                                   'eval')
+                    result = eval(expr, self.namespace)
+                    if result is not None:
+                        self._write(repr(result).replace('\n', '\r\n')
+                                    + '\r\n')
+                else:
+                    module = ast.Module(body=[node], type_ignores=[])
+                    exec(compile(module, '<stdin>', 'exec'), self.namespace)
+        except _Reset as e:
+            reset = e.hard
+        except KeyboardInterrupt:
+            self._write(self._traceback('KeyboardInterrupt', ''))
+        except Exception as e:
+            self._write(self._traceback(type(e).__name__, e))
+        finally:
+            with self._lock:
+                self._busy = False
+        if reset is not None:
+            self._reset(hard=reset)
+            return False
+        return True
+
+    def _reset(self, hard=False):
+        self.n_resets += 1
+        self._line, self._block, self._paste = '', None, None
+        self.booting = True
+        if not hard:
+            self._write('MPY: soft reboot\r\n')
+        if self.on_reset is not None:
+            self.on_reset(hard)
+        self._init_namespace()
+        time.sleep(self.boot_time)
+        self.booting = False
+        if hard:
+            self._write('rst:0xc (SW_CPU_RESET),boot:0x13 (SPI_FAST_FLASH_BOOT)'
+                        '\r\n')
+        self._write(self.banner + _PROMPT)
+
+    # NAMESPACE
+
+    def _init_namespace(self):
+        self._kbd_intr = True
+        self._stdin = b''
+        self._user_modules = {}
+        self.modules = self._make_modules()
+        device_builtins = dict(vars(builtins))
+        device_builtins.update(__import__=self._import, print=self._print,
+                               open=self._open)
+        self._builtins = device_builtins
+        self.namespace = {'__name__': '__main__',
+                          '__builtins__': device_builtins}
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0:
+            if name in self.modules:
+                return self.modules[name]
+            if name in self._user_modules:
+                return self._user_modules[name]
+            module = self._load_user_module(name)
+            if module is not None:
+                return module
+            name = _ALIASES.get(name, name)
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def _load_user_module(self, name):
+        # modules uploaded to the device filesystem (sys.path)
+        for folder in self.modules['sys'].path:
+            for ext in ('.py', '.mpy'):
+                path = self.path('/'.join(filter(None, [folder, name + ext])))
+                if os.path.isfile(path):
+                    return self._exec_module(name, path, ext)
+        return None
+
+    def _exec_module(self, name, path, ext):
+        with open(path, 'rb') as module_file:
+            data = module_file.read()
+        if ext == '.mpy':
+            if data[:2] != bytes([ord('M'), self.mpy & 0xff]):
+                raise ValueError('incompatible .mpy file')
+            code = marshal.loads(data[4:])
+        else:
+            code = compile(data.decode('utf-8'), '/' + os.path.relpath(
+                path, self.root).replace(os.sep, '/'), 'exec')
+        module = ModuleType(name)
+        module.__file__ = code.co_filename
+        module.__dict__['__builtins__'] = self._builtins
+        self._user_modules[name] = module
+        try:
+            exec(code, module.__dict__)
+        except BaseException:
+            self._user_modules.pop(name, None)
+            raise
+        return module
+
+    # FILESYSTEM
+
+    def path(self, path='.'):
+        """Host path of a device path"""
+        if not path.startswith('/'):
+            path = self._cwd.rstrip('/') + '/' + path
+        parts = []
+        for part in path.split('/'):
+            if part == '..':
+                if parts:
+                    parts.pop()
+            elif part and part != '.':
+                parts.append(part)
+        return os.path.join(self.root, *parts)
+
+    def _open(self, file, mode='r', *args, **kargs):
+        if isinstance(file, str):
+            file = self.path(file)
+        return builtins.open(file, mode, *args, **kargs)
+
+    def _chdir(self, path):
+        host_path = self.path(path)
+        if not os.path.isdir(host_path):
+            raise OSError(2, 'ENOENT')
+        self._cwd = '/' + os.path.relpath(host_path, self.root).replace(
+            os.sep, '/').lstrip('.')
+
+    # MODULES
+
+    def _make_modules(self):
+        sim = self
+
+        def module(name, **attrs):
+            mod = ModuleType(name)
+            mod.__dict__.update(attrs)
+            return mod
+
+        def sleep(seconds):
+            # short slices so KeyboardInterrupt is delivered
+            deadline = time.monotonic() + seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                time.sleep(min(remaining, 0.01))
+
+        def ticks_ms():
+            return int((time.monotonic() - sim.t0) * 1000) & 0x3FFFFFFF
+
+        def ticks_us():
+            return int((time.monotonic() - sim.t0) * 1e6) & 0x3FFFFFFF
+
+        utime = module('utime', sleep=sleep,
+                       sleep_ms=lambda ms: sleep(ms / 1000),
+                       sleep_us=lambda us: sleep(us / 1e6),
+                       ticks_ms=ticks_ms, ticks_us=ticks_us,
+                       ticks_cpu=ticks_us,
+                       ticks_diff=lambda a, b: ((a - b + 0x20000000)
+                                                & 0x3FFFFFFF) - 0x20000000,
+                       ticks_add=lambda a, b: (a + b) & 0x3FFFFFFF,
+                       time=lambda: int(time.time()), time_ns=time.time_ns,
+                       localtime=lambda secs=None: time.localtime(secs)[:8],
+                       mktime=lambda t: int(time.mktime(tuple(t) + (0,))))
+
+        class Pin:
+            IN, OUT, OPEN_DRAIN = 1, 3, 7
+            PULL_UP, PULL_DOWN = 2, 1
+            IRQ_FALLING, IRQ_RISING = 2, 1
+
+            def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+                self.id = pin_id
+                self._value = value or 0
+
+            def value(self, val=None):
+                if val is None:
+                    return self._value
+                self._value = int(bool(val))
+
+            def on(self):
+                self._value = 1
+
+            def off(self):
+                self._value = 0
+
+            def irq(self, handler=None, trigger=3):
+                pass
+
+            def __repr__(self):
+                return 'Pin({})'.format(self.id)
+
+        def reset():
+            raise _Reset(hard=True)
+
+        def soft_reset():
+            raise _Reset(hard=False)
+
+        uid = hashlib.sha1(self.name.encode()).digest()[:6]
+        umachine = module('umachine', Pin=Pin, reset=reset,
+                          soft_reset=soft_reset, unique_id=lambda: uid,
+                          freq=lambda hz=None: 240000000,
+                          idle=lambda: None, reset_cause=lambda: 1)
+
+        def listdir(path='.'):
+            return sorted(os.listdir(sim.path(path)))
+
+        def ilistdir(path='.'):
+            for name in listdir(path):
+                is_dir = os.path.isdir(os.path.join(sim.path(path), name))
+                yield (name, 0x4000 if is_dir else 0x8000, 0)
+
+        def stat(path):
+            st = os.stat(sim.path(path))
+            mode = 0x4000 if os.path.isdir(sim.path(path)) else 0x8000
+            return (mode, 0, 0, 0, 0, 0, st.st_size, int(st.st_atime),
+                    int(st.st_mtime), int(st.st_ctime))
+
+        uos = module('uos', sep='/', listdir=listdir, ilistdir=ilistdir,
+                     stat=stat, getcwd=lambda: sim._cwd, chdir=sim._chdir,
+                     mkdir=lambda path: os.mkdir(sim.path(path)),
+                     rmdir=lambda path: os.rmdir(sim.path(path)),
+                     remove=lambda path: os.remove(sim.path(path)),
+                     rename=lambda old, new: os.rename(sim.path(old),
+                                                       sim.path(new)),
+                     statvfs=lambda path: (4096, 4096, 512, 384, 384, 0, 0,
+                                           0, 0, 255),
+                     uname=lambda: _OS_UNAME(sim.platform, sim.platform,
+                                             sim.version,
+                                             'v{} on 2022-06-18'.format(
+                                                 sim.version), sim.machine),
+                     urandom=os.urandom)
+
+        def print_exception(exc, file=None):
+            sim._write(sim._traceback(type(exc).__name__, exc))
+
+        stdin = SimpleNamespace(buffer=SimpleNamespace(read=self._read_bytes))
+
+        class poll:
+            # sys.stdin is polled on the host input, other objects (sockets)
+            # with select.poll
+            def __init__(self):
+                self._poll = select.poll()
+                self._stdin = False
+
+            def register(self, obj, mask=select.POLLIN):
+                if obj is stdin:
+                    self._stdin = True
+                else:
+                    self._poll.register(obj, mask)
+
+            def unregister(self, obj):
+                if obj is stdin:
+                    self._stdin = False
+                else:
+                    self._poll.unregister(obj)
+
+            def poll(self, timeout=-1):
+                if not self._stdin:
+                    return self._poll.poll(timeout)
+                ready = self._poll.poll(0)
+                if sim._poll_bytes(0 if ready else timeout):
+                    ready.append((stdin, select.POLLIN))
+                return ready
+
+        uselect = module('select', poll=poll, select=select.select,
+                         POLLIN=select.POLLIN, POLLOUT=select.POLLOUT,
+                         POLLERR=select.POLLERR, POLLHUP=select.POLLHUP)
+
+        usys = module('usys', platform=self.platform, byteorder='little',
+                      maxsize=2**31 - 1, argv=[], path=['', '/lib'],
+                      modules=self._user_modules, version='3.4.0',
+                      implementation=SimpleNamespace(
+                          name='micropython',
+                          version=tuple(int(v) for v in
+                                        self.version.split('.')),
+                          _mpy=self.mpy),
+                      print_exception=print_exception,
+                      exit=lambda code=0: None,
+                      stdin=stdin,
+                      stdout=SimpleNamespace(write=self._write,
+                                             buffer=SimpleNamespace(
+                                                 write=self._write_bytes)))
+
+        ugc = module('gc', collect=lambda: None, enable=lambda: None,
+                     disable=lambda: None, mem_free=lambda: 111168,
+                     mem_alloc=lambda: 4032,
+                     threshold=lambda amount=None: -1)
+
+        class WLAN:
+            def __init__(self, interface=0):
+                self.interface = interface
+
+            def active(self, is_active=None):
+                return True
+
+            def isconnected(self):
+                return True
+
+            def ifconfig(self, config=None):
+                return ('127.0.0.1', '255.255.255.0', '127.0.0.1',
+                        '127.0.0.1')
+
+            def status(self, param=None):
+                return -45 if param == 'rssi' else 1010
+
+            def config(self, param=None, **kargs):
+                return {'dhcp_hostname': sim.name, 'essid': sim.name,
+                        'mac': uid}.get(param)
+
+        unetwork = module('network', WLAN=WLAN, STA_IF=0, AP_IF=1)
+
+        class DeflateIO:
+            # deflate.DeflateIO (v1.21+, with compression support)
+            def __init__(self, stream, format=0, wbits=0, close=False):
+                self._stream = stream
+                self._close = close
+                wbits = wbits or 15
+                self._wbits = {1: -wbits, 2: wbits,
+                               3: 16 + wbits}.get(format, 32 + wbits)
+                self._decomp = None
+                self._comp = None
+                self._buf = b''
+
+            def read(self, size=-1):
+                if self._decomp is None:
+                    self._decomp = zlib.decompressobj(self._wbits)
+                while size < 0 or len(self._buf) < size:
+                    chunk = self._stream.read(512)
+                    if not chunk:
+                        self._buf += self._decomp.flush()
+                        break
+                    self._buf += self._decomp.decompress(chunk)
+                if size < 0:
+                    size = len(self._buf)
+                data, self._buf = self._buf[:size], self._buf[size:]
+                return data
+
+            def readinto(self, buf):
+                data = self.read(len(buf))
+                buf[:len(data)] = data
+                return len(data)
+
+            def write(self, data):
+                if self._comp is None:
+                    self._comp = zlib.compressobj(
+                        9, zlib.DEFLATED, min(self._wbits, 31))
+                self._stream.write(self._comp.compress(bytes(data)))
+                return len(data)
+
+            def close(self):
+                if self._comp is not None:
+                    self._stream.write(self._comp.flush())
+                    self._comp = None
+                if self._close:
+                    self._stream.close()
+
+        udeflate = module('deflate', DeflateIO=DeflateIO, AUTO=0, RAW=1,
+                          ZLIB=2, GZIP=3)
+        uzlib = module('uzlib', decompress=lambda data, wbits=15:
+                       zlib.decompress(data, wbits),
+                       DecompIO=lambda stream, wbits=0: DeflateIO(
+                           stream, 1 if wbits < 0 else
+                           3 if wbits > 16 else 2))
+
+        def kbd_intr(char):
+            sim._kbd_intr = char != -1
+
+        umicropython = module('micropython', const=lambda expr: expr,
+                              opt_level=lambda level=None: 0,
+                              mem_info=lambda verbose=None: None,
+                              alloc_emergency_exception_buf=lambda n: None,
+                              schedule=lambda func, arg: func(arg),
+                              kbd_intr=kbd_intr)
+        modules = {'time': utime, 'utime': utime, 'machine': umachine,
+                   'umachine': umachine, 'os': uos, 'uos': uos, 'sys': usys,
+                   'usys': usys, 'gc': ugc, 'network': unetwork,
+                   'micropython': umicropython, 'select': uselect,
+                   'uselect': uselect, 'deflate': udeflate, 'zlib': uzlib,
+                   'uzlib': uzlib}
+        usys.modules = modules
+        return modules
+
+
+# SERIAL
+
+class SerialSimulator:
+    """
+    Serial REPL on a pseudo terminal, use sim.port as the serial port:
+
+        with SerialSimulator() as sim:
+            dev = SerialDevice(sim.port)
+    """
+
+    def __init__(self, repl=None, latency=0.0, bandwidth=None, mtu=None,
+                 **repl_kargs):
+        self.repl = repl or REPLSimulator(**repl_kargs)
+        self.link = LinkModel(latency, bandwidth, mtu)
+        self.port = None
+        self._master = None
+        self._slave = None
+        self._running = False
+        self._reader = None
+        self._tx = None
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._tx = _Link(lambda data: os.write(self._master, data), self.link)
+        self.repl.output = self._tx.put
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        return self
+
+    def _read(self):
+        while self._running:
+            readable, _, _ = select.select([self._master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                break
+            delay = self.link.delay(len(data))
+            if delay:
+                time.sleep(delay)
+            self.repl.feed(data)
+
+    def stop(self):
+        self._running = False
+        if self._reader is not None:
+            self._reader.join()
+        self.repl.output = None
+        self._tx.close()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+# WEBREPL
+
+_WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_WEBREPL_HEADER = '<2sBBQLH64s'
+_WEBREPL_HEADER_SIZE = struct.calcsize(_WEBREPL_HEADER)
+
+
+class WebREPLSimulator:
+    """
+    WebREPL server (websocket handshake, password prompt, text frames for
+    the REPL and the binary file protocol), one client at a time:
+
+        with WebREPLSimulator(password='mypass') as sim:
+            dev = WebSocketDevice(sim.address, 'mypass')
+    """
+
+    def __init__(self, password='upydevice', host='127.0.0.1', port=0,
+                 repl=None, latency=0.0, bandwidth=None, mtu=None,
+                 **repl_kargs):
+        self.password = password
+        self.host = host
+        self.port = port
+        self.repl = repl or REPLSimulator(**repl_kargs)
+        self.repl.on_reset = self._on_reset
+        self.link = LinkModel(latency, bandwidth, mtu)
+        self.n_connections = 0
+        self._server = None
+        self._client = None
+        self._tx = None
+        self._running = False
+        self._file_op = None
+        self._file_rx = b''
+
+    @property
+    def address(self):
+        return '{}:{}'.format(self.host, self.port)
+
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen(1)
+        self.port = self._server.getsockname()[1]
+        self._running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._close_client()
+        self._server.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _accept(self):
+        while self._running:
+            try:
+                conn, addr = self._server.accept()
+            except OSError:
+                return
+            if self.repl.booting or self._client is not None:
+                # rebooting or WebREPL already in use
+                conn.close()
+                continue
+            threading.Thread(target=self._serve, args=(conn,),
+                             daemon=True).start()
+
+    def _handshake(self, conn):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            data = conn.recv(1024)
+            if not data:
+                return False
+            request += data
+        key = b''
+        for line in request.split(b'\r\n'):
+            if line.lower().startswith(b'sec-websocket-key:'):
+                key = line.split(b':', 1)[1].strip()
+        accept = base64.b64encode(hashlib.sha1(key + _WS_GUID).digest())
+        conn.sendall(b'HTTP/1.1 101 Switching Protocols\r\n'
+                     b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        return True
+
+    def _serve(self, conn):
+        ws = None
+        try:
+            if not self._handshake(conn):
+                return
+            ws = _ServerWebsocket(conn)
+            ws.write_frame(wsprotocol.OP_TEXT, b'Password: ')
+            password = b''
+            while not password.endswith(b'\r'):
+                fin, opcode, data = ws.read_frame()
+                if opcode == wsprotocol.OP_CLOSE:
+                    return
+                password += data
+            if password[:-1].decode() != self.password:
+                ws.write_frame(wsprotocol.OP_TEXT, b'\r\nAccess denied\r\n')
+                return
+            self.n_connections += 1
+            self._client = ws
+            self._file_op = None
+            self._tx = _Link(lambda data: ws.write_frame(wsprotocol.OP_TEXT,
+                                                         data), self.link)
+            ws.write_frame(wsprotocol.OP_TEXT,
+                           b'\r\nWebREPL connected\r\n>>> ')
+            self.repl.output = self._tx.put
+            while self._running and self._client is ws:
+                fin, opcode, data = ws.read_frame()
+                if opcode == wsprotocol.OP_CLOSE:
+                    break
+                if opcode == wsprotocol.OP_PING:
+                    ws.write_frame(wsprotocol.OP_PONG, data)
+                    continue
+                delay = self.link.delay(len(data))
+                if delay:
+                    time.sleep(delay)
+                if opcode == wsprotocol.OP_BYTES:
+                    self._file_data(ws, data)
+                else:
+                    self.repl.feed(data)
+        except (OSError, ValueError, struct.error,
+                wsprotocol.NoDataException):
+            pass
+        finally:
+            if ws is not None and self._client is ws:
+                self._close_client()
+            else:
+                conn.close()
+
+    def _close_client(self):
+        client, self._client = self._client, None
+        if self._tx is not None:
+            self.repl.output = None
+            self._tx.close()
+            self._tx = None
+        if client is not None:
+            client.close()
+
+    def _on_reset(self, hard):
+        # WebREPL connection is closed when the device reboots
+        self._close_client()
+
+    # binary file protocol (webrepl_cli put/get)
+
+    def _file_resp(self, ws, code=0):
+        ws.write_frame(wsprotocol.OP_BYTES, struct.pack('<2sH', b'WB', code))
+
+    def _file_data(self, ws, data):
+        op = self._file_op
+        if op is None:
+            self._file_rx += data
+            if len(self._file_rx) < _WEBREPL_HEADER_SIZE:
+                return
+            header = self._file_rx[:_WEBREPL_HEADER_SIZE]
+            self._file_rx = b''
+            sig, kind, _, _, size, fname_len, fname = struct.unpack(
+                _WEBREPL_HEADER, header)
+            path = self.repl.path(fname[:fname_len].decode())
+            try:
+                if kind == 1:
+                    self._file_op = ['put', open(path, 'wb'), size]
+                    if size == 0:
+                        self._file_op[1].close()
+                        self._file_op = None
+                        self._file_resp(ws)
+                elif kind == 2:
+                    self._file_op = ['get', open(path, 'rb'), 0]
+                else:
+                    raise OSError
+            except OSError:
+                self._file_op = None
+                return self._file_resp(ws, 1)
+            return self._file_resp(ws)
+        kind, file, remaining = op
+        if kind == 'put':
+            file.write(data[:remaining])
+            op[2] = remaining - len(data[:remaining])
+            if op[2] <= 0:
+                file.close()
+                self._file_op = None
+                self._file_resp(ws)
+        else:
+            chunk = file.read(1024)
+            ws.write_frame(wsprotocol.OP_BYTES,
+                           struct.pack('<H', len(chunk)) + chunk)
+            if not chunk:
+                file.close()
+                self._file_op = None
+                self._file_resp(ws)
+
+
+class _ServerWebsocket:
+    """Server side websocket framing (unmasked writes, EOF aware reads)"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._lock = threading.Lock()
+
+    def _quickack(self):
+        # clients write frame header and payload in separate sends, ack at
+        # once so Nagle + delayed ACK do not stall them (like lwIP does)
+        if hasattr(socket, 'TCP_QUICKACK'):
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+    def _recv_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            self._quickack()
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise wsprotocol.NoDataException
+            data += chunk
+        return data
+
+    def read_frame(self):
+        byte1, byte2 = struct.unpack('!BB', self._recv_exactly(2))
+        length = byte2 & 0x7f
+        if length == 126:
+            length, = struct.unpack('!H', self._recv_exactly(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', self._recv_exactly(8))
+        mask_bits = self._recv_exactly(4) if byte2 & 0x80 else None
+        data = self._recv_exactly(length)
+        if mask_bits:
+            data = bytes(b ^ mask_bits[i % 4] for i, b in enumerate(data))
+        return bool(byte1 & 0x80), byte1 & 0x0f, data
+
+    def write_frame(self, opcode, data=b''):
+        length = len(data)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < (1 << 16):
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        with self._lock:
+            self.sock.sendall(header + data)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+# BLE
+
+NUS_SERVICE = '6e400001-b5a3-f393-e0a9-e50e24dcca9e'
+NUS_RX = '6e400002-b5a3-f393-e0a9-e50e24dcca9e'
+NUS_TX = '6e400003-b5a3-f393-e0a9-e50e24dcca9e'
+
+
+class _Characteristic(SimpleNamespace):
+    pass
+
+
+class _Service(SimpleNamespace):
+    pass
+
+
+class BleSimulator:
+    """
+    BLE device with a Nordic UART Service REPL, mock BleakClient and
+    BleakScanner are patched into upydevice.bledevice with sim.patch():
+
+        sim = BleSimulator()
+        with sim.patch():
+            dev = BleDevice(sim.address)
+
+    mtu limits write and notification sizes (ATT payload is mtu - 3).
+    """
+
+    _registry = {}
+
+    def __init__(self, address='D4:3A:2C:00:00:01', name='upydevice-sim',
+                 repl=None, latency=0.0, bandwidth=None, mtu=247, rssi=-50,
+                 **repl_kargs):
+        self.address = address
+        self.name = name
+        self.rssi = rssi
+        self.repl = repl or REPLSimulator(name=name, **repl_kargs)
+        self.repl.on_reset = self._on_reset
+        self.link = LinkModel(latency, bandwidth, mtu - 3)
+        self.mtu = mtu
+        self.advertising = True
+        self.client = None
+        self._tx = _Link(self._notify, self.link)
+        self.repl.output = self._tx.put
+        self.rx = _Characteristic(uuid=NUS_RX, description='Nordic UART RX',
+                                  properties=['write',
+                                              'write-without-response'],
+                                  handle=12, descriptors=[])
+        self.tx = _Characteristic(uuid=NUS_TX, description='Nordic UART TX',
+                                  properties=['notify'], handle=14,
+                                  descriptors=[])
+        self.services = [_Service(uuid=NUS_SERVICE,
+                                  description='Nordic UART Service',
+                                  characteristics=[self.rx, self.tx])]
+
+    @property
+    def scan_device(self):
+        return SimpleNamespace(address=self.address, name=self.name,
+                               rssi=self.rssi, details=None)
+
+    def _notify(self, data):
+        client = self.client
+        if client is not None:
+            client._notify(self.tx, data)
+
+    def _on_reset(self, hard):
+        # BLE REPL is restarted from boot.py, the connection drops
+        if self.client is not None:
+            self.client._disconnected()
+        self.advertising = False
+        threading.Timer(self.repl.boot_time * 2, self._advertise).start()
+
+    def _advertise(self):
+        self.advertising = True
+
+    @contextmanager
+    def patch(self):
+        """Patch BleakClient/BleakScanner in upydevice.bledevice"""
+        from upydevice import bledevice
+        BleSimulator._registry[self.address] = self
+        client, scanner = bledevice.BleakClient, bledevice.BleakScanner
+        bledevice.BleakClient = MockBleakClient
+        bledevice.BleakScanner = MockBleakScanner
+        try:
+            yield self
+        finally:
+            bledevice.BleakClient, bledevice.BleakScanner = client, scanner
+            BleSimulator._registry.pop(self.address, None)
+
+
+class MockBleakClient:
+    """Minimal BleakClient connected to a BleSimulator"""
+
+    def __init__(self, address, **kargs):
+        self.address = getattr(address, 'address', address)
+        self.sim = None
+        self._connected = False
+        self._callback = None
+        self._loop = None
+        self._disconnected_callback = kargs.get('disconnected_callback')
+        self._device_info = {}
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    @property
+    def services(self):
+        return self.sim.services if self.sim else []
+
+    async def connect(self, timeout=10, **kargs):
+        sim = BleSimulator._registry.get(self.address)
+        if sim is None or not sim.advertising:
+            raise Exception('Device with address {} was not found'.format(
+                self.address))
+        self.sim = sim
+        self._device_info = {'Name': sim.name}
+        sim.client = self
+        sim.advertising = False
+        self._connected = True
+        return True
+
+    async def disconnect(self):
+        if self.sim is not None and self.sim.client is self:
+            self.sim.client = None
+            self.sim.advertising = True
+        self._connected = False
+        return True
+
+    def _disconnected(self):
+        self._connected = False
+        self._callback = None
+        self.sim.client = None
+        callback, loop = self._disconnected_callback, self._loop
+        if callback is not None and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(callback, self)
+
+    def set_disconnected_callback(self, callback, **kargs):
+        self._disconnected_callback = callback
+
+    async def write_gatt_char(self, char, data, response=False):
+        if not self._connected:
+            raise Exception('Not connected')
+        if len(data) > self.sim.mtu - 3 and not response:
+            raise Exception('Data length {} exceeds ATT MTU'.format(len(data)))
+        delay = self.sim.link.delay(len(data))
+        if delay:
+            await asyncio_sleep(delay)
+        self.sim.repl.feed(bytes(data))
+
+    async def start_notify(self, char, callback, **kargs):
+        import asyncio
+        self._loop = asyncio.get_running_loop()
+        self._callback = callback
+
+    async def stop_notify(self, char):
+        self._callback = None
+
+    def _notify(self, char, data):
+        callback, loop = self._callback, self._loop
+        if callback is None or loop is None or loop.is_closed():
+            return
+
+        def deliver():
+            # drop notifications that arrive after stop_notify
+            if self._callback is callback:
+                callback(char, bytearray(data))
+        loop.call_soon_threadsafe(deliver)
+
+    async def read_gatt_char(self, char, **kargs):
+        return bytearray()
+
+
+class MockBleakScanner:
+    @staticmethod
+    async def find_device_by_address(address, timeout=10, **kargs):
+        sim = BleSimulator._registry.get(address)
+        if sim is not None and sim.advertising:
+            return sim.scan_device
+        await asyncio_sleep(min(timeout, 0.05))
+        return None
+
+    @staticmethod
+    async def discover(timeout=5, **kargs):
+        return [sim.scan_device for sim in BleSimulator._registry.values()
+                if sim.advertising]
+
+
+class MpyCrossSimulator:
+    """
+    mpy-cross stand-in (upydevice.precompile.MpyCross interface) for the
+    simulators: .mpy header and the CPython code object (marshal).
+    """
+
+    available = True
+
+    def __init__(self, version=(6, 0)):
+        self.version = version
+        self.n_compiled = 0
+
+    def compile(self, source, name, arch=''):
+        try:
+            code = compile(source, name + '.py', 'exec')
+        except SyntaxError:
+            return None
+        self.n_compiled += 1
+        return bytes([ord('M'), self.version[0], self.version[1], 31]
+                     ) + marshal.dumps(code)
+
+
+async def asyncio_sleep(delay):
+    import asyncio
+    await asyncio.sleep(delay)
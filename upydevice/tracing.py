@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# MIT License
+#
+# Copyright (c) 2020 - 2022 Carlos Gil Gonzalez
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Per command latency tracing (phase timings, bytes, retries)"""
+
+from collections import namedtuple, deque
+import bisect
+import math
+import time
+
+# phases of wr_cmd in order, each one is the time since the previous one
+PHASES = ('flush', 'write', 'first_byte', 'prompt', 'decode', 'parse')
+TOTAL = 'total'
+
+# histogram bucket upper edges (ms)
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+CMD_TRACE = namedtuple('CMD_TRACE', ['dev', 'cmd', 'phases', 'elapsed',
+                                     'sent', 'received', 'retries', 'ts'])
+
+
+class _NullSpan:
+    """Span used while tracing is disabled, does nothing"""
+
+    def mark(self, phase):
+        pass
+
+    def first_byte(self):
+        pass
+
+    def retry(self):
+        pass
+
+    def end(self, sent=0, received=0):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'cmd', 'ts', 't0', 't_last', 'phases', 'retries',
+                 '_first')
+
+    def __init__(self, tracer, cmd):
+        self.tracer = tracer
+        self.cmd = cmd
+        self.ts = time.time()
+        self.t0 = self.t_last = time.perf_counter()
+        self.phases = {}
+        self.retries = 0
+        self._first = False
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self.t_last
+        self.t_last = now
+
+    def first_byte(self):
+        if not self._first:
+            self._first = True
+            self.mark('first_byte')
+
+    def retry(self):
+        self.retries += 1
+
+    def end(self, sent=0, received=0):
+        self.tracer._record(CMD_TRACE(
+            self.tracer.dev_name, self.cmd, self.phases,
+            time.perf_counter() - self.t0, sent, received, self.retries,
+            self.ts))
+
+
+class LatencyHistogram:
+    """Latest maxlen samples (s) of a phase, percentiles and bucket counts"""
+
+    def __init__(self, maxlen=1024):
+        self.samples = deque(maxlen=maxlen)
+        self.count = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def percentile(self, q):
+        """Nearest rank percentile (s), q in 0-100"""
+        if not self.samples:
+            return None
+        values = sorted(self.samples)
+        rank = max(0, min(len(values) - 1,
+                          math.ceil(q / 100 * len(values)) - 1))
+        return values[rank]
+
+    def buckets(self, edges=BUCKETS_MS):
+        """{'<=edge ms': count} plus '>last ms'"""
+        counts = [0] * (len(edges) + 1)
+        for value in self.samples:
+            counts[bisect.bisect_left(edges, value * 1e3)] += 1
+        hist = {'<={}'.format(edge): n for edge, n in zip(edges, counts)}
+        hist['>{}'.format(edges[-1])] = counts[-1]
+        return hist
+
+    def summary(self):
+        if not self.samples:
+            return {'n': 0}
+        values = sorted(self.samples)
+        return {'n': len(values),
+                'mean(ms)': round(sum(values) / len(values) * 1e3, 3),
+                'p50(ms)': round(self.percentile(50) * 1e3, 3),
+                'p95(ms)': round(self.percentile(95) * 1e3, 3),
+                'p99(ms)': round(self.percentile(99) * 1e3, 3),
+                'max(ms)': round(values[-1] * 1e3, 3)}
+
+
+class CommandTracer:
+    """
+    Opt-in wr_cmd instrumentation of a device (dev.tracer): phase timings,
+    bytes sent/received and retries of each command, passed to subscribed
+    callbacks as CMD_TRACE and aggregated in per phase histograms.
+
+        dev.tracer.enable(callback=print)
+        dev.wr_cmd('gc.mem_free()')
+        dev.tracer.stats()['total']['p95(ms)']
+    """
+
+    def __init__(self, device, maxlen=1024):
+        self.dev = device
+        self.maxlen = maxlen
+        self.enabled = False
+        self.callbacks = []
+        self.histograms = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.errors = 0
+        self.last = None
+
+    @property
+    def dev_name(self):
+        return getattr(self.dev, 'name', None) or getattr(
+            self.dev, 'address', None)
+
+    def enable(self, callback=None):
+        if callback is not None:
+            self.subscribe(callback)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def subscribe(self, callback):
+        """callback(CMD_TRACE) called after each traced command"""
+        if callback not in self.callbacks:
+            self.callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    def span(self, cmd):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, cmd)
+
+    def _record(self, trace):
+        self.last = trace
+        for phase, value in trace.phases.items():
+            self._histogram(phase).add(value)
+        self._histogram(TOTAL).add(trace.elapsed)
+        self.bytes_sent += trace.sent
+        self.bytes_received += trace.received
+        self.retries += trace.retries
+        for callback in self.callbacks:
+            try:
+                callback(trace)
+            except Exception:
+                self.errors += 1
+
+    def _histogram(self, phase):
+        hist = self.histograms.get(phase)
+        if hist is None:
+            hist = self.histograms[phase] = LatencyHistogram(self.maxlen)
+        return hist
+
+    def histogram(self, phase=TOTAL, edges=BUCKETS_MS):
+        hist = self.histograms.get(phase)
+        return hist.buckets(edges) if hist else {}
+
+    def stats(self):
+        """{phase: {n, mean, p50, p95, p99, max (ms)}} in phase order"""
+        order = [phase for phase in PHASES + (TOTAL,)
+                 if phase in self.histograms]
+        return {phase: self.histograms[phase].summary() for phase in order}
+
+    def reset(self):
+        self.histograms.clear()
+        self.bytes_sent = self.bytes_received = self.retries = 0
+        self.last = None
+
+    def report(self):
+        lines = ['{:<12}{:>7}{:>11}{:>11}{:>11}{:>11}'.format(
+            'phase', 'n', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'max(ms)')]
+        for phase, summary in self.stats().items():
+            lines.append('{:<12}{:>7}{:>11}{:>11}{:>11}{:>11}'.format(
+                phase, summary['n'], summary['p50(ms)'], summary['p95(ms)'],
+                summary['p99(ms)'], summary['max(ms)']))
+        lines.append('sent: {} B, received: {} B, retries: {}'.format(
+            self.bytes_sent, self.bytes_received, self.retries))
+        return '\n'.join(lines)
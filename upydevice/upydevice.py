@@ -22,17 +22,14 @@
 # SOFTWARE.
 
 
-from .serialdevice import *
-from .websocketdevice import *
-from .devgroup import *
-from .decorators import *
+# transports are imported in Device (see __init__.py lazy loading)
 # from .bledevice import *
 from .exceptions import *
-from ipaddress import ip_address
-import socket
 
 
 def check_device_type(dev_address, resolve_name=False):
+    from ipaddress import ip_address
+    import socket
     if isinstance(dev_address, str):
         if '.' in dev_address and dev_address.count('.') == 3:
             # check IP
@@ -70,10 +67,18 @@ def check_device_type(dev_address, resolve_name=False):
             return 'BleDevice'
 
 
-def Device(dev_address, password=None, **kargs):
-    """Returns Device class depending on dev_address type"""
+def Device(dev_address, password=None, broker=None, **kargs):
+    """
+    Returns Device class depending on dev_address type, with broker=True
+    (or a socket path) a BrokerDevice served by the local broker daemon
+    """
+    if broker:
+        from .broker import BrokerDevice
+        path = broker if isinstance(broker, str) else None
+        return BrokerDevice(dev_address, password, path=path, **kargs)
     dev_type = check_device_type(dev_address)
     if dev_type == 'SerialDevice':
+        from .serialdevice import SerialDevice
         baudrt = 115200
         pop_args = ['ssl', 'auth', 'capath']
         fkargs = {k: v for k, v in kargs.items() if k not in pop_args}
@@ -83,9 +88,16 @@ def Device(dev_address, password=None, **kargs):
             baudrt = fkargs.pop('baudrate')
         return SerialDevice(dev_address, baudrate=baudrt, **fkargs)
     if dev_type == 'WebSocketDevice':
+        from .websocketdevice import WebSocketDevice
         return WebSocketDevice(dev_address, password, **kargs)
     if dev_type == 'BleDevice':
         from .bledevice import BleDevice
         pop_args = ['ssl', 'auth', 'capath']
         fkargs = {k: v for k, v in kargs.items() if k not in pop_args}
         return BleDevice(dev_address, **fkargs)
+
+
+def __getattr__(attr):
+    # names that were star imported here before lazy loading
+    from . import __getattr__ as _pkg_getattr
+    return _pkg_getattr(attr)
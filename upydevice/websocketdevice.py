@@ -24,12 +24,9 @@
 import ast
 import time
 import socket
-import multiprocessing
 import shlex
 import subprocess
 from array import array
-import netifaces
-import nmap
 import sys
 import ssl as sslib
 import select
@@ -38,7 +35,18 @@ from io import BufferedRandom
 from binascii import hexlify
 from upydevice import wsclient, wsprotocol
 from .exceptions import DeviceException, DeviceNotFound
-from .decorators import getsource
+from .decorators import (DeviceBatch, DeviceCodeCache, code_source,
+                         active_rpc)
+from .executor import DeviceExecutor
+from .rpc import DeviceRPC
+from .tracing import CommandTracer, NULL_SPAN
+from .datalog import DatalogCapture
+from .output import OutputPipeline
+from . import netscan
+from .backoff import Backoff
+from .compression import DeviceCompression
+from .precompile import DevicePrecompile
+from .filetransfer import WebREPLFileTransfer
 import functools
 import re
 
@@ -83,48 +91,36 @@ def get_ssid():
 
 
 # find devices in wlan with port 8266/8833 open/listening
-def net_scan(n=None, debug=False, ssl=False, debug_info=False):
-    WebREPL_port = 8266
+def net_scan(n=None, debug=False, ssl=False, debug_info=False, subnet=None,
+             ports=None, timeout=0.5, concurrency=256, probe=False,
+             cache_ttl=0):
+    WebREPL_port = netscan.WEBREPL_PORT
     if ssl:
-        WebREPL_port = 8833
+        WebREPL_port = netscan.WEBREPL_SSL_PORT
+    if ports is None:
+        ports = [WebREPL_port]
     if debug:
         print('Scanning WLAN {} for upy devices...'.format(get_ssid()))
-    gws = netifaces.gateways()
-    host_range = "{}-255".format(gws['default'][netifaces.AF_INET][0])
-    nmScan = nmap.PortScanner()
-    n_scans = 1
-    netdevices = []
-    if n is not None:
-        n_scans = n
-    for i in range(n_scans):
-        if debug:
-            print('SCAN # {}'.format(i))
-        my_scan = nmScan.scan(
-            hosts=host_range, arguments='-p {}'.format(WebREPL_port))
-        hosts_list = [{'host': x, 'state': nmScan[x]['status']['state'], 'port':list(
-            nmScan[x]['tcp'].keys())[0],
-            'status':nmScan[x]['tcp'][WebREPL_port]['state']}
-            for x in nmScan.all_hosts()]
-        devs = [host for host in hosts_list if host['status'] == 'open']
-        if debug:
-            print('FOUND {} device/s :'.format(len(devs)))
-        N = 1
-        if debug:
-            for dev in devs:
-                try:
-                    print('DEVICE {}: , IP: {} , STATE: {}, PORT: {}, '
-                          'STATUS: {}'.format(N, dev['host'], dev['state'],
-                                              dev['port'], dev['status']))
-                    N += 1
-                except Exception:
-                    pass
-        if not debug_info:
-            for dev in devs:
-                if dev['host'] not in netdevices:
-                    netdevices.append(dev['host'])
-            return netdevices
-        else:
-            return devs
+    devs = netscan.scan(subnet=subnet, ports=ports, timeout=timeout,
+                        concurrency=concurrency, probe=probe, n=n or 1,
+                        cache_ttl=cache_ttl)
+    if probe:
+        devs = [dev for dev in devs if dev['webrepl']]
+    if debug:
+        print('FOUND {} device/s :'.format(len(devs)))
+        for N, dev in enumerate(devs, start=1):
+            print('DEVICE {}: , IP: {} , STATE: {}, PORT: {}, '
+                  'STATUS: {}, LATENCY: {:.1f} ms'.format(
+                      N, dev['host'], dev['state'], dev['port'],
+                      dev['status'], dev['latency']))
+    if not debug_info:
+        netdevices = []
+        for dev in devs:
+            if dev['host'] not in netdevices:
+                netdevices.append(dev['host'])
+        return netdevices
+    else:
+        return devs
 
 
 class BASE_WS_DEVICE:
@@ -161,6 +157,14 @@ class BASE_WS_DEVICE:
         self.platform = None
         self.connected = False
         self.repl_CONN = self.connected
+        self.code_cache = DeviceCodeCache(self)
+        self.filetransfer = WebREPLFileTransfer(self)
+        self.executor = DeviceExecutor(self)
+        self.compression = DeviceCompression(self)
+        self.precompile = DevicePrecompile(self)
+        self.rpc = DeviceRPC(self)
+        self.tracer = CommandTracer(self)
+        self._span = NULL_SPAN
         self._ssl = ssl
         self._uriprotocol = 'ws'
         if ssl:
@@ -290,6 +294,9 @@ class BASE_WS_DEVICE:
         self.ws.send(cmd)
         return n_bytes
 
+    def _kbi_cmd(self):
+        self.bytes_sent = self.write(self._kbi+'\r')
+
     def read_all(self):
         self.ws.sock.settimeout(None)
         try:
@@ -298,6 +305,7 @@ class BASE_WS_DEVICE:
                 try:
                     fin, opcode, data = self.ws.read_frame()
                     self.raw_buff += data
+                    self._span.first_byte()
                 except AttributeError:
                     pass
 
@@ -392,6 +400,7 @@ class BASE_WS_DEVICE:
             return self.output
 
     def reset(self, silent=False, reconnect=True, hr=False):
+        self.code_cache.clear()
         if not silent:
             print('Rebooting device...')
         if self.connected:
@@ -431,6 +440,75 @@ class BASE_WS_DEVICE:
             if not silent:
                 print('Done!')
 
+    def _wait_closed(self, backoff):
+        # device closes the websocket when it reboots
+        while not backoff.expired():
+            try:
+                self.ws.sock.settimeout(max(0.01, backoff.remaining()))
+                if not self.ws.sock.recv(256):
+                    return True
+            except socket.timeout:
+                return False
+            except OSError:
+                return True
+        return False
+
+    def reset_ready(self, hr=False, timeout=20, silent=True):
+        """
+        Reset and reconnect as soon as the WebREPL port is up again and the
+        REPL answers, with exponential backoff until timeout (s).
+        Returns elapsed s.
+        """
+        self.code_cache.clear()
+        if not silent:
+            print('Rebooting device...')
+        backoff = Backoff(timeout)
+        if not self.connected:
+            self.open_wconn(ssl=self._ssl, auth=True)
+        self.bytes_sent = self.write(self._hreset if hr else self._reset)
+        if self._wait_closed(backoff):
+            # already closed by the device, no close frame
+            self.ws._close()
+        self.close_wconn()
+        backoff.reset()
+        while True:
+            probe = netscan.run_coro(netscan.as_tcp_connect(
+                self.ip, self.port, timeout=max(0.05, min(
+                    0.5, backoff.remaining()))))
+            if probe['status'] == 'open':
+                self.open_wconn(ssl=self._ssl, auth=True)
+                if self.connected:
+                    try:
+                        self.wr_cmd(self._banner, silent=True)
+                        # a late login prompt may have ended the read
+                        buff = self.raw_buff
+                        self.ws.sock.settimeout(max(0.1, backoff.remaining()))
+                        while not (b'MicroPython' in buff
+                                   and buff.endswith(self.prompt)):
+                            fin, opcode, data = self.ws.read_frame()
+                            buff += data or b''
+                        # '\r' after Ctrl-B prints one more prompt, read it
+                        # here or the next command takes it as its output
+                        tail = buff.split(b'MicroPython')[-1]
+                        self.ws.sock.settimeout(0.5)
+                        try:
+                            while tail.count(self.prompt) < 2:
+                                fin, opcode, data = self.ws.read_frame()
+                                tail += data or b''
+                        except socket.timeout:
+                            pass
+                        break
+                    except Exception:
+                        self.ws._close()
+                        self.connected = False
+            if not backoff.sleep():
+                raise DeviceNotFound(f"WebSocketDevice @ "
+                                     f"{self._uriprotocol}://{self.ip}:"
+                                     f"{self.port} not ready after {timeout} s")
+        if not silent:
+            print('Done! ({:.2f} s)'.format(backoff.elapsed))
+        return backoff.elapsed
+
     def kbi(self, silent=True, pipe=None, long_string=False):
         if self.connected:
             if pipe is not None:
@@ -486,9 +564,10 @@ class WS_DEVICE(BASE_WS_DEVICE):
         self.name = name
         self.raw_buff = b''
         self.message = b''
-        self.output_queue = multiprocessing.Queue(maxsize=1)
         self.data_buff = ''
         self.datalog = []
+        self.dlog_capture = None
+        self._dlog = None
         self.paste_cmd = ''
         self.flush_conn = self.flush
         self._is_traceback = False
@@ -592,12 +671,15 @@ class WS_DEVICE(BASE_WS_DEVICE):
     def wr_cmd(self, cmd, silent=False, rtn=True, long_string=False,
                rtn_resp=False, follow=False, pipe=None, multiline=False,
                dlog=False, nb_queue=None):
+        span = self._span = self.tracer.span(cmd)
         self.output = None
         self._is_traceback = False
         self.response = ''
         self.buff = b''
         self.flush()
+        span.mark('flush')
         self.bytes_sent = self.write(cmd+'\r')
+        span.mark('write')
         # time.sleep(0.1)
         # self.buff = self.read_all()[self.bytes_sent:]
         if not follow:
@@ -605,12 +687,18 @@ class WS_DEVICE(BASE_WS_DEVICE):
         if self.buff == b'':
             # time.sleep(0.1)
             if not follow:
+                span.retry()
                 self.buff = self.read_all()
             else:
                 silent_pipe = silent
                 silent = True
                 rtn = False
                 rtn_resp = False
+                if dlog:
+                    # parse data lines as they arrive
+                    self._dlog = dlog if isinstance(
+                        dlog, DatalogCapture) else DatalogCapture()
+                    self.dlog_capture = self._dlog
                 try:
                     self.follow_output(cmd, pipe=pipe, multiline=multiline,
                                        silent=silent_pipe)
@@ -627,11 +715,21 @@ class WS_DEVICE(BASE_WS_DEVICE):
                     for i in range(1):
                         self.write('\r')
                         self.flush_conn()
+        span.mark('prompt')
+        self._span = NULL_SPAN
+        received = len(self.buff)
         # print(self.buff)
         # filter command
         cmd_filt = bytes(cmd + '\r\n', 'utf-8')
         self.buff = self.buff.replace(cmd_filt, b'', 1)
-        if dlog:
+        dlog_error = ''
+        if self._dlog is not None:
+            self._dlog.close()
+            dlog_error = self._dlog.error
+            self._dlog = None
+            self.data_buff = ''
+        elif dlog:
+            self.dlog_capture = None
             self.data_buff = self.buff.replace(b'\r', b'').replace(
                 b'\r\n>>> ', b'').replace(b'>>> ', b'').decode('utf-8', 'ignore')
         if self._traceback in self.buff:
@@ -642,6 +740,10 @@ class WS_DEVICE(BASE_WS_DEVICE):
         else:
             self.response = self.buff.replace(b'\r\n', b'').replace(
                 b'\r\n>>> ', b'').replace(b'>>> ', b'').decode('utf-8', 'ignore')
+        if dlog_error:
+            # datalog output is not kept in buff, only its traceback
+            self._is_traceback = True
+            self.response = dlog_error
         if not silent:
             if self.response != '\n' and self.response != '':
                 if pipe is None:
@@ -659,8 +761,10 @@ class WS_DEVICE(BASE_WS_DEVICE):
                         self.output = ''
             else:
                 self.response = ''
+        span.mark('decode')
         if rtn:
             self.get_output()
+            span.mark('parse')
             if self.output == '\n' and self.output == '':
                 self.output = None
             if self.output is None:
@@ -672,6 +776,7 @@ class WS_DEVICE(BASE_WS_DEVICE):
                 else:
                     nb_queue.get_nowait()
                     nb_queue.put((self.output), block=False)
+        span.end(sent=self.bytes_sent, received=received)
         if rtn_resp:
             return self.output
 
@@ -692,7 +797,15 @@ class WS_DEVICE(BASE_WS_DEVICE):
             self.message = self.readline()
             self.buff += self.message
             # self.raw_buff += self.message
-            if self.message == b'':
+            if self._dlog is not None:
+                # keep only prompt detection tail in memory
+                self._dlog.feed(self.message)
+                self.buff = self.buff[-len(self.prompt):]
+            if isinstance(pipe, OutputPipeline):
+                pipe.feed(self.message)
+                if self.message == b'' and self.buff.endswith(self.prompt):
+                    break
+            elif self.message == b'':
                 if self.buff.endswith(self.prompt):
                     break
             else:
@@ -744,16 +857,67 @@ class WS_DEVICE(BASE_WS_DEVICE):
             if self.buff.endswith(self.prompt):
                 if not self.ws_readable():
                     break
+        if isinstance(pipe, OutputPipeline):
+            pipe.flush()
         self.paste_cmd = ''
 
-    def is_reachable(self, n_tries=2, max_loss=1, debug=False, timeout=2, zt=False):
+    def _repl_ping(self, timeout=0.5):
+        # empty line round trip on the open connection, until prompt
+        self.flush()
+        t0 = time.perf_counter()
+        deadline = t0 + timeout
+        self.write('\r')
+        buff = b''
+        try:
+            while self.prompt not in buff:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self.ws.sock.settimeout(remaining)
+                fin, opcode, data = self.ws.read_frame()
+                buff += data
+        except (socket.timeout, wsprotocol.NoDataException, OSError):
+            return None
+        finally:
+            self.ws.sock.settimeout(None)
+            self.ws.reset_buffers()
+        return (time.perf_counter() - t0) * 1000
+
+    def ping(self, n_tries=1, timeout=0.5):
+        """
+        Reachability and latency (ms), through the open connection if
+        connected (REPL round trip) else TCP connect to WebREPL port.
+        """
+        if self.connected:
+            latencies = [self._repl_ping(timeout=timeout)
+                         for i in range(n_tries)]
+            return netscan.latency_summary(self.ip, self.port, latencies,
+                                           n_tries)
+        return netscan.tcp_ping(self.ip, self.port, timeout=timeout,
+                                n_tries=n_tries)
+
+    def is_reachable(self, n_tries=2, max_loss=1, debug=False, timeout=0.5,
+                     zt=False, latency=False):
         if zt:
-            ping_cmd_str = f'ssh {zt["fwd"]} ping -c {n_tries} {zt["dev"]} -t {timeout}'
+            return self._zt_is_reachable(zt, n_tries=n_tries,
+                                         max_loss=max_loss, debug=debug,
+                                         timeout=max(1, round(timeout)))
+        result = self.ping(n_tries=n_tries, timeout=timeout)
+        if debug:
+            print(result)
+        if latency:
+            return result
+        if not result['reachable'] or result['lost'] >= max_loss:
+            if debug:
+                print('DEVICE IS DOWN OR SIGNAL RSSI IS TOO LOW')
+            return False
         else:
-            if self.ip.endswith('.local'):
-                ping_cmd_str = 'ping -c {} {} '.format(n_tries, self.ip)
-            else:
-                ping_cmd_str = 'ping -c {} {} -t {}'.format(n_tries, self.ip, timeout)
+            return True
+
+    def _zt_is_reachable(self, zt, n_tries=2, max_loss=1, debug=False,
+                         timeout=2):
+        # ping through ssh forwarding host
+        ping_cmd_str = f'ssh {zt["fwd"]} ping -c {n_tries} {zt["dev"]} -t {timeout}'
         ping_cmd = shlex.split(ping_cmd_str)
         timeouts = 0
         down_kw = ['Unreachable', 'down', 'timeout', 'Unknown']
@@ -808,7 +972,48 @@ class WS_DEVICE(BASE_WS_DEVICE):
             except socket.timeout:
                 pass
 
+    def _repl_exec(self, cmd):
+        self.wr_cmd(cmd, silent=True, rtn=True)
+        return self.output
+
+    def _transfer(self, method, *args, **kargs):
+        disconnect_on_end = not self.connected
+        if not self.connected:
+            self.open_wconn(ssl=self._ssl, auth=True)
+        try:
+            return method(*args, **kargs)
+        finally:
+            self.flush()
+            if disconnect_on_end:
+                self.close_wconn()
+
+    def put(self, local, remote=None, verify=True, compress=None):
+        """Upload a file (WebREPL file protocol), returns TRANSFER"""
+        return self._transfer(self.filetransfer.put, local, remote,
+                              verify=verify, compress=compress)
+
+    def get(self, remote, local=None, verify=True, compress=None):
+        """Download a file (WebREPL file protocol), returns TRANSFER"""
+        return self._transfer(self.filetransfer.get, remote, local,
+                              verify=verify, compress=compress)
+
+    def sync(self, local_dir, remote_dir='', verify=True, exclude=(),
+             **kargs):
+        """
+        Upload changed files of a directory (block delta for large files),
+        see FileTransfer.sync, returns list of TRANSFER
+        """
+        return self._transfer(self.filetransfer.sync, local_dir, remote_dir,
+                              verify=verify, exclude=exclude, **kargs)
+
     def get_datalog(self, dvars=None, fs=None, time_out=None, units=None):
+        if self.dlog_capture is not None:
+            if dvars is None:
+                self.datalog = self.dlog_capture.rows()
+            else:
+                self.datalog = self.dlog_capture.as_dict(
+                    dvars=dvars, fs=fs, time_out=time_out, units=units)
+            return
         self.datalog = []
         self.output = None
         for line in self.data_buff.splitlines():
@@ -867,24 +1072,20 @@ class WS_DEVICE(BASE_WS_DEVICE):
 
     def cmd_nb(self, command, silent=False, rtn=True, long_string=False,
                rtn_resp=False, follow=False, pipe=None, multiline=False,
-               dlog=False, block_dev=True):
-        # do a
+               dlog=False, block_dev=True, timeout=None):
         if self.connected:
             if block_dev:
-                self.dev_process_raw = multiprocessing.Process(
-                    target=self.wr_cmd, args=(command, silent, rtn, long_string,
-                                              rtn_resp,
-                                              follow, pipe, multiline, dlog,
-                                              self.output_queue))
-                self.dev_process_raw.start()
+                return self.executor.submit(self.wr_cmd, command, silent, rtn,
+                                            long_string, rtn_resp, follow,
+                                            pipe, multiline, dlog,
+                                            timeout=timeout)
             else:
                 self.bytes_sent = self.write(command+'\r')
         else:
             if block_dev:
-                self.dev_process_raw = multiprocessing.Process(
-                    target=self.cmd, args=(command, silent, rtn, rtn_resp,
-                                           self.output_queue, long_string))
-                self.dev_process_raw.start()
+                return self.executor.submit(self.cmd, command, silent, rtn,
+                                            rtn_resp, long_string=long_string,
+                                            timeout=timeout)
             else:
                 self.open_wconn(ssl=self._ssl, auth=True)
                 self.bytes_sent = self.write(command+'\r')
@@ -892,10 +1093,10 @@ class WS_DEVICE(BASE_WS_DEVICE):
                 self.close_wconn()
 
     def get_opt(self):
-        try:
-            self.output = self.output_queue.get(block=False)
-        except Exception:
-            pass
+        nb_cmd = self.executor.pop_last()
+        if nb_cmd is not None and not nb_cmd.cancelled():
+            if nb_cmd.exception() is None:
+                self.output = nb_cmd.result()
 
     def get_RSSI(self):
         rssi_cmd = "import network;network.WLAN(network.STA_IF).status('rssi')"
@@ -906,13 +1107,17 @@ class WebSocketDevice(WS_DEVICE):
     def __init__(self, *args, **kargs):
         super().__init__(*args, **kargs)
 
+    def batch(self, max_calls=32):
+        return DeviceBatch(self, max_calls=max_calls)
+
     def code(self, func):
-        str_func = '\n'.join(getsource(func).split('\n')[1:])
-        self.paste_buff(str_func)
-        self.cmd('\x04', silent=True)
+        self.code_cache.define(func.__name__, code_source(func))
 
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
+            rpc = active_rpc(self)
+            if rpc is not None:
+                return rpc.call(func.__name__, *args, **kwargs)
             flags = ['>', '<', 'object', 'at', '0x']
             args_repr = [repr(a) for a in args if any(
                 f not in repr(a) for f in flags)]
@@ -926,9 +1131,7 @@ class WebSocketDevice(WS_DEVICE):
         return wrapper_cmd
 
     def code_follow(self, func):
-        str_func = '\n'.join(getsource(func).split('\n')[1:])
-        self.paste_buff(str_func)
-        self.cmd('\x04', silent=True)
+        self.code_cache.define(func.__name__, code_source(func))
 
         @functools.wraps(func)
         def wrapper_cmd(*args, **kwargs):
@@ -945,6 +1148,8 @@ class WebSocketDevice(WS_DEVICE):
         return wrapper_cmd
 
     def load(self, file):
+        if self.precompile.use() and self.precompile.load(file):
+            return
         with open(file, 'r') as upy_file:
             upy_content = upy_file.read()
         self.paste_buff(upy_content)
@@ -8,8 +8,15 @@ from machine import Pin, PWM
 import time
 import urandom
 from array import array
+from ustruct import pack_into, calcsize
+from micropython import const
 import socket
 
+# IRQ event frame header: magic, pin value, irq count, ticks_ms
+EVENT_HEADER = '!BBHI'
+EVENT_MAGIC = const(0xA5)
+EVENT_HEADER_SIZE = const(8)
+
 
 class U_IRQ_MG:
     def __init__(self, signal_pin, irq_pin, buzz_pin=None, led_pin=None,
@@ -34,6 +41,14 @@ class U_IRQ_MG:
         self.irq_timeout = timeout  # ms
         self.sensor_vals = array(p_format, (0 for _ in range(n_vars)))
         self.cli_soc = None
+        self.p_format = p_format
+        self.n_vars = n_vars
+        # preallocated event frame so the irq handler does not allocate
+        self.event_buff = bytearray(EVENT_HEADER_SIZE
+                                    + calcsize(p_format*n_vars))
+        self.event_debounce = 50  # ms
+        self.event_last = time.ticks_ms()
+        self.event_dropped = 0
 
     def reset_flag(self):
         self.irq_detflag = False
@@ -83,6 +98,40 @@ class U_IRQ_MG:
         self.cli_soc.close()
         self.irq_busy = False
 
+    # EVENT SUBSCRIPTION (push event frames through cli_soc)
+
+    def subscribe(self, trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, debounce=50):
+        self.event_debounce = debounce
+        self.event_dropped = 0
+        self.irq_detect = Pin(self.irq_pin, Pin.IN)
+        self.irq_detect.irq(trigger=trigger, handler=self.event_callback)
+
+    def unsubscribe(self):
+        if self.irq_detect is not None:
+            self.irq_detect.irq(handler=None)
+
+    def event_callback(self, x):
+        now = time.ticks_ms()
+        if self.irq_busy or time.ticks_diff(now, self.event_last) < self.event_debounce:
+            self.event_dropped += 1
+            return
+        try:
+            self.irq_busy = True
+            self.event_last = now
+            self.irq_count += 1
+            self.irq_detflag = True
+            if hasattr(self, 'read_data'):
+                self.sensor_vals[:] = self.read_data()
+            pack_into(EVENT_HEADER, self.event_buff, 0, EVENT_MAGIC,
+                      x.value(), self.irq_count & 0xFFFF, now)
+            pack_into(self.p_format*self.n_vars, self.event_buff,
+                      EVENT_HEADER_SIZE, *self.sensor_vals)
+            self.cli_soc.sendall(self.event_buff)
+            self.irq_busy = False
+        except Exception as e:
+            self.event_dropped += 1
+            self.irq_busy = False
+
     def buzz_beep(self, sleeptime, ntimes, ntimespaced, fq):
         self.buzz.freq(fq)
         for i in range(ntimes):
@@ -1,8 +1,15 @@
 from machine import Timer
 import usocket as socket
-from ustruct import pack
+from ustruct import pack, pack_into, calcsize
 from array import array
 from micropython import const
+import time
+
+# UDP datagram header: sequence number, device ticks_ms
+UDP_HEADER = '!II'
+UDP_HEADER_SIZE = const(8)
+# sequence numbers wrap around at the header field size
+UDP_SEQ_PERIOD = 1 << 32
 
 
 class U_STREAMER:
@@ -16,6 +23,11 @@ class U_STREAMER:
         self.index_put = 0
         self.p_format = p_format
         self.n_vars = n_vars
+        self.udp_soc = None
+        self.udp_addr = None
+        self.udp_seq = 0
+        self.udp_dropped = 0
+        self.udp_buff = None
 
     def connect_SOC(self, host, port):
         self.irq_busy = True
@@ -30,6 +42,27 @@ class U_STREAMER:
         self.cli_soc.close()
         self.irq_busy = False
 
+    def connect_UDP(self, host, port, chunk=False):
+        self.irq_busy = True
+        self.udp_soc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_addr = socket.getaddrinfo(host, port)[0][-1]
+        # preallocate datagram so irq callbacks do not allocate
+        if chunk:
+            self.udp_buff = bytearray(UDP_HEADER_SIZE
+                                      + calcsize(self.p_format*self.BUFFERSIZE))
+        else:
+            self.udp_buff = bytearray(UDP_HEADER_SIZE
+                                      + calcsize(self.p_format*self.n_vars))
+        self.udp_seq = 0
+        self.udp_dropped = 0
+        self.irq_busy = False
+
+    def disconnect_UDP(self):
+        self.irq_busy = True
+        self.udp_soc.close()
+        self.udp_soc = None
+        self.irq_busy = False
+
 
 # stream through socket
     def sample_send(self):
@@ -69,6 +102,56 @@ class U_STREAMER:
         except Exception as e:
             self.irq_busy = False
 
+# stream through udp (seq + timestamp header)
+# udp_seq only advances for packets sent, so gaps on the host are network
+# loss; samples dropped on the device (irq busy, errors) are counted in
+# udp_dropped
+    def udp_sample_send_call(self, x):
+        if self.irq_busy:
+            self.udp_dropped += 1
+            return
+        try:
+            self.irq_busy = True
+            pack_into(UDP_HEADER, self.udp_buff, 0, self.udp_seq,
+                      time.ticks_ms())
+            pack_into(self.p_format*self.n_vars, self.udp_buff,
+                      UDP_HEADER_SIZE, *self.read_method())
+            self.udp_soc.sendto(self.udp_buff, self.udp_addr)
+            self.udp_seq = (self.udp_seq + 1) % UDP_SEQ_PERIOD
+            self.irq_busy = False
+        except Exception as e:
+            self.udp_dropped += 1
+            self.irq_busy = False
+
+    def udp_chunk_send_call(self, x):
+        if self.irq_busy:
+            self.udp_dropped += 1
+            return
+        n_samples = 1
+        try:
+            self.irq_busy = True
+            if self.index_put < self.BUFFERSIZE:
+                self.chunk_buffer[self.index_put] = self.read_method()[0]
+                self.index_put += 1
+            elif self.index_put == self.BUFFERSIZE:
+                # the chunk is lost if it can not be sent
+                n_samples = self.BUFFERSIZE
+                pack_into(UDP_HEADER, self.udp_buff, 0, self.udp_seq,
+                          time.ticks_ms())
+                pack_into(self.p_format*self.BUFFERSIZE, self.udp_buff,
+                          UDP_HEADER_SIZE, *self.chunk_buffer)
+                self.index_put = 0
+                self.udp_soc.sendto(self.udp_buff, self.udp_addr)
+                self.udp_seq = (self.udp_seq + 1) % UDP_SEQ_PERIOD
+            self.irq_busy = False
+        except Exception as e:
+            self.udp_dropped += n_samples
+            self.index_put = 0
+            self.irq_busy = False
+
+    def udp_stats(self):
+        return [self.udp_seq, self.udp_dropped]
+
     def start_send(self, sampling_callback, timeout=100, on_init=None):
         self.irq_busy = False
         if on_init is not None: